@@ -162,10 +162,11 @@ def VDH_plot(SS, prefix, file_ext='pdf', xlabel='', xscale='linear', yscale='log
              alpha=0.5, pre_label='', post_label='', pre_model_label='',
              post_model_label='', pre_color='orange', post_color='blue',
              pre_model_color='purple', post_model_color='green',
-             font_size='medium', backend=None):
+             font_size='medium', backend=None, chunk_size=None):
 
     """Plots a histogram of the amplitudes of the visibility differences that
-    result from sky subtraction.
+    result from sky subtraction. The histograms and models are accumulated in
+    a single pass over the data with VDH objects.
 
     Args:
         SS (SS): An SS object whose data to plot *Required*
@@ -174,7 +175,8 @@ def VDH_plot(SS, prefix, file_ext='pdf', xlabel='', xscale='linear', yscale='log
         xlabel (str): The label for the horizontal axis of the histogram
         xscale ('linear' or 'log'): The scale of the horizontal axis
         yscale ('linear' or 'log'): The scale of the vertical axis
-        bins: See numpy.histogram() documentation
+        bins: See numpy.histogram() documentation. Bin edges are used as they
+            are, while other choices need the amplitudes in memory to find edges.
         legend (bool): Whether or not to display a legend
         ylim: Set the limits for the vertical axis
         density (bool): Report a probability density instead of counts
@@ -194,11 +196,14 @@ def VDH_plot(SS, prefix, file_ext='pdf', xlabel='', xscale='linear', yscale='log
         post_model_color (str): The color of the post-flag model
         font_size (str): The font size for all labels
         backend (str): Which matplotlib backend to use.
+        chunk_size (int): The number of baseline-times to take the amplitudes
+            of at once. If None, do all of them at once.
     """
     from matplotlib import use
     if backend is not None:
         use(backend)
     import matplotlib.pyplot as plt
+    from SSINS.sky_subtract import VDH
 
     outdir = prefix[:prefix.rfind('/')]
 
@@ -207,39 +212,41 @@ def VDH_plot(SS, prefix, file_ext='pdf', xlabel='', xscale='linear', yscale='log
 
     fig, ax = plt.subplots()
 
-    if post_flag:
-        if SS.flag_choice is None:
-            warnings.warn("Asking to plot post-flagging data, but SS.flag_choice is None. This is identical to plotting pre-flagging data")
-        if post_model:
-            model_func = SS.mixture_prob
-        else:
-            model_func = None
-        hist_plot(fig, ax, np.abs(SS.data_array[np.logical_not(SS.data_array.mask)]),
-                  bins=bins, legend=legend, model_func=model_func,
-                  yscale=yscale, ylim=ylim, density=density, label=post_label,
-                  xlabel=xlabel, error_sig=error_sig, alpha=alpha,
-                  model_label=post_model_label, color=post_color,
-                  model_color=post_model_color, font_size=font_size)
-    if pre_flag:
-        if pre_model:
-            model_func = SS.mixture_prob
-        else:
-            model_func = None
-        if SS.flag_choice is not 'original':
-            temp_flags = np.copy(SS.data_array.mask)
-            temp_choice = '%s' % SS.flag_choice
-        else:
-            temp_choice = 'original'
-        SS.apply_flags(flag_choice=None)
-        hist_plot(fig, ax, np.abs(SS.data_array).flatten(), bins=bins,
-                  legend=legend, model_func=model_func, yscale=yscale,
-                  ylim=ylim, density=density, label=pre_label, alpha=alpha,
-                  xlabel=xlabel, error_sig=error_sig, model_label=pre_model_label,
-                  color=pre_color, model_color=pre_model_color, font_size=font_size)
-        if temp_choice is 'original':
-            SS.apply_flags(flag_choice='original')
-        else:
-            SS.apply_flags(flag_choice='custom', custom=temp_flags)
-            SS.flag_choice = temp_choice
+    if post_flag and (SS.flag_choice is None):
+        warnings.warn("Asking to plot post-flagging data, but SS.flag_choice is None. This is identical to plotting pre-flagging data")
+    if chunk_size is None:
+        chunk_size = SS.Nblts
+    mask = SS._get_mask()
+
+    if isinstance(bins, str) or np.ndim(bins) == 0:
+        amp = np.absolute(SS.data_array.data)
+        post_bins = np.histogram_bin_edges(amp[np.logical_not(mask)], bins=bins)
+        pre_bins = np.histogram_bin_edges(amp, bins=bins)
+        del amp
+    else:
+        post_bins = pre_bins = bins
+    post_vdh = VDH(post_bins, SS.Nfreqs)
+    pre_vdh = VDH(pre_bins, SS.Nfreqs)
+    for blt_ind in range(0, SS.Nblts, chunk_size):
+        blt_slice = slice(blt_ind, blt_ind + chunk_size)
+        amp = np.absolute(SS.data_array.data[blt_slice])
+        if post_flag:
+            post_vdh.accumulate(amp, mask=mask[blt_slice])
+        if pre_flag:
+            pre_vdh.accumulate(amp)
+
+    for vdh, plot_vdh, model, label, model_label, color, model_color in [
+            (post_vdh, post_flag, post_model, post_label, post_model_label, post_color, post_model_color),
+            (pre_vdh, pre_flag, pre_model, pre_label, pre_model_label, pre_color, pre_model_color)]:
+        if plot_vdh:
+            if model:
+                model_func = vdh.mixture_prob
+            else:
+                model_func = None
+            hist_plot(fig, ax, None, bins=vdh.bins, counts=np.sum(vdh.counts, axis=0),
+                      legend=legend, model_func=model_func, yscale=yscale,
+                      ylim=ylim, density=density, label=label, alpha=alpha,
+                      xlabel=xlabel, error_sig=error_sig, model_label=model_label,
+                      color=color, model_color=model_color, font_size=font_size)
 
     fig.savefig('%s_VDH.%s' % (prefix, file_ext), bbox_inches="tight")
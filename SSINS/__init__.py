@@ -8,10 +8,39 @@ import warnings
 warnings.filterwarnings("ignore", message="numpy.dtype size changed")
 warnings.filterwarnings("ignore", message="numpy.ufunc size changed")
 
+import importlib
 from . import version
-from .incoherent_noise_spectrum import *
-from .plot_lib import *
-from .match_filter import *
-from .sky_subtract import *
 
 __version__ = version.version
+
+# The submodules are only imported when something from them is first used (see
+# PEP 562), so that e.g. using MF does not import pyuvdata.
+_submodules = ['incoherent_noise_spectrum', 'plot_lib', 'match_filter',
+               'sky_subtract', 'util', 'Catalog_Plot', 'data']
+_attr_to_submodule = {'INS': 'incoherent_noise_spectrum',
+                      'image_plot': 'plot_lib',
+                      'set_ticks_labels': 'plot_lib',
+                      'hist_plot': 'plot_lib',
+                      'MF': 'match_filter',
+                      'Event': 'match_filter',
+                      'PackedMask': 'sky_subtract',
+                      'SS': 'sky_subtract',
+                      'VDH': 'sky_subtract'}
+
+__all__ = ['version'] + list(_attr_to_submodule)
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module('.' + name, __name__)
+    if name in _attr_to_submodule:
+        module = importlib.import_module('.' + _attr_to_submodule[name], __name__)
+        attr = getattr(module, name)
+        # Cache it so that __getattr__ is skipped next time
+        globals()[name] = attr
+        return attr
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_submodules) | set(_attr_to_submodule))
@@ -4,13 +4,405 @@ The incoherent noise spectrum class.
 
 import numpy as np
 import os
-from pyuvdata import UVFlag
-import yaml
+from pyuvdata import UVData, UVFlag
 from SSINS import version
-from functools import reduce
+from functools import partial
+from copy import copy, deepcopy
 import warnings
 from itertools import combinations
 from SSINS.match_filter import Event
+from SSINS.sky_subtract import SS, PackedMask
+
+
+def _waterfall_sums(ss, time_array, spectrum_type='cross',
+                    use_integration_weights=False, nsample_default=1,
+                    chunk_size=1000, dtype=np.float64):
+    """
+    Reduces the (masked) visibilities of an SS object to sums over baselines
+    at each time, which is everything needed to build an INS waterfall. Sums
+    from different sets of baselines of the same observation can simply be added.
+    Follows the conventions of UVFlag.to_waterfall(method='mean'), i.e. infinite
+    amplitudes get zero weight.
+
+    Args:
+        ss: The SS object to reduce. Its data_array is masked with apply_flags()
+            if it is not already a masked array. A packed mask is unpacked one
+            chunk at a time.
+        time_array: The times of the waterfall. Every time in ss must be present.
+        spectrum_type: 'cross' or 'auto'. Only blts of this type are included.
+        use_integration_weights: Whether to weight by integration time and nsample
+        nsample_default: The value to give nsamples that are 0 if
+            use_integration_weights is True.
+        chunk_size (int): The number of blts to reduce at a time, which bounds
+            the temporary arrays to a few times the size of the chunk. If
+            None, reduce all of them at once.
+        dtype: The floating point type of the per-visibility amplitudes and
+            weights, and of the sum over baselines within each chunk. The
+            sums of the chunks are always accumulated in float64. This only
+            affects the chunk buffers, not ss.data_array.
+
+    Returns:
+        metric_sum: The weighted sum of amplitudes, shape (Ntimes, Nfreqs, Npols)
+        weights_sum: The sum of the weights, same shape
+        weights_square_sum: The sum of the squared weights, same shape
+    """
+    import scipy.sparse
+
+    if not isinstance(ss.data_array, np.ma.MaskedArray):
+        ss.apply_flags()
+
+    if spectrum_type == 'cross':
+        blt_inds = np.where(ss.ant_1_array != ss.ant_2_array)[0]
+    else:
+        blt_inds = np.where(ss.ant_1_array == ss.ant_2_array)[0]
+
+    time_inds = np.searchsorted(time_array, ss.time_array[blt_inds])
+    time_inds = np.minimum(time_inds, len(time_array) - 1)
+    if not np.all(time_array[time_inds] == ss.time_array[blt_inds]):
+        raise ValueError("SS object has times that are not in the waterfall time_array.")
+
+    shape = (len(time_array), ) + ss.data_array.shape[2:]
+    metric_sum = np.zeros(shape)
+    weights_sum = np.zeros(shape)
+    weights_square_sum = np.zeros(shape)
+    if chunk_size is None:
+        chunk_size = max(len(blt_inds), 1)
+
+    # Reused for every chunk, so that only a few chunk-sized arrays ever exist
+    buf_shape = (min(chunk_size, len(blt_inds)), ) + ss.data_array.shape[2:]
+    amp_buf = np.empty(buf_shape, dtype=dtype)
+    weights_buf = np.empty(buf_shape, dtype=dtype)
+    prod_buf = np.empty(buf_shape, dtype=dtype)
+    for chunk_start in range(0, len(blt_inds), chunk_size):
+        chunk_inds = blt_inds[chunk_start:chunk_start + chunk_size]
+        chunk_time_inds = time_inds[chunk_start:chunk_start + chunk_size]
+        Nchunk = len(chunk_inds)
+        # Slicing makes views rather than copies when the blts are contiguous
+        if chunk_inds[-1] - chunk_inds[0] + 1 == Nchunk:
+            chunk_sel = slice(chunk_inds[0], chunk_inds[-1] + 1)
+        else:
+            chunk_sel = chunk_inds
+        chunk_data = ss.data_array[chunk_sel, 0]
+        if ss.packed_mask is None:
+            chunk_mask = np.ma.getmaskarray(chunk_data)
+        else:
+            chunk_mask = ss.packed_mask.unpack(chunk_sel)[:, 0]
+
+        amp = amp_buf[:Nchunk]
+        weights = weights_buf[:Nchunk]
+        prod = prod_buf[:Nchunk]
+        np.absolute(np.ma.getdata(chunk_data), out=amp)
+        np.copyto(amp, 0, where=chunk_mask)
+        np.logical_not(chunk_mask, out=weights)
+        if use_integration_weights:
+            prod[:] = ss.nsample_array[chunk_sel, 0]
+            np.copyto(prod, nsample_default, where=prod == 0)
+            weights *= prod
+            weights *= ss.integration_time[chunk_sel, np.newaxis, np.newaxis].astype(dtype)
+        inf_amp = np.isinf(amp)
+        weights[inf_amp] = 0
+        amp[inf_amp] = 0
+
+        # Summing over baselines for each time is a product with a sparse matrix
+        # that maps each blt to its time. The map has the chunk's dtype so that
+        # the chunk is not upcast, and the small products are added to the
+        # float64 sums.
+        time_map = scipy.sparse.csr_matrix((np.ones(Nchunk, dtype=dtype), (chunk_time_inds, np.arange(Nchunk))),
+                                           shape=(len(time_array), Nchunk))
+        flat_shape = (Nchunk, -1)
+        np.multiply(weights, amp, out=prod)
+        metric_sum += (time_map @ prod.reshape(flat_shape)).reshape(shape)
+        weights_sum += (time_map @ weights.reshape(flat_shape)).reshape(shape)
+        np.multiply(weights, weights, out=prod)
+        weights_square_sum += (time_map @ prod.reshape(flat_shape)).reshape(shape)
+
+    return(metric_sum, weights_sum, weights_square_sum)
+
+
+def _sums_to_metric(metric_sum, weights_sum):
+    """
+    Divides the output of _waterfall_sums into the baseline-averaged amplitudes,
+    following the convention of UVFlag.to_waterfall for samples with no weight.
+
+    Args:
+        metric_sum: The weighted sum of amplitudes
+        weights_sum: The sum of the weights
+
+    Returns:
+        metric_array: The average amplitudes, masked where weights_sum is 0
+    """
+    has_weight = weights_sum > 1e-10
+    metric_array = np.full(metric_sum.shape, np.inf)
+    np.true_divide(metric_sum, weights_sum, out=metric_array, where=has_weight)
+    metric_array = np.ma.masked_array(metric_array, mask=weights_sum == 0)
+
+    return(metric_array)
+
+
+def _batch_polyfit(x, y, w, deg):
+    """
+    Weighted least-squares polynomial fits of every column of y at once.
+    Equivalent to np.ma.polyfit(x, y[:, col], deg, w=w[:, col]) for each column,
+    including the column scaling and singular value cutoff used by np.polyfit.
+
+    Args:
+        x: The sample points, length N
+        y: A masked array of shape (N, Ncols). Masked samples are left out of the fits.
+        w: The weights of shape (N, Ncols). As in np.polyfit, these multiply
+            the residuals, not their squares.
+        deg: The degree of the polynomials
+
+    Returns:
+        coeffs: The polynomial coefficients, highest power first, of shape (deg + 1, Ncols)
+    """
+    unmasked = np.logical_not(np.ma.getmaskarray(y))
+    w = np.where(unmasked, w, 0)
+    y = np.ma.filled(y, fill_value=0)
+
+    # Weighted Vandermonde matrix of each column, shape (Ncols, N, deg + 1)
+    lhs = np.vander(np.asarray(x, dtype=float), deg + 1)[np.newaxis] * w.T[:, :, np.newaxis]
+    rhs = (y * w).T
+    scale = np.sqrt(np.sum(lhs**2, axis=1))
+    scale[scale == 0] = 1
+    lhs /= scale[:, np.newaxis, :]
+
+    # np.polyfit's cutoff, which only counts the unmasked samples
+    rcond = np.count_nonzero(unmasked, axis=0) * np.finfo(float).eps
+    coeffs = np.matmul(np.linalg.pinv(lhs, rcond=rcond), rhs[:, :, np.newaxis])[:, :, 0]
+    coeffs = (coeffs / scale).T
+
+    return(coeffs)
+
+
+def _read_chunk_sums(shell_cls, filenames, bls, diff=True, flag_choice=None,
+                     history='', label='', spectrum_type='cross',
+                     use_integration_weights=False, nsample_default=1,
+                     dtype=np.float64, diff_chunk_size=None, read_kwargs=None):
+    """
+    Reads a set of baselines into an SS object and reduces it with
+    _waterfall_sums. Module level so that it can be run in worker processes.
+
+    Args:
+        shell_cls: If not None, the class (INS or a subclass) of an object to
+            return that holds the waterfall metadata of the chunk. Its arrays
+            are placeholders.
+        filenames: The visibility file(s) to read
+        bls: The antenna pairs to read
+        diff, flag_choice, diff_chunk_size: Passed to SS.read
+        history, label: Passed to UVFlag.__init__ for the shell object
+        spectrum_type, use_integration_weights, nsample_default, dtype: Passed to _waterfall_sums
+        read_kwargs: Additional keywords passed to SS.read
+
+    Returns:
+        shell: The waterfall metadata object, or None if shell_cls is None
+        time_array: The waterfall times of the chunk
+        sums: The output of _waterfall_sums
+    """
+    if read_kwargs is None:
+        read_kwargs = {}
+    ss = SS()
+    ss.read(filenames, bls=bls, diff=diff, flag_choice=flag_choice,
+            diff_chunk_size=diff_chunk_size, **read_kwargs)
+    time_array = np.unique(ss.time_array)
+    if shell_cls is None:
+        shell = None
+    else:
+        shell = shell_cls.__new__(shell_cls)
+        UVFlag.__init__(shell, ss, mode='metric', copy_flags=False,
+                        waterfall=True, history=history, label=label)
+    sums = _waterfall_sums(ss, time_array, spectrum_type=spectrum_type,
+                           use_integration_weights=use_integration_weights,
+                           nsample_default=nsample_default, dtype=dtype)
+
+    return(shell, time_array, sums)
+
+
+def _merge_chunk_sums(chunk_results):
+    """
+    Adds up the outputs of _read_chunk_sums into the metadata object of the
+    first chunk.
+
+    Args:
+        chunk_results: An iterable of outputs from _read_chunk_sums, the first
+            of which holds the waterfall metadata.
+
+    Returns:
+        shell: The metadata object of the first chunk, whose metric_array,
+            weights_array and weights_square_array hold the summed weighted
+            amplitudes, weights and squared weights.
+    """
+    for chunk_ind, (chunk_shell, time_array, sums) in enumerate(chunk_results):
+        if chunk_ind == 0:
+            shell = chunk_shell
+            if np.any(shell.polarization_array > 0):
+                raise ValueError("SS input has pseudo-Stokes data. SSINS does not"
+                                 " currently support pseudo-Stokes spectra.")
+            shell.metric_array, shell.weights_array, shell.weights_square_array = sums
+        else:
+            if not np.array_equal(time_array, shell.time_array):
+                raise ValueError("The baseline chunks do not have matching time arrays.")
+            shell.metric_array += sums[0]
+            shell.weights_array += sums[1]
+            shell.weights_square_array += sums[2]
+
+    return(shell)
+
+
+_EVENT_DTYPE = np.dtype([('t_start', np.int64), ('t_stop', np.int64),
+                         ('f_start', np.int64), ('f_stop', np.int64),
+                         ('shape_id', np.int32), ('sig', np.float64)])
+"""The columns of a table of match events. Shapes are stored as indices into a list of shape names."""
+
+
+def _events_to_array(match_events):
+    """
+    Packs a list of match events into a structured array with columns given
+    by _EVENT_DTYPE.
+
+    Args:
+        match_events: A list of Event namedtuples
+
+    Returns:
+        event_array: The structured array of events. Events without a
+            significance have a sig of nan.
+        shape_names: The shape names, in order of first appearance
+    """
+    # Events are unpacked by position rather than by name so that plain tuples work too
+    shape_ids = {}
+    rows = [(time_slice.start, time_slice.stop, freq_slice.start, freq_slice.stop,
+             shape_ids.setdefault(shape, len(shape_ids)), np.nan if sig is None else sig)
+            for time_slice, freq_slice, shape, sig in match_events]
+    event_array = np.array(rows, dtype=_EVENT_DTYPE)
+    shape_names = list(shape_ids)
+
+    return(event_array, shape_names)
+
+
+def _array_to_events(event_array, shape_names):
+    """
+    Unpacks a structured array made by _events_to_array into a list of match events.
+
+    Args:
+        event_array: The structured array of events
+        shape_names: The shape names that the shape_id column indexes
+
+    Returns:
+        match_events: A list of Event namedtuples
+    """
+    match_events = [Event(slice(int(t_start), int(t_stop)), slice(int(f_start), int(f_stop)),
+                          shape_names[shape_id], None if np.isnan(sig) else float(sig))
+                    for t_start, t_stop, f_start, f_stop, shape_id, sig in event_array.tolist()]
+
+    return(match_events)
+
+
+def _write_events(group, match_events):
+    """
+    Writes match events to an h5 group as a dataset called match_events,
+    holding the output of _events_to_array, with the shape names as an attribute.
+    """
+    import h5py
+    event_array, shape_names = _events_to_array(match_events)
+    events = group.create_dataset('match_events', data=event_array)
+    events.attrs.create('shape_names', shape_names, dtype=h5py.string_dtype())
+
+
+def _read_events(group, as_array=False):
+    """
+    Reads the match events written to an h5 group by _write_events.
+
+    Args:
+        group: The h5 group
+        as_array: If True, return the structured array and shape names instead
+            of a list of Events.
+
+    Returns:
+        match_events: A list of Events, or (event_array, shape_names) if as_array
+    """
+    events = group['match_events']
+    event_array = events[()]
+    shape_names = [str(shape) for shape in events.attrs['shape_names']]
+    if as_array:
+        return(event_array, shape_names)
+    else:
+        return(_array_to_events(event_array, shape_names))
+
+
+def _write_mwaf_box(path, chan_ind, filename, flags, mwaf_method='add', Ncoarse=24,
+                    clobber=False, ssins_version=''):
+    """
+    Writes the flags for one coarse channel box into a copy of its mwaf file.
+    The flags are broadcast over scans, fine channels and baselines straight
+    into the flag column of the file, so the replicated flags are never made.
+    Module level so that boxes can be written in worker threads.
+
+    Args:
+        path: The mwaf file of the box
+        chan_ind: The index of the coarse channel of the box in the INS
+        filename: The mwaf file to write
+        flags: The (Ntimes, Nfreqs) flags of the whole INS
+        mwaf_method ('add' or 'replace'): See INS.write
+        Ncoarse: The number of coarse channels in the INS
+        clobber: Whether to overwrite filename if it exists
+        ssins_version: The SSINS version string for the SSINSVER header keyword
+    """
+    from astropy.io import fits
+    with fits.open(path) as mwaf_hdu:
+        NCHANS = mwaf_hdu[0].header['NCHANS']
+        NSCANS = mwaf_hdu[0].header['NSCANS']
+        # Check that freq res and time res are compatible
+        freq_mod = NCHANS % (flags.shape[1] / Ncoarse)
+        time_mod = NSCANS % flags.shape[0]
+        assert freq_mod == 0, "Number of fine channels of mwaf input and INS are incompatible."
+        assert time_mod == 0, "Time axes of mwaf input and INS flags are incompatible."
+        box_chans = flags.shape[1] // Ncoarse
+        freq_div = NCHANS // box_chans
+        time_div = NSCANS // flags.shape[0]
+        Nant = mwaf_hdu[0].header['NANTENNA']
+        Nbls = Nant * (Nant + 1) // 2
+
+        # The rows are ordered by scan, then baseline (see the MWA wiki)
+        box_flags = flags[:, box_chans * chan_ind: box_chans * (chan_ind + 1)]
+        box_flags = box_flags[:, np.newaxis, np.newaxis, :, np.newaxis]
+        mwaf_flags = mwaf_hdu[1].data['FLAGS']
+        flag_blocks = mwaf_flags.reshape((flags.shape[0], time_div, Nbls, box_chans, freq_div))
+        if mwaf_method == 'add':
+            flag_blocks |= box_flags
+        else:
+            flag_blocks[:] = box_flags
+        # A no-op copy if the reshape was a view
+        mwaf_hdu[1].data['FLAGS'] = flag_blocks.reshape(mwaf_flags.shape)
+
+        mwaf_hdu[0].header['SSINSVER'] = ssins_version
+        mwaf_hdu.writeto(filename, overwrite=clobber)
+
+
+def _read_bundle_extras(filename):
+    """
+    Reads everything that a file written by INS.write with output_type='bundle'
+    holds besides what UVFlag reads, opening the file only once.
+
+    Args:
+        filename: The path to the file
+
+    Returns:
+        extras: A dict of the mask, metric_ms, ms_mask, sig_array, sig_mask
+            and match_events in the bundle, or None if the file is not a bundle
+    """
+    import h5py
+    try:
+        infile = h5py.File(filename, 'r')
+    except OSError:
+        return(None)
+    with infile:
+        if 'Data/match_events' not in infile:
+            return(None)
+        data_group = infile['Data']
+        extras = {name: data_group[name][()]
+                  for name in ['mask', 'metric_ms', 'ms_mask', 'sig_array', 'sig_mask']}
+        extras['match_events'] = _read_events(data_group)
+
+    return(extras)
 
 
 class INS(UVFlag):
@@ -21,7 +413,8 @@ class INS(UVFlag):
 
     def __init__(self, input, history='', label='', order=0, mask_file=None,
                  match_events_file=None, spectrum_type="cross",
-                 use_integration_weights=False, nsample_default=1):
+                 use_integration_weights=False, nsample_default=1,
+                 chunk_size=1000, dtype=np.float64):
 
         """
         init function for the INS class.
@@ -32,7 +425,7 @@ class INS(UVFlag):
             label: See UVFlag documentation
             order: Sets the order parameter for the INS object
             mask_file: A path to an .h5 (UVFlag) file that contains a mask for the metric_array
-            match_events_file: A path to a .yml file that has events caught by the match filter
+            match_events_file: A path to a .yml or .h5 file that has events caught by the match filter
             spectrum_type: Type of visibilities to use in making the specturm. Options are 'auto' or 'cross'.
             use_integration_weights: Whether to use the integration time and nsample array to compute the weights
             nsample_default: The default nsample value to fill zeros in the
@@ -40,13 +433,28 @@ class INS(UVFlag):
                 working with data from uvfits files, which combine information
                 from the flag_array and nsample_array in the weights field of
                 the uvfits file.
+            chunk_size: The number of blts to reduce at a time when input is
+                visibility data, which bounds the extra memory used. If None,
+                reduce all of them at once.
+            dtype: The floating point type of the per-visibility amplitudes and
+                weights when input is visibility data. np.float32 halves the
+                memory and bandwidth of the reduction for complex64 data. Each
+                chunk of blts is summed in this type, but the spectrum is
+                always float64. Only the reduction is affected: the
+                visibilities, and their differencing in SS.diff, keep their
+                own precision. See benchmarks/bench_precision.py.
         """
 
+        # Visibilities are reduced straight into a waterfall below, so never
+        # make the full-size baseline arrays
+        from_vis = isinstance(input, UVData)
         super().__init__(input, mode='metric', copy_flags=False,
-                         waterfall=False, history='', label='')
+                         waterfall=from_vis, history='', label='')
 
         # Used in _data_params to determine when not to return None
         self._super_complete = True
+        self.packed_masks = None
+        """The masks of metric_array, metric_ms and sig_array as PackedMask objects while they are packed with pack_masks"""
 
         if np.any(self.polarization_array > 0):
             raise ValueError("SS input has pseudo-Stokes data. SSINS does not"
@@ -62,25 +470,15 @@ class INS(UVFlag):
         self.order = order
         """The order of polynomial fit for each frequency channel during mean-subtraction. Default is 0, which just calculates the mean."""
 
-        if self.type == 'baseline':
+        if from_vis:
 
             self.history += spec_type_str
             # Check if the data has a mask yet. If not, mask it and set flag_choice to None.
             if not isinstance(input.data_array, np.ma.MaskedArray):
                 input.apply_flags()
 
-            self.metric_array = np.abs(input.data_array)
-            """The baseline-averaged sky-subtracted visibility amplitudes (numpy masked array)"""
-            self.weights_array = np.logical_not(input.data_array.mask).astype(float)
-            """The number of baselines that contributed to each element of the metric_array"""
-            if use_integration_weights:
-                # Set nsample default if some are zero
-                input.nsample_array[input.nsample_array == 0] = nsample_default
-                # broadcast problems with single pol
-                self.weights_array *= (input.integration_time[:, np.newaxis, np.newaxis, np.newaxis] * input.nsample_array)
-
-            cross_bool = self.ant_1_array != self.ant_2_array
-            auto_bool = self.ant_1_array == self.ant_2_array
+            cross_bool = input.ant_1_array != input.ant_2_array
+            auto_bool = input.ant_1_array == input.ant_2_array
 
             if self.spectrum_type == "cross":
 
@@ -92,7 +490,6 @@ class INS(UVFlag):
                 has_autos = np.any(auto_bool)
                 if has_autos:
                     warnings.warn("Requested spectrum type is 'cross'. Removing autos before averaging.")
-                    self.select(ant_str="cross")
 
             elif self.spectrum_type == "auto":
                 has_autos = np.any(auto_bool)
@@ -104,9 +501,18 @@ class INS(UVFlag):
                 if has_crosses:
                     warnings.warn("Requested spectrum type is 'auto'. Removing"
                                   " crosses before averaging.")
-                    self.select(ant_str="auto")
 
-            super().to_waterfall(method='mean', return_weights_square=True)
+            # The other type of baseline is skipped by index rather than selected out
+            metric_sum, weights_sum, weights_square_sum = _waterfall_sums(
+                input, self.time_array, spectrum_type=self.spectrum_type,
+                use_integration_weights=use_integration_weights,
+                nsample_default=nsample_default, chunk_size=chunk_size,
+                dtype=dtype)
+            self.metric_array = _sums_to_metric(metric_sum, weights_sum)
+            """The baseline-averaged sky-subtracted visibility amplitudes (numpy masked array)"""
+            self.weights_array = weights_sum
+            """The number of baselines that contributed to each element of the metric_array"""
+            self.weights_square_array = weights_square_sum
         # Make sure the right type of spectrum is being used, otherwise raise errors.
         # If neither statement inside is true, then it is an old spectrum and is therefore a cross-only spectrum.
         elif spec_type_str not in self.history:
@@ -118,9 +524,14 @@ class INS(UVFlag):
                                  " spectrum_type for INS initialization.")
         if not hasattr(self.metric_array, 'mask'):
             self.metric_array = np.ma.masked_array(self.metric_array)
+        # Bundles also hold the mask, z-scores, significances and events
+        bundle = _read_bundle_extras(input) if isinstance(input, str) else None
         if mask_file is None:
-            # Only mask elements initially if no baselines contributed
-            self.metric_array.mask = self.weights_array == 0
+            if bundle is not None:
+                self.metric_array.mask = bundle['mask']
+            else:
+                # Only mask elements initially if no baselines contributed
+                self.metric_array.mask = self.weights_array == 0
         else:
             # Read in the flag array
             flag_uvf = UVFlag(mask_file)
@@ -130,6 +541,8 @@ class INS(UVFlag):
         if match_events_file is None:
             self.match_events = []
             """A list of tuples that contain information about events caught during match filtering"""
+            if bundle is not None:
+                self.match_events = bundle['match_events']
         else:
             self.match_events = self.match_events_read(match_events_file)
 
@@ -137,12 +550,105 @@ class INS(UVFlag):
         # Works because weights are all 1 or 0 before this feature was added
         if self.weights_square_array is None:
             self.weights_square_array = np.copy(self.weights_array)
-        self.metric_ms = self.mean_subtract()
+        # The z-scores of a bundle only match its own mask
+        if (bundle is not None) and (mask_file is None):
+            self.metric_ms = np.ma.masked_array(bundle['metric_ms'], mask=bundle['ms_mask'])
+        else:
+            self.metric_ms = self.mean_subtract()
         """An array containing the z-scores of the data in the incoherent noise spectrum."""
-        self.sig_array = np.ma.copy(self.metric_ms)
+        if bundle is not None:
+            self.sig_array = np.ma.masked_array(bundle['sig_array'], mask=bundle['sig_mask'])
+        else:
+            self.sig_array = np.ma.copy(self.metric_ms)
         """An array that is initially equal to the z-score of each data point. During flagging,
         the entries are assigned according to their z-score at the time of their flagging."""
 
+    @classmethod
+    def from_files(cls, filenames, chunk_bls=None, diff=True, flag_choice=None,
+                   history='', label='', order=0, spectrum_type='cross',
+                   use_integration_weights=False, nsample_default=1,
+                   num_workers=1, dtype=np.float64, diff_chunk_size=None,
+                   **read_kwargs):
+        """
+        Builds an INS from visibility files by reading chunk_bls baselines at a
+        time. Each chunk is reduced to running sums of the weighted amplitudes,
+        weights, and squared weights, so memory scales with the chunk rather
+        than the observation. The mean-subtracted spectrum is calculated once
+        at the end. Chunks can be read and reduced in parallel processes, in
+        which case each process only sends back the sums for its chunk.
+
+        Args:
+            filenames (str or list of str): The visibility file(s) to read
+            chunk_bls (int): The number of baselines to read at a time. If None,
+                read all baselines at once.
+            diff (bool): Whether to difference the visibilities in time on read
+            flag_choice (None or 'original'): Passed to SS.read for each chunk.
+            history: See INS.__init__
+            label: See INS.__init__
+            order: See INS.__init__
+            spectrum_type: See INS.__init__
+            use_integration_weights: See INS.__init__
+            nsample_default: See INS.__init__
+            num_workers (int): The number of processes to read and reduce chunks
+                with. If 1, everything is done in this process.
+            dtype: See INS.__init__. For uvh5 files, also pass
+                data_array_dtype=np.complex64 to read the visibilities in
+                single precision.
+            diff_chunk_size (int): Passed to SS.read for each chunk, to bound
+                the extra memory used when differencing.
+            read_kwargs: Additional keywords passed to SS.read for each chunk.
+
+        Returns:
+            ins: The INS made from all the baselines in the files.
+        """
+        if spectrum_type not in ['cross', 'auto']:
+            raise ValueError("Requested spectrum_type is invalid. Choose 'cross' or 'auto'.")
+        if flag_choice not in [None, 'original']:
+            raise ValueError("flag_choice must be None or 'original' when building"
+                             " an INS from files.")
+
+        uvd = UVData()
+        uvd.read(filenames, read_data=False, **read_kwargs)
+        antpairs = [antpair for antpair in uvd.get_antpairs()
+                    if (antpair[0] == antpair[1]) == (spectrum_type == 'auto')]
+        del uvd
+        if len(antpairs) == 0:
+            raise ValueError(f"Requested spectrum type is '{spectrum_type}', but"
+                             " no such baselines exist in the files.")
+        if chunk_bls is None:
+            chunk_bls = len(antpairs)
+
+        chunks = [antpairs[chunk_ind:chunk_ind + chunk_bls]
+                  for chunk_ind in range(0, len(antpairs), chunk_bls)]
+        # Only the first chunk needs to make the waterfall metadata
+        shell_cls = [cls] + [None] * (len(chunks) - 1)
+        chunk_args = (shell_cls, [filenames] * len(chunks), chunks)
+        chunk_kwargs = {'diff': diff, 'flag_choice': flag_choice, 'history': history,
+                        'label': label, 'spectrum_type': spectrum_type,
+                        'use_integration_weights': use_integration_weights,
+                        'nsample_default': nsample_default, 'dtype': dtype,
+                        'diff_chunk_size': diff_chunk_size, 'read_kwargs': read_kwargs}
+        chunk_func = partial(_read_chunk_sums, **chunk_kwargs)
+
+        if num_workers > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=num_workers) as executor:
+                ins = _merge_chunk_sums(executor.map(chunk_func, *chunk_args))
+        else:
+            ins = _merge_chunk_sums(map(chunk_func, *chunk_args))
+
+        ins._super_complete = True
+        ins.spectrum_type = spectrum_type
+        ins.order = order
+        ins.history += f"Initialized spectrum_type:{spectrum_type} from visibility data. "
+
+        ins.metric_array = _sums_to_metric(ins.metric_array, ins.weights_array)
+        ins.match_events = []
+        ins.metric_ms = ins.mean_subtract()
+        ins.sig_array = np.ma.copy(ins.metric_ms)
+
+        return(ins)
+
     def mean_subtract(self, freq_slice=slice(None), return_coeffs=False):
 
         """
@@ -158,21 +664,9 @@ class INS(UVFlag):
         Returns:
             MS (masked array): The mean-subtracted data array.
         """
+        self._check_unpacked()
 
-        if self.spectrum_type == 'cross':
-            # This constant is determined by the Rayleigh distribution, which
-            # describes the ratio of its rms to its mean
-            C = 4 / np.pi - 1
-        else:
-            # This involves another constant that results from the folded normal distribution
-            # which describes the amplitudes of the auto-pols.
-            # The cross-pols have Rayleigh distributed amplitudes.
-            C_ray = 4 / np.pi - 1
-            C_fold = np.pi / 2 - 1
-            C_pol_map = {-1: C_fold, -2: C_fold, -3: C_ray, -4: C_ray,
-                         -5: C_fold, -6: C_fold, -7: C_ray, -8: C_ray}
-
-            C = np.array([C_pol_map[pol] for pol in self.polarization_array])
+        C = self._ms_constant()
 
         if not self.order:
             coeffs = np.ma.average(self.metric_array[:, freq_slice], axis=0, weights=self.weights_array[:, freq_slice])
@@ -181,30 +675,22 @@ class INS(UVFlag):
         else:
             MS = np.zeros_like(self.metric_array[:, freq_slice])
             coeffs = np.zeros((self.order + 1, ) + MS.shape[1:])
-            # Make sure x is not zero so that np.polyfit can proceed without nans
+            # Make sure x is not zero so that the fit can proceed without nans
             x = np.arange(1, self.metric_array.shape[0] + 1)
-            # We want to iterate over only a subset of the frequencies, so we need to investigate
             y_0 = self.metric_array[:, freq_slice]
-            # Find which channels are not fully masked (only want to iterate over those)
-            # This gives an array of channel indexes into the freq_slice
-            good_chans = np.where(np.logical_not(np.all(y_0.mask, axis=0)))[0]
+            # Find which (channel, pol) columns are not fully masked (only want to fit those)
+            good_cols = np.logical_not(np.all(y_0.mask, axis=0))
             # Only do this if there are unmasked channels
-            if len(good_chans) > 0:
-                # np.ma.polyfit does not take 2-d weights (!!!) so we just do the slow implementation and go chan by chan, pol-by-pol
-                for chan in good_chans:
-                    for pol_ind in range(self.Npols):
-                        y = self.metric_array[:, chan, pol_ind]
-                        w = self.weights_array[:, chan, pol_ind]
-                        w_sq = self.weights_square_array[:, chan, pol_ind]
-                        # Make the fit
-                        coeff = np.ma.polyfit(x, y, self.order, w=w)
-                        coeffs[:, chan, pol_ind] = coeff
-                        # Do the magic
-                        mu = np.sum([coeff[poly_ind] * x**(self.order - poly_ind)
-                                     for poly_ind in range(self.order + 1)],
-                                    axis=0)
-                        weights_factor = w / np.sqrt(C * w_sq)
-                        MS[:, chan, pol_ind] = (y / mu - 1) * weights_factor
+            if np.any(good_cols):
+                # Fit all the columns at once
+                y = y_0[:, good_cols]
+                w = self.weights_array[:, freq_slice][:, good_cols]
+                w_sq = self.weights_square_array[:, freq_slice][:, good_cols]
+                coeffs[:, good_cols] = _batch_polyfit(x, y, w, self.order)
+                mu = np.vander(x, self.order + 1) @ coeffs[:, good_cols]
+                C_cols = np.broadcast_to(C, good_cols.shape)[good_cols]
+                weights_factor = w / np.sqrt(C_cols * w_sq)
+                MS[:, good_cols] = (y / mu - 1) * weights_factor
             else:
                 MS[:] = np.ma.masked
 
@@ -213,6 +699,83 @@ class INS(UVFlag):
         else:
             return(MS)
 
+    def _ms_constant(self):
+        """
+        The squared ratio of the standard deviation to the mean of the
+        amplitudes, used to normalize the mean-subtracted spectrum.
+
+        Returns:
+            C: A number for cross spectra, or an array of length Npols for auto spectra.
+        """
+        if self.spectrum_type == 'cross':
+            # This constant is determined by the Rayleigh distribution, which
+            # describes the ratio of its rms to its mean
+            C = 4 / np.pi - 1
+        else:
+            # This involves another constant that results from the folded normal distribution
+            # which describes the amplitudes of the auto-pols.
+            # The cross-pols have Rayleigh distributed amplitudes.
+            C_ray = 4 / np.pi - 1
+            C_fold = np.pi / 2 - 1
+            C_pol_map = {-1: C_fold, -2: C_fold, -3: C_ray, -4: C_ray,
+                         -5: C_fold, -6: C_fold, -7: C_ray, -8: C_ray}
+
+            C = np.array([C_pol_map[pol] for pol in self.polarization_array])
+
+        return(C)
+
+    def _mean_subtract_sums(self):
+        """
+        Makes the running sums used by _mean_subtract_update(). Only for order 0.
+
+        Returns:
+            ms_sums (dict): The weighted sum of the unmasked metric_array, the
+                sum of the unmasked weights (both per channel and pol) and the
+                mask the sums were made with.
+        """
+        mask = np.ma.getmaskarray(self.metric_array)
+        weights = np.where(mask, 0, self.weights_array)
+        ms_sums = {'metric': np.sum(weights * self.metric_array.data, axis=0),
+                   'weights': np.sum(weights, axis=0),
+                   'mask': np.copy(mask)}
+
+        return(ms_sums)
+
+    def _mean_subtract_update(self, freq_slice, ms_sums):
+        """
+        Equivalent to mean_subtract(freq_slice=freq_slice) for order 0, but
+        updates running sums by removing only the samples that were masked
+        since the last update, instead of averaging over the whole time axis.
+
+        Args:
+            freq_slice: The frequency slice whose mask may have changed.
+            ms_sums (dict): The output of _mean_subtract_sums(). Updated in place.
+
+        Returns:
+            MS (masked array): The mean-subtracted data array for freq_slice.
+        """
+        mask = np.ma.getmaskarray(self.metric_array)[:, freq_slice]
+        metric = self.metric_array.data[:, freq_slice]
+        weights = self.weights_array[:, freq_slice]
+
+        new_mask = mask & np.logical_not(ms_sums['mask'][:, freq_slice])
+        new_weights = np.where(new_mask, weights, 0)
+        ms_sums['metric'][freq_slice] -= np.sum(new_weights * metric, axis=0)
+        ms_sums['weights'][freq_slice] -= np.sum(new_weights, axis=0)
+        ms_sums['mask'][:, freq_slice] = mask
+
+        # Channels with nothing left unmasked have no mean
+        no_weight = ms_sums['weights'][freq_slice] <= 0
+        MS_mask = mask | no_weight
+        with np.errstate(divide='ignore', invalid='ignore'):
+            coeffs = ms_sums['metric'][freq_slice] / ms_sums['weights'][freq_slice]
+            weights_factor = weights / np.sqrt(self._ms_constant() * self.weights_square_array[:, freq_slice])
+            MS = (metric / coeffs - 1) * weights_factor
+        # Masked arithmetic leaves the data of the first operand where masked
+        MS = np.ma.masked_array(np.where(MS_mask, metric, MS), mask=MS_mask)
+
+        return(MS)
+
     def mask_to_flags(self):
         """
         Propagates the mask to construct flags for the original
@@ -224,6 +787,10 @@ class INS(UVFlag):
             tp_flags (array): The time-propagated flags
         """
 
+        packed_masks = getattr(self, 'packed_masks', None)
+        if packed_masks is not None:
+            return(packed_masks['metric_array'].time_propagate().unpack())
+
         # Propagate the flags
         shape = list(self.metric_array.shape)
         tp_flags = np.zeros([shape[0] + 1] + shape[1:], dtype=bool)
@@ -232,6 +799,37 @@ class INS(UVFlag):
 
         return(tp_flags)
 
+    def pack_masks(self):
+        """
+        Moves the masks of metric_array, metric_ms and sig_array into the
+        packed_masks attribute as PackedMask objects, which use an eighth of the
+        memory. mask_to_flags and flag_uvf work on the packed mask directly.
+        Other methods that need the masks raise an error until unpack_masks is
+        called.
+        """
+        self.packed_masks = {}
+        for attr in ['metric_array', 'metric_ms', 'sig_array']:
+            self.packed_masks[attr] = PackedMask(np.ma.getmaskarray(getattr(self, attr)))
+            setattr(self, attr, np.ma.masked_array(getattr(self, attr).data))
+
+    def unpack_masks(self):
+        """
+        Restores the masks packed with pack_masks.
+        """
+        if getattr(self, 'packed_masks', None) is None:
+            raise ValueError("The masks are not packed.")
+        for attr, packed_mask in self.packed_masks.items():
+            getattr(self, attr).mask = packed_mask.unpack()
+        self.packed_masks = None
+
+    def _check_unpacked(self):
+        """
+        Raises an error if the masks are packed, since the masked arrays are
+        unmasked while they are.
+        """
+        if getattr(self, 'packed_masks', None) is not None:
+            raise ValueError("The masks are packed. Call unpack_masks first.")
+
     def flag_uvf(self, uvf, inplace=False):
         """
         Applies flags calculated from mask_to_flags method onto a given UVFlag
@@ -274,7 +872,7 @@ class INS(UVFlag):
 
     def write(self, prefix, clobber=False, data_compression='lzf',
               output_type='data', mwaf_files=None, mwaf_method='add',
-              metafits_file=None, Ncoarse=24, sep='_', uvf=None):
+              metafits_file=None, Ncoarse=24, sep='_', uvf=None, num_workers=1):
 
         """
         Writes attributes specified by output_type argument to appropriate files
@@ -285,11 +883,18 @@ class INS(UVFlag):
         Args:
             prefix: The filepath prefix for the output file e.g. /analysis/SSINS_outdir/obsid
             clobber: See UVFlag documentation
-            data_compression: See UVFlag documentation
-            output_type ('data', 'z_score', 'mask', 'flags', 'match_events'):
+            data_compression: See UVFlag documentation. Not used for 'bundle',
+                whose datasets are always written contiguous and uncompressed
+                so that read_bundle() can memory-map them.
+            output_type ('data', 'bundle', 'z_score', 'mask', 'flags', 'match_events'):
 
                 data - outputs the metric_array attribute into an h5 file
 
+                bundle - outputs the data along with its mask, the metric_ms and
+                sig_array attributes, and the match_events into a single h5 file.
+                Initializing an INS from the file restores all of these, and
+                individual datasets can be read lazily with read_bundle().
+
                 z_score - outputs the the metric_ms attribute into an h5 file
 
                 mask - outputs the mask for the metric_array attribute into an h5 file
@@ -298,6 +903,10 @@ class INS(UVFlag):
 
                 match_events - Writes the match_events attribute out to a human-readable yml file
 
+                match_events_h5 - Writes the match_events attribute out to a compact h5 file
+                as a table of event bounds, shape ids and significances. Much faster
+                to read and write than yml for many events.
+
                 mwaf - Writes an mwaf file by converting mask to flags.
             mwaf_files (seq): A list of paths to mwaf files to use as input for
                 each coarse channel
@@ -306,12 +915,17 @@ class INS(UVFlag):
             metafits_file (str): A path to the metafits file if writing mwaf outputs.
                 Required only if writing mwaf files.
             sep (str): Determines the separator in the filename of the output file.
+            num_workers (int): The number of threads to write mwaf files with.
+                Each thread writes one coarse channel box at a time.
         """
 
-        version_info_list = ['%s: %s, ' % (key, version.version_info[key]) for key in version.version_info]
-        version_hist_substr = reduce(lambda x, y: x + y, version_info_list)
+        if output_type in ['data', 'bundle', 'z_score', 'mask']:
+            self._check_unpacked()
+        version_hist_substr = version.get_version_str()
         if output_type == 'match_events':
             filename = '%s%sSSINS%s%s.yml' % (prefix, sep, sep, output_type)
+        elif output_type == 'match_events_h5':
+            filename = '%s%sSSINS%smatch_events.h5' % (prefix, sep, sep)
         else:
             filename = '%s%sSSINS%s%s.h5' % (prefix, sep, sep, output_type)
 
@@ -323,6 +937,35 @@ class INS(UVFlag):
             super().write(filename, clobber=clobber, data_compression=data_compression)
             self.metric_array = np.ma.masked_array(data=self.metric_array, mask=self.metric_ms.mask)
 
+        elif output_type == 'bundle':
+            # read_bundle can only memory-map datasets that are neither
+            # chunked nor compressed, but UVFlag.write always chunks them. So
+            # write placeholders for the data-like arrays and replace them below.
+            data_arrays = [('metric_array', self.metric_array), ('weights_array', self.weights_array)]
+            if self.weights_square_array is not None:
+                data_arrays.append(('weights_square_array', self.weights_square_array))
+            for name, _ in data_arrays:
+                setattr(self, name, np.zeros(1))
+            try:
+                super().write(filename, clobber=clobber, data_compression=None)
+            finally:
+                for name, data in data_arrays:
+                    setattr(self, name, data)
+
+            import h5py
+            with h5py.File(filename, 'a') as bundle:
+                data_group = bundle['Data']
+                for name, data in data_arrays:
+                    del data_group[name]
+                    data_group.create_dataset(name, data=np.ma.getdata(data))
+                for name, data in [('mask', np.ma.getmaskarray(self.metric_array)),
+                                   ('metric_ms', np.ma.getdata(self.metric_ms)),
+                                   ('ms_mask', np.ma.getmaskarray(self.metric_ms)),
+                                   ('sig_array', np.ma.getdata(self.sig_array)),
+                                   ('sig_mask', np.ma.getmaskarray(self.sig_array))]:
+                    data_group.create_dataset(name, data=data)
+                _write_events(data_group, self.match_events)
+
         elif output_type == 'z_score':
             z_uvf = self.copy()
             z_uvf.metric_array = np.copy(self.metric_ms.data)
@@ -331,7 +974,7 @@ class INS(UVFlag):
 
         elif output_type == 'mask':
             mask_uvf = self._make_mask_copy()
-            super(INS, mask_uvf).write(filename, clobber=clobber, data_compression=data_compression)
+            mask_uvf.write(filename, clobber=clobber, data_compression=data_compression)
             del mask_uvf
 
         elif output_type == 'flags':
@@ -342,6 +985,7 @@ class INS(UVFlag):
             flag_uvf.write(filename, clobber=clobber, data_compression=data_compression)
 
         elif output_type == 'match_events':
+            import yaml
             yaml_dict = {'time_bounds': [],
                          'freq_bounds': [],
                          'shape': [],
@@ -360,6 +1004,13 @@ class INS(UVFlag):
             with open(filename, 'w') as outfile:
                 yaml.safe_dump(yaml_dict, outfile, default_flow_style=False)
 
+        elif output_type == 'match_events_h5':
+            if os.path.exists(filename) and not clobber:
+                raise IOError("File exists; skipping")
+            import h5py
+            with h5py.File(filename, 'w') as outfile:
+                _write_events(outfile, self.match_events)
+
         elif output_type == 'mwaf':
             if mwaf_files is None:
                 raise ValueError("mwaf_files is set to None. This must be a sequence of existing mwaf filepaths.")
@@ -385,59 +1036,91 @@ class INS(UVFlag):
             # The rest go in frequency-decreasing order
             box_vals[num_less:] = np.arange(len(coarse_chans) - 1, num_less - 1, -1)
             box_label_to_chan_ind_map = dict(zip(box_keys, box_vals))
+            chan_inds = []
+            filenames = []
             for path in mwaf_files:
                 if not os.path.exists(path):
                     raise IOError("filepath %s in mwaf_files was not found in system." % path)
                 path_ind = path.rfind('_') + 1
                 boxstr = path[path_ind:path_ind + 2]
-                chan_ind = box_label_to_chan_ind_map[boxstr]
-                with fits.open(path) as mwaf_hdu:
-                    NCHANS = mwaf_hdu[0].header['NCHANS']
-                    NSCANS = mwaf_hdu[0].header['NSCANS']
-                    # Check that freq res and time res are compatible
-                    freq_mod = NCHANS % (flags.shape[1] / Ncoarse)
-                    time_mod = NSCANS % flags.shape[0]
-                    assert freq_mod == 0, "Number of fine channels of mwaf input and INS are incompatible."
-                    assert time_mod == 0, "Time axes of mwaf input and INS flags are incompatible."
-                    freq_div = NCHANS / (flags.shape[1] / Ncoarse)
-                    time_div = NSCANS / flags.shape[0]
-                    Nant = mwaf_hdu[0].header['NANTENNA']
-                    Nbls = Nant * (Nant + 1) // 2
-
-                    # Repeat in time
-                    time_rep_flags = np.repeat(flags, time_div, axis=0)
-                    # Repeat in freq
-                    freq_time_rep_flags = np.repeat(time_rep_flags, freq_div, axis=1)
-                    # Repeat in bls
-                    freq_time_bls_rep_flags = np.repeat(freq_time_rep_flags[:, np.newaxis, NCHANS * chan_ind: NCHANS * (chan_ind + 1)], Nbls, axis=1)
-                    # This shape is on MWA wiki. Reshape to this shape.
-                    new_flags = freq_time_bls_rep_flags.reshape((NSCANS * Nbls, NCHANS))
-                    if mwaf_method == 'add':
-                        mwaf_hdu[1].data['FLAGS'][new_flags] = 1
-                    elif mwaf_method == 'replace':
-                        mwaf_hdu[1].data['FLAGS'] = new_flags
-                    else:
-                        raise ValueError("mwaf_method is %s. Options are 'add' or 'replace'." % mwaf_method)
-
-                    mwaf_hdu[0].header['SSINSVER'] = version_hist_substr
-
-                    filename = '%s_%s.mwaf' % (prefix, boxstr)
-
-                    mwaf_hdu.writeto(filename, overwrite=clobber)
-                    self.history += 'Wrote flags to %s using SSINS %s' % (filename, version_hist_substr)
+                chan_inds.append(box_label_to_chan_ind_map[boxstr])
+                filenames.append('%s_%s.mwaf' % (prefix, boxstr))
+            if mwaf_method not in ['add', 'replace']:
+                raise ValueError("mwaf_method is %s. Options are 'add' or 'replace'." % mwaf_method)
+
+            box_func = partial(_write_mwaf_box, flags=flags, mwaf_method=mwaf_method,
+                               Ncoarse=Ncoarse, clobber=clobber,
+                               ssins_version=version_hist_substr)
+            # Each box is written by a separate thread, since most of the time
+            # is spent in I/O and in numpy, which release the GIL
+            if num_workers > 1:
+                from concurrent.futures import ThreadPoolExecutor
+                with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                    list(executor.map(box_func, mwaf_files, chan_inds, filenames))
+            else:
+                list(map(box_func, mwaf_files, chan_inds, filenames))
+            for filename in filenames:
+                self.history += 'Wrote flags to %s using SSINS %s' % (filename, version_hist_substr)
         else:
             raise ValueError("output_type %s is invalid. See documentation for options." % output_type)
 
-    def match_events_read(self, filename):
+    @staticmethod
+    def read_bundle(filename, name, index=Ellipsis, mmap=True):
+        """
+        Reads one dataset from a file written with output_type='bundle',
+        without reading the rest of the file. The datasets are stored
+        contiguously, so they are memory-mapped and nothing is read until the
+        returned array is used. Chunked datasets (e.g. in bundles that were
+        compressed after writing) fall back to reading the chunks that
+        overlap index.
+
+        Args:
+            filename: The path to the bundle
+            name: The dataset to read. One of 'metric_array', 'weights_array',
+                'weights_square_array', 'mask', 'metric_ms', 'ms_mask',
+                'sig_array', 'sig_mask', or 'match_events'.
+            index: An index into the dataset, e.g. np.s_[:, 10:20]. Not used
+                for 'match_events'.
+            mmap: Whether to memory-map contiguous datasets.
+
+        Returns:
+            data: The indexed dataset, or a list of Events for 'match_events'
+        """
+        import h5py
+        with h5py.File(filename, 'r') as bundle:
+            dset = bundle['Data'][name]
+            if name == 'match_events':
+                return(_read_events(bundle['Data']))
+            offset = dset.id.get_offset()
+            if mmap and (offset is not None) and (dset.chunks is None):
+                data = np.memmap(filename, dtype=dset.dtype, mode='r',
+                                 offset=offset, shape=dset.shape)[index]
+            else:
+                data = dset[index]
+
+        return(data)
+
+    def match_events_read(self, filename, as_array=False):
         """
         Reads match events from file specified by filename argument
 
         Args:
-            filename: The yml file with the stored match_events
+            filename: The yml or h5 file with the stored match_events
+            as_array: For h5 files, return the table of events as a structured
+                array, along with the list of shape names that its shape_id
+                column indexes, instead of a list of Events.
 
         Returns:
-            match_events: The match_events in the yml file
+            match_events: The match_events in the file
         """
+        import h5py
+        import yaml
+
+        if h5py.is_hdf5(filename):
+            with h5py.File(filename, 'r') as infile:
+                return(_read_events(infile, as_array=as_array))
+        elif as_array:
+            raise ValueError("as_array is only supported for h5 match_events files.")
 
         with open(filename, 'r') as infile:
             yaml_dict = yaml.safe_load(infile)
@@ -472,10 +1155,11 @@ class INS(UVFlag):
         """Thin wrapper around UVFlag.select that also recalculates the ms array
         immediately afterwards.
         """
+        self._check_unpacked()
 
         mask_uvf = self._make_mask_copy()
         super(INS, self).select(**kwargs)
-        super(INS, mask_uvf).select(**kwargs)
+        mask_uvf.select(**kwargs)
         self.metric_array.mask = np.copy(mask_uvf.flag_array)
         if hasattr(self, 'metric_ms'):
             self.metric_ms = self.mean_subtract()
@@ -498,6 +1182,8 @@ class INS(UVFlag):
                 ins: if not inplace, a new INS object
 
         """
+        self._check_unpacked()
+        other._check_unpacked()
         if inplace:
             this = self
         else:
@@ -506,12 +1192,10 @@ class INS(UVFlag):
         mask_uvf_this = this._make_mask_copy()
         mask_uvf_other = other._make_mask_copy()
 
-        mask_uvf = super(INS, mask_uvf_this).__add__(mask_uvf_other,
-                                                     inplace=False,
-                                                     axis=axis,
-                                                     run_check=run_check,
-                                                     check_extra=check_extra,
-                                                     run_check_acceptability=run_check_acceptability)
+        mask_uvf = mask_uvf_this.__add__(mask_uvf_other, inplace=False,
+                                         axis=axis, run_check=run_check,
+                                         check_extra=check_extra,
+                                         run_check_acceptability=run_check_acceptability)
 
         if inplace:
             super(INS, this).__add__(other, inplace=True, axis=axis,
@@ -531,17 +1215,148 @@ class INS(UVFlag):
         if not inplace:
             return this
 
+    @classmethod
+    def concatenate(cls, ins_list, axis="time", run_check=True, check_extra=True,
+                    run_check_acceptability=True):
+        """
+        Concatenates any number of INS objects along the time or frequency axis
+        in one go. Unlike chaining __add__, the output arrays are allocated
+        once and each INS is copied into place, and the mean-subtracted
+        spectrum is only calculated once at the end. The match_events of each
+        INS are kept, with their slices shifted to where that INS ends up.
+
+        Args:
+            ins_list: A sequence of INS objects to concatenate, in order
+            axis ('time' or 'frequency'): The axis to concatenate along
+            run_check: Option to check for the existence and proper shapes
+                of parameters after combining the objects.
+            check_extra: Option to check optional parameters as well as required ones.
+            run_check_acceptability: Option to check acceptable range of the
+                values of parameters after combining the objects.
+
+        Returns:
+            ins: The concatenated INS
+        """
+        if axis not in ['time', 'frequency']:
+            raise ValueError("INS objects can only be concatenated along the"
+                             " 'time' or 'frequency' axis.")
+        ins_list = list(ins_list)
+        if len(ins_list) == 0:
+            raise ValueError("No INS objects were given to concatenate.")
+
+        for ins in ins_list:
+            ins._check_unpacked()
+        first = ins_list[0]
+        match_params = ['time_array' if axis == 'frequency' else 'freq_array',
+                        'polarization_array']
+        for ins in ins_list[1:]:
+            for param in match_params:
+                if not np.array_equal(getattr(ins, param), getattr(first, param)):
+                    raise ValueError(f"The spectra do not have matching {param}s.")
+            if ins.spectrum_type != first.spectrum_type:
+                raise ValueError("The spectra do not have the same spectrum_type.")
+
+        ax = 0 if axis == 'time' else 1
+        offsets = np.cumsum([0] + [ins.metric_array.shape[ax] for ins in ins_list])
+        shape = list(first.metric_array.shape)
+        shape[ax] = offsets[-1]
+        data_params = ['metric_array', 'weights_array']
+        if first.weights_square_array is not None:
+            data_params.append('weights_square_array')
+        data = {param: np.empty(shape, dtype=getattr(first, param).dtype) for param in data_params}
+        mask = np.empty(shape, dtype=bool)
+
+        match_events = []
+        for ins, start, stop in zip(ins_list, offsets[:-1], offsets[1:]):
+            place = (slice(None), ) * ax + (slice(start, stop), )
+            for param in data_params:
+                data[param][place] = np.ma.getdata(getattr(ins, param))
+            mask[place] = np.ma.getmaskarray(ins.metric_array)
+            for event in ins.match_events:
+                event_slice = (event.time_slice, event.freq_slice)[ax]
+                start_ind, stop_ind, _ = event_slice.indices(ins.metric_array.shape[ax])
+                event_slice = slice(start_ind + start, stop_ind + start, event_slice.step)
+                if axis == 'time':
+                    match_events.append(event._replace(time_slice=event_slice))
+                else:
+                    match_events.append(event._replace(freq_slice=event_slice))
+
+        # Only the metadata of the first INS is copied, since the data-like
+        # arrays are replaced below
+        this = cls.__new__(cls)
+        UVFlag.__init__(this)
+        first._copy_metadata(this)
+        this._super_complete = first._super_complete
+        this.spectrum_type = first.spectrum_type
+        this.order = first.order
+        this.packed_masks = None
+        if axis == 'time':
+            this.time_array = np.concatenate([ins.time_array for ins in ins_list])
+            this.lst_array = np.concatenate([ins.lst_array for ins in ins_list])
+            this.Ntimes = np.unique(this.time_array).size
+        else:
+            this.freq_array = np.concatenate([ins.freq_array for ins in ins_list], axis=-1)
+            if np.ndim(first.channel_width) > 0:
+                this.channel_width = np.concatenate([ins.channel_width for ins in ins_list])
+            if first.flex_spw_id_array is not None:
+                this.flex_spw_id_array = np.concatenate([ins.flex_spw_id_array for ins in ins_list])
+                # Keep the spws in the order they first appear
+                unique_index = np.sort(np.unique(this.flex_spw_id_array, return_index=True)[1])
+                this.spw_array = this.flex_spw_id_array[unique_index]
+                this.Nspws = len(this.spw_array)
+            this.Nfreqs = np.unique(this.freq_array).size
+        this.history += f"Concatenated {len(ins_list)} spectra along {axis} axis. "
+
+        for param in data_params:
+            setattr(this, param, data[param])
+        this.metric_array = np.ma.masked_array(this.metric_array, mask=mask)
+        this.match_events = match_events
+        this.metric_ms = this.mean_subtract()
+        this.sig_array = np.ma.copy(this.metric_ms)
+
+        if run_check:
+            this.check(check_extra=check_extra,
+                       run_check_acceptability=run_check_acceptability)
+
+        return(this)
+
+    def _copy_metadata(self, other):
+        """
+        Copies the UVParameters of self onto another UVFlag (or INS), except
+        for the data-like arrays, whose values are left as None. Used to make
+        new objects without copying data that will be replaced anyway.
+
+        Args:
+            other: The object to copy the metadata onto
+        """
+        data_params = ['_metric_array', '_weights_array', '_weights_square_array',
+                       '_flag_array']
+        for param_name in self:
+            if param_name in data_params:
+                # Keep the expected shape and type of the array, but not its value
+                param = copy(getattr(self, param_name))
+                param.value = None
+            else:
+                param = deepcopy(getattr(self, param_name))
+            setattr(other, param_name, param)
+
     def _make_mask_copy(self):
         """
-        Makes a new INS in flag mode that copies self whose flags are the mask of
-        self. Useful for holding the mask temporarily during concatenation etc.
+        Makes a new UVFlag in flag mode whose flags are the mask of self. Only
+        the metadata of self is copied, not the data-like arrays, so this only
+        costs as much memory as the mask. Useful for holding the mask
+        temporarily during concatenation etc.
 
         Returns:
-            mask_uvf_copy: A copy of self in flag_mode that holds the mask in
-                its flag_array
+            mask_uvf_copy: A UVFlag in flag mode with the metadata of self that
+                holds the mask in its flag_array
         """
-        mask_uvf_copy = self.copy()
+        mask_uvf_copy = UVFlag()
+        self._copy_metadata(mask_uvf_copy)
+        # Give to_flag the mask to threshold so that no float array is made
+        mask = np.ma.getmaskarray(self.metric_array)
+        mask_uvf_copy.metric_array = mask
         mask_uvf_copy.to_flag()
-        mask_uvf_copy.flag_array = np.copy(self.metric_array.mask)
+        mask_uvf_copy.flag_array = np.copy(mask)
 
         return(mask_uvf_copy)
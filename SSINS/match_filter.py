@@ -5,10 +5,8 @@ Match Filter class
 import numpy as np
 import warnings
 from collections import namedtuple
-import yaml
 from copy import deepcopy
 from SSINS import version
-from functools import reduce
 import os
 
 Event = namedtuple("Event", ["time_slice", "freq_slice", "shape", "sig"])
@@ -115,7 +113,177 @@ class MF():
 
         return(slice_dict)
 
-    def match_test(self, INS):
+    def _init_stats(self, INS):
+        """
+        Makes the statistics that match_test() searches over from the
+        metric_ms attribute of an INS. These are the sum and number of
+        unmasked samples of each shape at each time and polarization, and the
+        largest absolute z-score in each channel and polarization for the
+        narrow shape.
+
+        Args:
+            INS: The INS to make statistics for
+
+        Returns:
+            stats (dict): The statistics, to be kept up to date with _update_stats()
+        """
+        INS._check_unpacked()
+        unmasked = np.logical_not(np.ma.getmaskarray(INS.metric_ms))
+        # Not filled(), which returns the data itself when nothing is masked
+        stats = {'data': np.where(unmasked, INS.metric_ms.data, 0),
+                 'unmasked': unmasked, 'sum': {}, 'count': {}}
+        for shape in self.slice_dict:
+            if shape != 'narrow':
+                self._shape_stats(stats, shape)
+        if 'narrow' in self.slice_dict:
+            stats['narrow_max'] = np.zeros(INS.metric_ms.shape[1:])
+            stats['narrow_arg'] = np.zeros(INS.metric_ms.shape[1:], dtype=int)
+            self._narrow_stats(stats, slice(0, INS.metric_ms.shape[1]))
+
+        return(stats)
+
+    def _shape_stats(self, stats, shape):
+        """
+        Sums the unmasked samples of a shape from scratch.
+
+        Args:
+            stats (dict): The statistics from _init_stats(). Updated in place.
+            shape: The shape to sum
+        """
+        stats['sum'][shape] = stats['data'][:, self.slice_dict[shape]].sum(axis=1)
+        stats['count'][shape] = np.count_nonzero(stats['unmasked'][:, self.slice_dict[shape]],
+                                                 axis=1)
+
+    def _narrow_stats(self, stats, freq_slice):
+        """
+        Finds the largest absolute z-score over time in each channel of a
+        frequency slice, and the time at which it occurs. The maximum of each
+        channel is found again over all times rather than updated
+        incrementally, which costs Ntimes per channel searched.
+
+        Args:
+            stats (dict): The statistics from _init_stats(). Updated in place.
+            freq_slice: The channels to search
+        """
+        # Masked samples can never be the maximum, as in a masked argmax
+        abs_arr = np.where(stats['unmasked'][:, freq_slice],
+                           np.absolute(stats['data'][:, freq_slice]), -np.inf)
+        stats['narrow_arg'][freq_slice] = abs_arr.argmax(axis=0)
+        stats['narrow_max'][freq_slice] = np.take_along_axis(abs_arr, stats['narrow_arg'][np.newaxis, freq_slice], axis=0)[0]
+
+    def _update_stats(self, INS, stats, freq_slice):
+        """
+        Brings the statistics up to date after metric_ms has changed in a
+        frequency slice. Only the channels in the slice are read. Shapes that
+        partially overlap the slice have the changed channels swapped out of
+        their sums, while those entirely inside of it are summed again.
+
+        Args:
+            INS: The INS whose metric_ms changed
+            stats (dict): The statistics from _init_stats(). Updated in place.
+            freq_slice: The frequency slice in which metric_ms changed
+        """
+        chans = np.arange(INS.metric_ms.shape[1])[freq_slice]
+        if not len(chans):
+            return
+        low, high = chans[0], chans[-1] + 1
+        new_data = INS.metric_ms[:, low:high].filled(0)
+        new_unmasked = np.logical_not(np.ma.getmaskarray(INS.metric_ms[:, low:high]))
+
+        resum = []
+        for shape in self.slice_dict:
+            if shape == 'narrow':
+                continue
+            shape_slc = self.slice_dict[shape]
+            shape_low = max(low, shape_slc.start)
+            shape_high = min(high, shape_slc.stop)
+            if shape_low >= shape_high:
+                continue
+            if (shape_low == shape_slc.start) and (shape_high == shape_slc.stop):
+                resum.append(shape)
+            else:
+                new_slc = slice(shape_low - low, shape_high - low)
+                stats['sum'][shape] += (new_data[:, new_slc].sum(axis=1) - stats['data'][:, shape_low:shape_high].sum(axis=1))
+                stats['count'][shape] += (np.count_nonzero(new_unmasked[:, new_slc], axis=1) - np.count_nonzero(stats['unmasked'][:, shape_low:shape_high], axis=1))
+
+        stats['data'][:, low:high] = new_data
+        stats['unmasked'][:, low:high] = new_unmasked
+        for shape in resum:
+            self._shape_stats(stats, shape)
+        if 'narrow' in self.slice_dict:
+            # Every changed channel is searched again over all of its times
+            self._narrow_stats(stats, slice(low, high))
+
+    def _shape_sig(self, stats, shape):
+        """
+        The significance of a shape at each time and polarization, i.e. the
+        absolute mean z-score over the shape times the square root of the
+        number of unmasked samples. Fully masked entries are -np.inf.
+
+        Args:
+            stats (dict): The statistics from _init_stats()
+            shape: The shape, other than narrow
+
+        Returns:
+            sliced_arr: The significances, with shape (Ntimes, Npols)
+        """
+        N = stats['count'][shape]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sliced_arr = np.where(N > 0, np.absolute(stats['sum'][shape] / N) * np.sqrt(N), -np.inf)
+
+        return(sliced_arr)
+
+    def batch_match_test(self, INS, batch_factor, stats=None):
+        """
+        Finds every outlier that is more significant than batch_factor times
+        the sig_thresh of its shape, for flagging in a single iteration. Each
+        shape contributes at most one outlier per time (and narrow at most
+        one per time and channel). Outliers are taken from most to least
+        significant, skipping any that overlap one already taken.
+
+        Args:
+            INS: An INS to test
+            batch_factor (float): The multiple of sig_thresh to exceed. At least 1.
+            stats (dict): Optional. Statistics of INS.metric_ms made by
+                _init_stats(). Made from scratch if not passed.
+
+        Returns:
+            events: A list of Events, strongest first. Empty if no outliers
+                exceed the batch threshold.
+        """
+        if stats is None:
+            stats = self._init_stats(INS)
+
+        candidates = []
+        for shape in self.slice_dict:
+            thresh = batch_factor * self.sig_thresh[shape]
+            if shape == 'narrow':
+                chans = np.nonzero(np.any(stats['narrow_max'] > thresh, axis=1))[0]
+                abs_arr = np.where(stats['unmasked'][:, chans],
+                                   np.absolute(stats['data'][:, chans]), -np.inf).max(axis=-1)
+                for t, ind in zip(*np.nonzero(abs_arr > thresh)):
+                    f = slice(chans[ind], chans[ind] + 1)
+                    shape_name = "narrow_%.3fMHz" % (INS.freq_array[f][0] * 10**(-6))
+                    candidates.append(Event(slice(t, t + 1), f, shape_name, abs_arr[t, ind]))
+            else:
+                sig_arr = self._shape_sig(stats, shape).max(axis=1)
+                for t in np.nonzero(sig_arr > thresh)[0]:
+                    candidates.append(Event(slice(t, t + 1), self.slice_dict[shape],
+                                            shape, sig_arr[t]))
+        candidates.sort(key=lambda event: event.sig, reverse=True)
+
+        events = []
+        taken = {}
+        for event in candidates:
+            t = event.time_slice.start
+            f = event.freq_slice
+            if not any((f.start < f_taken.stop) and (f_taken.start < f.stop) for f_taken in taken.get(t, [])):
+                taken.setdefault(t, []).append(f)
+                events.append(event)
+
+        return(events)
+
+    def match_test(self, INS, stats=None):
 
         """
         The primary test that the filter is used with. The greatest outlier in
@@ -125,6 +293,9 @@ class MF():
 
         Args:
             INS: An INS to test
+            stats (dict): Optional. Statistics of INS.metric_ms made by
+                _init_stats() and kept current with _update_stats(). Made from
+                scratch if not passed.
 
         Returns:
             t_max: The time index of the strongest outlier (None if no significant outliers)
@@ -132,28 +303,33 @@ class MF():
             R_max: The ratio of the z-score of the outlier to the sig_thresh (-np.inf if no significant outliers)
             shape_max: The shape of the strongest outlier
         """
+        if stats is None:
+            stats = self._init_stats(INS)
 
         sig_max = -np.inf
         t_max = None
         f_max = None
         shape_max = None
         for shape in self.slice_dict:
-            if shape is 'narrow':
-                t, f, p = np.unravel_index(np.absolute(INS.metric_ms).argmax(),
-                                           INS.metric_ms.shape)
-                sig = np.absolute(INS.metric_ms[t, f, p])
+            if shape == 'narrow':
+                sig = stats['narrow_max'].max()
+                # Break ties in the same order as an argmax over the whole array
+                f, p = np.nonzero(stats['narrow_max'] == sig)
+                t = stats['narrow_arg'][f, p]
+                if len(t):
+                    ind = np.lexsort((p, f, t))[0]
+                    t, f = t[ind], f[ind]
+                else:
+                    t, f = 0, 0
                 t = slice(t, t + 1)
                 f = slice(f, f + 1)
             else:
-                N = np.count_nonzero(np.logical_not(INS.metric_ms[:, self.slice_dict[shape]].mask),
-                                     axis=1)
-                sliced_arr = np.absolute(INS.metric_ms[:, self.slice_dict[shape]].mean(axis=1)) * np.sqrt(N)
+                sliced_arr = self._shape_sig(stats, shape)
                 t, p = np.unravel_index((sliced_arr / self.sig_thresh[shape]).argmax(),
                                         sliced_arr.shape)
+                sig = sliced_arr[t, p]
                 t = slice(t, t + 1)
                 f = self.slice_dict[shape]
-                # Pull out the number instead of a sliced arr
-                sig = sliced_arr[t, p][0]
             if sig > self.sig_thresh[shape]:
                 if sig > sig_max:
                     t_max, f_max, shape_max, sig_max = (t, f, shape, sig)
@@ -166,7 +342,8 @@ class MF():
         return(event)
 
     def apply_match_test(self, INS, event_record=True, apply_samp_thresh=None,
-                         freq_broadcast=False, time_broadcast=False):
+                         freq_broadcast=False, time_broadcast=False,
+                         incremental=False, batch_factor=None):
 
         """
         A method that uses the match_test() method to flag RFI. The champion
@@ -181,18 +358,48 @@ class MF():
             apply_samp_thresh (bool): Deprecated in favor of the time_broadcast keyword.
             freq_broadcast (bool): If True, broadcast flags between iterations using the broadcast_dict
             time_broadcast (bool): If True, broadcasts flags in time if significant flagging in channels. Set tb_aggro parameter for aggression.
+            incremental (bool): If True, keep running sums of the metric and
+                weights in each channel and only remove the newly flagged
+                samples from them after each event, instead of averaging the
+                affected channels again. Only for INS with order 0.
+            batch_factor (float): Optional. If set, each iteration flags every
+                non-overlapping outlier found by batch_match_test() before
+                recalculating, falling back to the champion once none are left.
+                This takes far fewer iterations when there are many strong
+                outliers, but can flag differently than the default, since
+                outliers that would have fallen below sig_thresh after earlier
+                flagging are flagged anyway. See benchmarks/bench_match_batch.py.
+                Must be at least 1.
         """
+        INS._check_unpacked()
         if apply_samp_thresh is not None:
             raise ValueError("apply_samp_thresh has been deprecated in favor of"
                              " the time_broadcast keyword.")
+        if (batch_factor is not None) and (batch_factor < 1):
+            raise ValueError("batch_factor must be at least 1.")
+        if incremental:
+            if INS.order:
+                raise ValueError("Incremental mean subtraction is only available"
+                                 " for INS objects with order 0.")
+            ms_sums = INS._mean_subtract_sums()
+        stats = self._init_stats(INS)
 
         # Initialize the counter so the loop starts.
         count = 1
         while count:
             # If no events are found, this will remain 0, and the loop will end
             count = 0
-            event = self.match_test(INS)
-            if event.sig > -np.inf:
+            events = []
+            if batch_factor is not None:
+                events = self.batch_match_test(INS, batch_factor, stats=stats)
+            if not events:
+                event = self.match_test(INS, stats=stats)
+                if event.sig > -np.inf:
+                    events = [event]
+            # Flag everything before recalculating, so that sig_array holds
+            # the z-scores that each event was found with
+            final_events = []
+            for event in events:
                 count += 1
                 INS.metric_array[event[:2]] = np.ma.masked
                 # Only adjust those values in the sig_array that are not already assigned
@@ -204,10 +411,21 @@ class MF():
                     event = self.time_broadcast(INS, event, event_record=event_record)
                 if freq_broadcast:
                     event = self.freq_broadcast(INS, event, event_record=event_record)
-                if not np.all(INS.metric_array[:, event[1]].mask):
-                    INS.metric_ms[:, event[1]] = INS.mean_subtract(freq_slice=event[1])
+                final_events.append(event)
+            # Channels hit by several events only need recalculating once
+            freq_slices = []
+            for event in final_events:
+                if event[1] not in freq_slices:
+                    freq_slices.append(event[1])
+            for freq_slice in freq_slices:
+                if not np.all(INS.metric_array[:, freq_slice].mask):
+                    if incremental:
+                        INS.metric_ms[:, freq_slice] = INS._mean_subtract_update(freq_slice, ms_sums)
+                    else:
+                        INS.metric_ms[:, freq_slice] = INS.mean_subtract(freq_slice=freq_slice)
                 else:
-                    INS.metric_ms[:, event[1]] = np.ma.masked
+                    INS.metric_ms[:, freq_slice] = np.ma.masked
+                self._update_stats(INS, stats, freq_slice)
         nonmask_all = np.logical_not(INS.metric_ms.mask)
         INS.sig_array[nonmask_all] = INS.metric_ms[nonmask_all]
 
@@ -228,6 +446,7 @@ class MF():
                 event if no additional flagging happened.
         """
 
+        INS._check_unpacked()
         # Find how many channels are already fully flagged, so we can ignore them
         num_chans_all_flag = np.sum(np.all(INS.metric_array.mask[:, event[1], :], axis=(0, -1)))
         # Find the total data volume and subtract off the data volume in channels that are totally flagged
@@ -262,6 +481,7 @@ class MF():
             event: The event to broadcast flags for.
             event_record (bool): Whether to record a new event for this flagging entry.
         """
+        INS._check_unpacked()
         if self.broadcast_slc_dict == {}:
             raise ValueError("MF object does not have a broadcast_dict, but is "
                              " being asked to broadcast flags. Check "
@@ -310,6 +530,7 @@ class MF():
         if file_exists and not clobber:
             raise ValueError(f"matchfilter file with prefix {prefix} already exists and clobber is False.")
         else:
+            import yaml
             with open(outpath, 'w') as outfile:
                 yaml.safe_dump(yaml_dict, outfile)
 
@@ -330,8 +551,7 @@ class MF():
             # Placeholder values. "narrow" really refers to Nfreqs different shapes.
             shape_dict.update({"narrow (vals are placeholders)": [self.freq_array[0], self.freq_array[-1]]})
 
-        version_info_list = [f'%s: %s, ' % (key, version.version_info[key]) for key in version.version_info]
-        version_hist_substr = reduce(lambda x, y: x + y, version_info_list)
+        version_hist_substr = version.get_version_str()
 
         yaml_dict = {"freqs": [float(freq) for freq in self.freq_array],
                      "shape_dict": {shape: [float(shape_dict[shape][0]), float(shape_dict[shape][1])] for shape in shape_dict},
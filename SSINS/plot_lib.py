@@ -3,7 +3,6 @@ A simple plotting library used by SSINS.Catalog_Plot. Direct interaction with
 these functions is unnecessary.
 """
 import numpy as np
-from astropy.time import Time
 import warnings
 
 
@@ -49,6 +48,7 @@ def image_plot(fig, ax, data, cmap=None, vmin=None, vmax=None, title='',
     """
 
     from matplotlib import colors, cm
+    from astropy.time import Time
 
     if cmap is None:
         cmap = cm.viridis
@@ -128,7 +128,7 @@ def hist_plot(fig, ax, data, bins='auto', yscale='log', xscale='linear',
               label='', legend=True, title='', xlabel='', ylim=None,
               density=False, model_func=None, error_sig=0, model_label='',
               color='blue', model_color='orange', alpha=0.5,
-              font_size='medium', **model_kwargs):
+              font_size='medium', counts=None, **model_kwargs):
 
     """
     A function that calculates and plots histograms. Can also make models using
@@ -155,9 +155,17 @@ def hist_plot(fig, ax, data, bins='auto', yscale='log', xscale='linear',
         alpha: The transparency parameter for the error shades.
         model_kwargs: Additional kwargs not included in the above list will be passed to model_func
         font_size: Fontsize is set globally here
+        counts: Optional. Counts that have already been histogrammed into the
+            bin edges given by bins, e.g. from a VDH. If passed, data is ignored.
     """
 
-    counts, bins = np.histogram(data, bins=bins, density=density)
+    if counts is None:
+        counts, bins = np.histogram(data, bins=bins, density=density)
+        N = np.prod(data.shape)
+    else:
+        N = np.sum(counts)
+        if density:
+            counts = counts / (N * np.diff(bins))
     counts = np.append(counts, 0)
     ax.plot(bins, counts, label=label, drawstyle='steps-post', color=color)
 
@@ -178,7 +186,6 @@ def hist_plot(fig, ax, data, bins='auto', yscale='log', xscale='linear',
             model_y = model_prob * np.sum(counts)
         model_y = np.append(model_y, 0)
         if error_sig:
-            N = np.prod(data.shape)
             yerr = np.sqrt(N * model_prob * (1 - model_prob))
             if density:
                 yerr /= (N * np.diff(bins))
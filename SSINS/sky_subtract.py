@@ -5,11 +5,200 @@ documentation for attributes that are not listed here.
 """
 import numpy as np
 from pyuvdata import UVData
-import scipy.stats
+import os
+import shutil
 import warnings
 import traceback
 
 
+def _pair_mean(arr_0, arr_1):
+    """The midpoint of two arrays, used to combine metadata during differencing."""
+    return(0.5 * (arr_0 + arr_1))
+
+
+def _is_baseline_ordered(uv):
+    """
+    Whether the blts of a UVData object are sorted by baseline number and then
+    by time. This checks the arrays themselves, since blt_order is only a label.
+    """
+    # Compare neighbours rather than using np.diff, which wraps for unsigned baselines
+    bls, times = uv.baseline_array, uv.time_array
+    in_order = (bls[1:] > bls[:-1]) | ((bls[1:] == bls[:-1]) & (times[1:] > times[:-1]))
+    return(bool(np.all(in_order)))
+
+
+def _rayleigh_mixture(bins, MLE, N_spec, chunk_size=256):
+    """
+    Calculates the probabilities of landing in each bin for a mixture of
+    Rayleigh distributions, one per frequency channel.
+
+    Args:
+        bins: The bin edges of the bins to calculate the probabilities for.
+        MLE: The Rayleigh scale for each channel. Masked or nonpositive
+            channels do not contribute.
+        N_spec: The number of samples in each channel, which weights the mixture.
+        chunk_size (int): The number of channels to evaluate at once.
+
+    Returns:
+        prob: The probability to land in each bin
+    """
+    # Calculate the fraction belonging to each frequency
+    chi_spec = N_spec / np.sum(N_spec)
+
+    # Fully flagged channels have a masked MLE and do not contribute
+    MLE = np.ma.filled(MLE, 0)
+    chans = np.nonzero(MLE > 0)[0]
+    bins = np.asarray(bins, dtype=float)
+
+    # initialize the probability array
+    prob = np.zeros(len(bins) - 1)
+    # Calculate the mixture distribution a chunk of frequencies at a time
+    for chunk_start in range(0, len(chans), chunk_size):
+        chunk = chans[chunk_start:chunk_start + chunk_size]
+        # The Rayleigh cdf, 1 - exp(-x^2 / 2 sigma^2), computed the same way as scipy.stats.rayleigh.cdf
+        x = bins / MLE[chunk, np.newaxis]
+        quants = np.where(x > 0, -np.expm1(-0.5 * x**2), 0)
+        prob += chi_spec[chunk] @ np.diff(quants, axis=1)
+
+    return(prob)
+
+
+class PackedMask():
+
+    """
+    Defines the PackedMask class, which stores a boolean mask with eight
+    samples per byte along its frequency axis. Logical OR/AND, time
+    propagation and counting work on the packed bytes directly.
+    """
+
+    # The number of set bits in each possible byte
+    _popcount = np.unpackbits(np.arange(256, dtype=np.uint8)[:, np.newaxis], axis=1).sum(axis=1)
+
+    def __init__(self, mask, freq_axis=-2):
+
+        """
+        Args:
+            mask: The boolean mask to pack
+            freq_axis (int): The frequency axis of mask. The default works for
+                SS.data_array and INS.metric_array.
+        """
+        mask = np.asarray(mask, dtype=bool)
+        self.shape = mask.shape
+        """The shape of the unpacked mask"""
+        self.freq_axis = freq_axis % mask.ndim
+        """The axis of the mask that is packed"""
+        self.packed = np.packbits(mask, axis=self.freq_axis)
+        """The packed mask, as an array of uint8"""
+
+    @classmethod
+    def zeros(cls, shape, freq_axis=-2):
+        """
+        Makes an all False PackedMask without making the boolean mask.
+
+        Args:
+            shape: The shape of the unpacked mask
+            freq_axis (int): The frequency axis of the mask
+
+        Returns:
+            packed_mask (PackedMask): The empty mask
+        """
+        freq_axis = freq_axis % len(shape)
+        packed_shape = list(shape)
+        packed_shape[freq_axis] = -(-shape[freq_axis] // 8)
+
+        return(cls._from_packed(np.zeros(packed_shape, dtype=np.uint8), tuple(shape), freq_axis))
+
+    @classmethod
+    def _from_packed(cls, packed, shape, freq_axis):
+        """Makes a PackedMask from packed bytes."""
+        new = cls.__new__(cls)
+        new.shape = shape
+        new.freq_axis = freq_axis % len(shape)
+        new.packed = packed
+
+        return(new)
+
+    def unpack(self, index=Ellipsis):
+        """
+        Args:
+            index: Only unpack this index (e.g. a slice or array of indices)
+                of the first axis. The first axis must not be the packed one.
+
+        Returns:
+            mask: The mask as a boolean array
+        """
+        if index is Ellipsis:
+            packed = self.packed
+        elif self.freq_axis == 0:
+            raise ValueError("Cannot index the packed axis.")
+        else:
+            packed = self.packed[index]
+        mask = np.unpackbits(packed, axis=self.freq_axis,
+                             count=self.shape[self.freq_axis]).astype(bool)
+
+        return(mask)
+
+    def _new(self, packed, shape):
+        """Makes a PackedMask with the same frequency axis from packed bytes."""
+        return(self._from_packed(packed, shape, self.freq_axis))
+
+    def _check_other(self, other):
+        """Checks that two PackedMask objects can be combined bytewise."""
+        if (self.shape != other.shape) or (self.freq_axis != other.freq_axis):
+            raise ValueError("PackedMask objects have different shapes or frequency axes.")
+
+    def __or__(self, other):
+        self._check_other(other)
+        return(self._new(self.packed | other.packed, self.shape))
+
+    def __and__(self, other):
+        self._check_other(other)
+        return(self._new(self.packed & other.packed, self.shape))
+
+    def count(self, axis=None):
+        """
+        Counts the True samples, like np.count_nonzero on the unpacked mask.
+        Counting over the frequency axis only uses the packed bytes. The
+        padding bits are always zero, so they do not contribute.
+
+        Args:
+            axis: None, or an axis or tuple of axes to count over.
+
+        Returns:
+            count: The number of True samples
+        """
+        if axis is None:
+            axis = tuple(range(len(self.shape)))
+        axes = np.atleast_1d(axis) % len(self.shape)
+        if self.freq_axis in axes:
+            count = np.sum(self._popcount[self.packed], axis=tuple(axes))
+        else:
+            count = np.count_nonzero(self.unpack(), axis=tuple(axes))
+
+        return(count)
+
+    def time_propagate(self):
+        """
+        Propagates the mask along the first (time) axis the same way as
+        INS.mask_to_flags, so that each time flags itself and the next one.
+
+        Returns:
+            tp_mask (PackedMask): The propagated mask, one time longer.
+        """
+        if self.freq_axis == 0:
+            raise ValueError("Cannot propagate in time along the packed axis.")
+        tp_packed = np.zeros((self.packed.shape[0] + 1, ) + self.packed.shape[1:], dtype=np.uint8)
+        tp_packed[:-1] = self.packed
+        tp_packed[1:] |= self.packed
+
+        return(self._new(tp_packed, (self.shape[0] + 1, ) + self.shape[1:]))
+
+    @property
+    def nbytes(self):
+        """The memory used by the packed mask, in bytes"""
+        return(self.packed.nbytes)
+
+
 class SS(UVData):
 
     """
@@ -25,9 +214,11 @@ class SS(UVData):
         self.MLE = None
         """Array of length Nfreqs that stores maximum likelihood estimators for
         each frequency, calculated using the MLE_calc method"""
+        self.packed_mask = None
+        """The mask of data_array as a PackedMask while it is packed with pack_mask"""
 
     def read(self, filename, diff=False, flag_choice=None, INS=None, custom=None,
-             **kwargs):
+             diff_chunk_size=None, pack_mask=False, **kwargs):
 
         """
         Reads in a file that is compatible with UVData object by first calling
@@ -40,6 +231,8 @@ class SS(UVData):
             flag_choice: Sets flags for the data array on read using apply_flags method.
             INS: An INS object for apply_flags()
             custom: A custom flag array for apply_flags()
+            diff_chunk_size (int): Passed to diff() as chunk_size
+            pack_mask (bool): Passed to apply_flags() as pack
             kwargs: Additional kwargs are passed to UVData.read()
         """
         warnings.warn("SS.read will be renamed to SS.read_data soon to avoid"
@@ -49,8 +242,9 @@ class SS(UVData):
 
         if (self.data_array is not None):
             if diff:
-                self.diff()
-                self.apply_flags(flag_choice=flag_choice, INS=INS, custom=custom)
+                self.diff(chunk_size=diff_chunk_size)
+                self.apply_flags(flag_choice=flag_choice, INS=INS, custom=custom,
+                                 pack=pack_mask)
             else:
                 # This warning will be issued when diff is False and there is some data read in
                 # If filename is a list of files, then this warning will get issued in the recursive call in UVData.read
@@ -61,7 +255,7 @@ class SS(UVData):
                     warnings.warn("flag_choice will be ignored on read since"
                                   " diff is being skipped.")
 
-    def apply_flags(self, flag_choice=None, INS=None, custom=None):
+    def apply_flags(self, flag_choice=None, INS=None, custom=None, pack=False):
         """
         A function which applies flags to the data via numpy masked arrays. Also
         changes the SS.flag_choice attribute.
@@ -75,36 +269,87 @@ class SS(UVData):
                 - it must be the same shape as the data.
             INS: An INS from which to apply flags - only used if flag_choice='INS'
             custom: A custom flag array from which to apply flags - only used if flag_choice='custom'
+            pack (bool): If True, the mask is made straight into the
+                packed_mask attribute as a PackedMask, as if pack_mask() had
+                been called, without ever making the full boolean mask.
         """
         if not isinstance(self.data_array, np.ma.MaskedArray):
             self.data_array = np.ma.masked_array(self.data_array)
         self.flag_choice = flag_choice
         self.MLE = None
-        if flag_choice is 'original':
-            self.data_array.mask = np.copy(self.flag_array)
-        elif flag_choice is 'INS':
+        self.packed_mask = None
+        shape = self.data_array.shape
+        if flag_choice == 'original':
+            mask = self.flag_array
+        elif flag_choice == 'INS':
             if not np.all(INS.time_array == np.unique(self.time_array)):
                 raise ValueError("INS object and SS object have incompatible time arrays. Cannot apply flags.")
-            self.data_array.mask[:] = False
-            for time_ind, time in enumerate(INS.time_array):
-                freq_inds, pol_inds = np.where(INS.metric_array.mask[time_ind])
-                # Skip if nothing to flag
-                if len(freq_inds) > 0:
-                    blt_inds = np.where(self.time_array == time)
-                    self.data_array.mask[blt_inds, :, freq_inds, pol_inds] = True
-        elif flag_choice is 'custom':
-            self.data_array.mask[:] = False
-            if custom is not None:
-                self.data_array[custom] = np.ma.masked
-            else:
+            # Look up the INS time of each blt, then gather the packed waterfall
+            # mask onto the blt axis
+            time_inds = np.searchsorted(INS.time_array, self.time_array)
+            INS_mask = PackedMask(np.ma.getmaskarray(INS.metric_array))
+            mask = PackedMask._from_packed(INS_mask.packed[time_inds, np.newaxis],
+                                           shape, -2)
+        elif flag_choice == 'custom':
+            mask = custom
+            if custom is None:
                 warnings.warn("Custom flags were chosen, but custom flags were None type. Setting flag_choice to None and unmasking data.")
                 self.flag_choice = None
         elif flag_choice is None:
-            self.data_array.mask = np.zeros(self.data_array.shape, dtype=bool)
+            mask = None
         else:
             raise ValueError('flag_choice of %s is unacceptable, aborting.' % flag_choice)
 
-    def diff(self):
+        if pack:
+            if mask is None:
+                mask = PackedMask.zeros(shape)
+            elif not isinstance(mask, PackedMask):
+                mask = PackedMask(mask)
+            self.packed_mask = mask
+            # Setting the mask to nomask would keep the old mask array
+            self.data_array = np.ma.masked_array(self.data_array.data)
+        elif mask is None:
+            self.data_array.mask = np.zeros(shape, dtype=bool)
+        elif isinstance(mask, PackedMask):
+            self.data_array.mask = mask.unpack()
+        elif flag_choice == 'custom':
+            self.data_array.mask = np.zeros(shape, dtype=bool)
+            self.data_array[custom] = np.ma.masked
+        else:
+            self.data_array.mask = np.copy(mask)
+
+    def pack_mask(self):
+        """
+        Moves the mask of data_array into the packed_mask attribute as a
+        PackedMask, which uses an eighth of the memory, leaving data_array
+        unmasked. INS construction, rev_ind, write and write_flags use the
+        packed mask directly. Other methods that need the mask raise an error
+        until unpack_mask is called. To avoid making the full boolean mask in
+        the first place, use apply_flags(pack=True) instead.
+        """
+        if not isinstance(self.data_array, np.ma.MaskedArray):
+            self.apply_flags()
+        self.packed_mask = PackedMask(np.ma.getmaskarray(self.data_array))
+        self.data_array = np.ma.masked_array(self.data_array.data)
+
+    def unpack_mask(self):
+        """
+        Restores the mask of data_array from the packed_mask attribute.
+        """
+        if self.packed_mask is None:
+            raise ValueError("The mask is not packed.")
+        self.data_array.mask = self.packed_mask.unpack()
+        self.packed_mask = None
+
+    def _check_unpacked(self):
+        """
+        Raises an error if the mask is packed, since data_array is unmasked
+        while it is.
+        """
+        if self.packed_mask is not None:
+            raise ValueError("The mask is packed. Call unpack_mask first.")
+
+    def diff(self, chunk_size=None):
 
         """
         Differences the visibilities in time. Does so independently for each baseline,
@@ -113,51 +358,52 @@ class SS(UVData):
         to the visibilities that are differenced from one another. Other metadata
         attributes are also adjusted so that the resulting SS object passes
         UVData.check()
+
+        Args:
+            chunk_size (int): If None, all differences are computed at once
+                into new arrays. Otherwise, the differences are written back
+                into the existing arrays chunk_size baseline-times at a time,
+                so that the extra memory needed is bounded by the chunk rather
+                than by the size of the visibilities. The results are identical.
         """
 
+        self._check_unpacked()
         if self.blt_order != 'baseline':
             warnings.warn("Reordering data array to baseline order to perform differencing.")
             self.reorder_blts(order='baseline')
 
-        # index accumulator
-        ind_acc = 0
-        # Just treat every baseline independently - make no assumptions other than what is guaranteed by baseline ordered objects
-        for bl in np.unique(self.baseline_array):
-            diff_dat = np.diff(self.get_data(bl, squeeze='none'), axis=0)
-            diff_flags = np.logical_or(self.get_flags(bl, squeeze='none')[:-1],
-                                       self.get_flags(bl, squeeze='none')[1:])
-            diff_times = self.get_times(bl)
-            diff_times = 0.5 * (diff_times[:-1] + diff_times[1:])
-            diff_nsamples = self.get_nsamples(bl, squeeze='none')
-            diff_nsamples = 0.5 * (diff_nsamples[:-1] + diff_nsamples[1:])
-
-            len_diff = diff_dat.shape[0]
-            blt_slice = slice(ind_acc, ind_acc + len_diff)
-
-            self.data_array[blt_slice, :, :, :] = diff_dat
-            """The time-differenced visibilities. Complex array of shape (Nblts, Nspws, Nfreqs, Npols)."""
-            self.flag_array[blt_slice, :, :, :] = diff_flags
-            """The flag array, which results from boolean OR of the flags corresponding to visibilities that are differenced from one another."""
-
-            self.time_array[blt_slice] = diff_times
-            """The center time of the differenced visibilities. Length Nblts."""
-            self.nsample_array[blt_slice, :, :, :] = diff_nsamples
-            """See pyuvdata documentation. Here we average the nsample_array of the visibilities that are differenced"""
-
-            where_bl = np.where(self.baseline_array == bl)
-
-            diff_ints = self.integration_time[where_bl]
-            diff_ints = diff_ints[:-1] + diff_ints[1:]
-            diff_uvw = self.uvw_array[where_bl]
-            diff_uvw = 0.5 * (diff_uvw[:-1] + diff_uvw[1:])
-
-            self.integration_time[blt_slice] = diff_ints
-            """Total amount of integration time (sum of the differenced visibilities) at each baseline-time (length Nblts)"""
-            self.uvw_array[blt_slice] = diff_uvw
-
-            self.baseline_array[blt_slice] = bl
-            self.ant_1_array[blt_slice], self.ant_2_array[blt_slice] = self.baseline_to_antnums(bl)
-            ind_acc += len_diff
+        # Every pair of adjacent blts that belong to the same baseline is a pair
+        # of visibilities to difference. Find them all at once.
+        pair_inds = self._diff_pair_inds()
+        if (chunk_size is not None) and (pair_inds is not None):
+            # Writing in place is only safe if no pair reads from a blt that
+            # has already been overwritten. Always true for sorted baselines.
+            if np.any(pair_inds[0] < np.arange(len(pair_inds[0]))):
+                chunk_size = None
+
+        self.data_array = self._diff_blt_array(self.data_array, lambda arr_0, arr_1: arr_1 - arr_0,
+                                               pair_inds, chunk_size)
+        """The time-differenced visibilities. Complex array of shape (Nblts, Nspws, Nfreqs, Npols)."""
+        self.flag_array = self._diff_blt_array(self.flag_array, np.logical_or,
+                                               pair_inds, chunk_size)
+        """The flag array, which results from boolean OR of the flags corresponding to visibilities that are differenced from one another."""
+        self.time_array = self._diff_blt_array(self.time_array, _pair_mean,
+                                               pair_inds, chunk_size)
+        """The center time of the differenced visibilities. Length Nblts."""
+        self.nsample_array = self._diff_blt_array(self.nsample_array, _pair_mean,
+                                                  pair_inds, chunk_size)
+        """See pyuvdata documentation. Here we average the nsample_array of the visibilities that are differenced"""
+        self.integration_time = self._diff_blt_array(self.integration_time, np.add,
+                                                     pair_inds, chunk_size)
+        """Total amount of integration time (sum of the differenced visibilities) at each baseline-time (length Nblts)"""
+        self.uvw_array = self._diff_blt_array(self.uvw_array, _pair_mean,
+                                              pair_inds, chunk_size)
+
+        # Both members of each pair belong to the same baseline, so just take the first
+        for blts_attr in ['baseline_array', 'ant_1_array', 'ant_2_array']:
+            setattr(self, blts_attr, self._diff_blt_array(getattr(self, blts_attr),
+                                                          lambda arr_0, arr_1: arr_0,
+                                                          pair_inds, chunk_size))
 
         # Adjust the UVData attributes.
         self.Nblts -= self.Nbls
@@ -165,14 +411,110 @@ class SS(UVData):
         self.Ntimes -= 1
         """Total number of integration times in the data. Equal to the original Ntimes-1."""
 
-        for blts_attr in ['data_array', 'flag_array', 'time_array',
-                          'nsample_array', 'integration_time', 'baseline_array',
-                          'ant_1_array', 'ant_2_array', 'uvw_array']:
-            setattr(self, blts_attr, getattr(self, blts_attr)[:-self.Nbls])
-
         super().set_lsts_from_time_array()
         self.data_array = np.ma.masked_array(self.data_array)
 
+    def _diff_pair_inds(self):
+        """
+        Finds the pairs of baseline-times that are differenced from one another
+        in diff(). Baselines are visited in sorted order and the blts of each
+        baseline are kept in the order they appear in the object, which is
+        equivalent to iterating over np.unique(self.baseline_array) and calling
+        get_data() on each baseline.
+
+        Returns:
+            pair_inds:
+                None if the object has a regular layout, i.e. the blts are
+                sorted by baseline and every baseline has Ntimes entries. Then
+                the arrays can be differenced by reshaping instead of indexing.
+                Otherwise a tuple of two index arrays into the blt axis, the
+                first member of each pair and the second member of each pair.
+        """
+        sorted_bls = np.all(self.baseline_array[1:] >= self.baseline_array[:-1])
+        if sorted_bls and (self.Nblts == self.Nbls * self.Ntimes):
+            bl_blocks = self.baseline_array.reshape(self.Nbls, self.Ntimes)
+            if np.all(bl_blocks == bl_blocks[:, :1]):
+                return(None)
+
+        if sorted_bls:
+            bl_sort = np.arange(self.Nblts)
+        else:
+            # A stable sort keeps the blts of each baseline in their original order
+            bl_sort = np.argsort(self.baseline_array, kind='stable')
+        sorted_bl_array = self.baseline_array[bl_sort]
+        same_bl = sorted_bl_array[1:] == sorted_bl_array[:-1]
+
+        return(bl_sort[:-1][same_bl], bl_sort[1:][same_bl])
+
+    def _diff_pairs(self, arr, pair_inds, pair_slice=None):
+        """
+        Gathers the two members of each differencing pair for a blt-axis array.
+
+        Args:
+            arr: An array whose first axis is the blt axis.
+            pair_inds: The output of _diff_pair_inds()
+            pair_slice: If not None, only gather the pairs in this slice of
+                the differenced blt axis.
+
+        Returns:
+            arr_0: The first member of each pair (earlier time)
+            arr_1: The second member of each pair (later time)
+        """
+        if pair_slice is None:
+            if pair_inds is None:
+                block_arr = arr.reshape((self.Nbls, self.Ntimes) + arr.shape[1:])
+                out_shape = (self.Nbls * (self.Ntimes - 1), ) + arr.shape[1:]
+                arr_0 = block_arr[:, :-1].reshape(out_shape)
+                arr_1 = block_arr[:, 1:].reshape(out_shape)
+            else:
+                arr_0 = arr[pair_inds[0]]
+                arr_1 = arr[pair_inds[1]]
+        else:
+            if pair_inds is None:
+                # Each baseline loses one blt, so skip one blt per baseline passed
+                pair_nums = np.arange(pair_slice.start, pair_slice.stop)
+                inds_0 = pair_nums + pair_nums // (self.Ntimes - 1)
+                inds_1 = inds_0 + 1
+            else:
+                inds_0 = pair_inds[0][pair_slice]
+                inds_1 = pair_inds[1][pair_slice]
+            arr_0 = arr[inds_0]
+            arr_1 = arr[inds_1]
+
+        return(arr_0, arr_1)
+
+    def _diff_blt_array(self, arr, diff_func, pair_inds, chunk_size=None):
+        """
+        Combines the pairs of entries of a blt-axis array that are differenced
+        from one another.
+
+        Args:
+            arr: An array whose first axis is the blt axis.
+            diff_func: A function of the earlier and later members of each pair
+                that returns the combined entry.
+            pair_inds: The output of _diff_pair_inds()
+            chunk_size: If None, make a new array. Otherwise, write the result
+                into arr chunk_size pairs at a time.
+
+        Returns:
+            diff_arr: The combined array, of length Nblts - Nbls. If chunk_size
+                is not None, this is a view into arr.
+        """
+        Npairs = self.Nblts - self.Nbls
+        if chunk_size is None:
+            arr_0, arr_1 = self._diff_pairs(arr, pair_inds)
+            diff_arr = diff_func(arr_0, arr_1)
+        else:
+            # Pair k reads from blts at or after k, so writing to blt k never
+            # clobbers an entry that is still needed.
+            for start in range(0, Npairs, chunk_size):
+                pair_slice = slice(start, min(start + chunk_size, Npairs))
+                arr_0, arr_1 = self._diff_pairs(arr, pair_inds, pair_slice=pair_slice)
+                arr[pair_slice] = diff_func(arr_0, arr_1)
+            diff_arr = arr[:Npairs]
+
+        return(diff_arr)
+
     def MLE_calc(self):
 
         """
@@ -180,19 +522,26 @@ class SS(UVData):
         frequency. Used for developing a mixture fit.
         """
 
-        self.MLE = np.sqrt(0.5 * np.mean(np.absolute(self.data_array)**2, axis=(0, 1, -1)))
+        self._check_unpacked()
+        # Accumulate in double precision, even for single precision data
+        self.MLE = np.sqrt(0.5 * np.mean(np.absolute(self.data_array)**2, axis=(0, 1, -1),
+                                         dtype=np.float64))
 
-    def mixture_prob(self, bins):
+    def mixture_prob(self, bins, chunk_size=256):
         """
         Calculates the probabilities of landing in each bin for a given set of
         bins.
 
         Args:
             bins: The bin edges of the bins to calculate the probabilities for.
+            chunk_size (int): The number of frequency channels to evaluate the
+                Rayleigh distributions for at once. Bounds the memory used to
+                chunk_size times the number of bins.
         Returns:
             prob: The probability to land in each bin based on the maximum likelihood model
         """
 
+        self._check_unpacked()
         if not isinstance(self.data_array, np.ma.MaskedArray):
             self.apply_flags()
         if self.MLE is None:
@@ -201,19 +550,7 @@ class SS(UVData):
             _, bins = np.histogram(np.abs(self.data_array[np.logical_not(self.data_array.mask)]))
 
         N_spec = np.sum(np.logical_not(self.data_array.mask), axis=(0, 1, -1))
-        N_total = np.sum(N_spec)
-
-        # Calculate the fraction belonging to each frequency
-        chi_spec = N_spec / N_total
-
-        # initialize the probability array
-        prob = np.zeros(len(bins) - 1)
-        # Calculate the mixture distribution
-        # If this could be vectorized over frequency, that would be better.
-        for chan in range(self.Nfreqs):
-            if self.MLE[chan] > 0:
-                quants = scipy.stats.rayleigh.cdf(bins, scale=self.MLE[chan])
-                prob += chi_spec[chan] * (quants[1:] - quants[:-1])
+        prob = _rayleigh_mixture(bins, self.MLE, N_spec, chunk_size=chunk_size)
 
         return(prob)
 
@@ -237,14 +574,72 @@ class SS(UVData):
 
         """
 
+        rev_ind_hist = self.rev_ind_bands([band])[0]
+        return(rev_ind_hist)
+
+    def rev_ind_bands(self, bands, chunk_size=1000):
+
+        """
+        Reverse indexes sky-subtracted visibilities for several amplitude bands
+        at once. Equivalent to calling rev_ind() for each band, but the
+        amplitudes are only calculated once, and every band is counted with a
+        single histogram. The blts do not need to be in any particular order,
+        and baselines may have different numbers of times.
+
+        Args:
+            bands: A sequence of bands, each of which holds the minimum and
+                maximum amplitudes to be sought. The bands may overlap.
+            chunk_size (int): The number of blts to histogram at a time, which
+                bounds the temporary arrays to a few times the size of the
+                chunk. If None, histogram all of them at once.
+        Returns:
+            rev_ind_hist:
+                An array of shape (Nbands, Ntimes, Nfreqs, Npols), where each
+                band has a time-frequency waterfall per polarization counting
+                the number of baselines whose sky-subtracted visibility
+                amplitude fell within the band. The times are in increasing order.
+        """
+
         if not isinstance(self.data_array, np.ma.MaskedArray):
             self.apply_flags()
-        where_band = np.logical_and(np.absolute(self.data_array) > min(band),
-                                    np.absolute(self.data_array) < max(band))
-        where_band_mask = np.logical_and(np.logical_not(self.data_array.mask),
-                                         where_band)
-        shape = [self.Ntimes, self.Nbls, self.Nfreqs, self.Npols]
-        rev_ind_hist = np.sum(where_band_mask.reshape(shape), axis=1)
+        bands = np.array([[min(band), max(band)] for band in bands])
+        edges, edge_inds = np.unique(bands, return_inverse=True)
+        edge_inds = edge_inds.reshape(bands.shape)
+        times, time_inds = np.unique(self.time_array, return_inverse=True)
+        Nbuckets = 2 * len(edges) + 1
+        wf_shape = (len(times), self.Nfreqs, self.Npols)
+        Nwf = np.prod(wf_shape)
+        if chunk_size is None:
+            chunk_size = max(self.Nblts, 1)
+
+        # Histogram chunk_size blts at a time into the counts of every bucket
+        # at every waterfall sample
+        counts = np.zeros(Nbuckets * Nwf, dtype=np.int64)
+        sample_inds = np.arange(self.Nfreqs * self.Npols)
+        for chunk_start in range(0, self.Nblts, chunk_size):
+            chunk_slice = slice(chunk_start, chunk_start + chunk_size)
+            amp = np.absolute(self.data_array.data[chunk_slice]).reshape((-1, self.Nfreqs * self.Npols))
+            # The bands do not include their bounds, so the even buckets are the
+            # open intervals between the edges and the odd buckets are the edges.
+            # Combining the bucket and waterfall sample into one index as soon as
+            # possible keeps a single chunk-sized index array.
+            inds = np.searchsorted(edges, amp)
+            on_edge = edges[np.minimum(inds, len(edges) - 1)] == amp
+            del amp
+            inds *= 2
+            inds += on_edge
+            del on_edge
+            # No band includes the bucket below the lowest edge
+            inds[self._get_mask(chunk_slice).reshape(inds.shape)] = 0
+            inds *= Nwf
+            inds += time_inds[chunk_slice, np.newaxis] * (self.Nfreqs * self.Npols)
+            inds += sample_inds
+            counts += np.bincount(inds.ravel(), minlength=Nbuckets * Nwf)
+        counts = np.cumsum(counts.reshape((Nbuckets, ) + wf_shape), axis=0)
+        # Everything past the lower edge, up to and not including the upper edge
+        rev_ind_hist = counts[2 * edge_inds[:, 1]] - counts[2 * edge_inds[:, 0] + 1]
+        # Nothing is strictly between equal bounds
+        rev_ind_hist[edge_inds[:, 0] == edge_inds[:, 1]] = 0
         return(rev_ind_hist)
 
     def write(self, filename_out, file_type_out, UV=None, filename_in=None,
@@ -259,6 +654,8 @@ class SS(UVData):
         and flag_array get combined into the weights when writing uvfits,
         areas where the nsample_array == 0 are set to nsample_default so that
         new flags can actually be propagated to those data in the new uvfits file.
+        To write the flags into a copy of a uvh5 file without reading its
+        visibilities, use write_flags() instead.
 
         Args:
             filename_out: The name of the file to write to. *Required*
@@ -275,7 +672,9 @@ class SS(UVData):
             write_kwargs: A keyword dictionary for the selected UVData write method. See pyuvdata documentation for write keywords.
         """
 
-        if self.blt_order != 'baseline':
+        if not _is_baseline_ordered(self):
+            # The packed mask would not be reordered with the data
+            self._check_unpacked()
             warnings.warn("Reordering data array to baseline order to propagate flags.")
             self.reorder_blts(order='baseline')
         if UV is None:
@@ -291,25 +690,261 @@ class SS(UVData):
             warnings.warn("Some nsamples are 0, which will result in failure to propagate flags. Setting nsample to default values where 0.")
             UV.nsample_array[UV.nsample_array == 0] = nsample_default
 
-        # index accumulator
-        ind_acc = 0
-        if UV.blt_order != 'baseline':
+        if not _is_baseline_ordered(UV):
             UV.reorder_blts(order='baseline')
-        for bl in np.unique(self.baseline_array):
-            try:
-                uv_times = UV.get_times(bl)
-                self_times = self.get_times(bl)
-                time_compat = np.all(self_times == 0.5 * (uv_times[:-1] + uv_times[1:]))
-                assert time_compat
-            except Exception:
-                raise ValueError("UVData and SS objects were found to be incompatible."
-                                 " Check that the SS and UVData objects were read appropriately!")
-
-            new_flags = self.get_data(bl, squeeze='none').mask
-            end_ind = new_flags.shape[0] + 1 + ind_acc
-            UV.flag_array[ind_acc:end_ind - 1][new_flags] = 1
-            UV.flag_array[ind_acc + 1:end_ind][new_flags] = 1
-            ind_acc = end_ind
+        uv_inds = self._undiff_blt_inds(UV)
+
+        new_flags = self._get_mask()
+        # Each differenced visibility flags both visibilities it came from
+        UV.flag_array[uv_inds] |= new_flags
+        UV.flag_array[uv_inds + 1] |= new_flags
 
         # Write file
         getattr(UV, 'write_%s' % file_type_out)(filename_out, **write_kwargs)
+
+    def write_flags(self, filename_out, filename_in, combine=True,
+                    chunk_size=10000, clobber=False):
+
+        """
+        Writes out the flags to a copy of a uvh5 file without reading its
+        visibilities. The flags are extended in time in the same way as in
+        write(). Only the metadata of filename_in is read, in order to match
+        the baseline-times. The file is then copied as is, and the flag
+        dataset of the copy is rewritten chunk_size baseline-times at a time,
+        so the cost is proportional to the size of the flags rather than the
+        visibilities.
+
+        Args:
+            filename_out: The name of the uvh5 file to write to. *Required*
+            filename_in: The uvh5 file that was differenced to make this object. *Required*
+            combine (bool): If True, combine the original flags with the new flags (OR them), else just use the new flags.
+            chunk_size (int): The number of baseline-times of the flag dataset to rewrite at a time.
+            clobber (bool): Whether to overwrite filename_out if it exists.
+        """
+        import h5py
+
+        if not h5py.is_hdf5(filename_in):
+            raise ValueError("write_flags only supports uvh5 files.")
+        if os.path.exists(filename_out) and not clobber:
+            raise IOError("File exists; skipping")
+
+        if not _is_baseline_ordered(self):
+            # The packed mask would not be reordered with the data
+            self._check_unpacked()
+            warnings.warn("Reordering data array to baseline order to propagate flags.")
+            self.reorder_blts(order='baseline')
+        UV = UVData()
+        UV.read(filename_in, file_type='uvh5', read_data=False)
+        # Remember where each blt is in the file
+        file_inds = np.lexsort((UV.time_array, UV.baseline_array))
+        UV.reorder_blts(order=file_inds)
+        uv_inds = self._undiff_blt_inds(UV)
+
+        # For each blt of the file, the blts of this object that flag it, or -1
+        blt_nums = np.arange(self.Nblts)
+        earlier = np.full(UV.Nblts, -1)
+        earlier[file_inds[uv_inds]] = blt_nums
+        later = np.full(UV.Nblts, -1)
+        later[file_inds[uv_inds + 1]] = blt_nums
+
+        new_flags = self._get_mask()
+        shutil.copyfile(filename_in, filename_out)
+        with h5py.File(filename_out, 'r+') as f:
+            flag_dset = f['Data/flags']
+            for start in range(0, UV.Nblts, chunk_size):
+                stop = min(start + chunk_size, UV.Nblts)
+                if combine:
+                    flags = flag_dset[start:stop]
+                else:
+                    flags = np.zeros((stop - start, ) + flag_dset.shape[1:], dtype=bool)
+                for self_inds in [earlier[start:stop], later[start:stop]]:
+                    has_flags = self_inds > -1
+                    flags[has_flags] |= new_flags[self_inds[has_flags]].reshape((-1, ) + flag_dset.shape[1:])
+                flag_dset[start:stop] = flags
+
+    def _get_mask(self, index=Ellipsis):
+        """
+        Gets the boolean mask of the data array, unpacking it if it is packed.
+
+        Args:
+            index: Only get the mask of this index (e.g. a slice) of the blts.
+        """
+        if self.packed_mask is not None:
+            mask = self.packed_mask.unpack(index)
+        else:
+            mask = np.ma.getmaskarray(self.data_array[index])
+
+        return(mask)
+
+    def _undiff_blt_inds(self, UV):
+        """
+        Finds the baseline-times of an undifferenced UVData object that each
+        baseline-time of this (differenced) object came from. Both objects
+        must be sorted by baseline and then time (see _is_baseline_ordered).
+        Baselines in UV that are not in this object are skipped over, so
+        baselines may have different numbers of times.
+
+        Args:
+            UV: The undifferenced UVData object
+
+        Returns:
+            uv_inds: For each blt of this object, the index of the earlier of
+                the two blts in UV that were differenced. The later one is the
+                next index.
+        """
+        if not (_is_baseline_ordered(self) and _is_baseline_ordered(UV)):
+            raise ValueError("The SS and UVData objects must be sorted by baseline"
+                             " and then time to match their baseline-times.")
+        self_bls, self_starts, self_counts = np.unique(self.baseline_array,
+                                                       return_index=True,
+                                                       return_counts=True)
+        uv_bls, uv_starts, uv_counts = np.unique(UV.baseline_array,
+                                                 return_index=True,
+                                                 return_counts=True)
+        bl_inds = np.searchsorted(uv_bls, self_bls)
+        bl_inds[bl_inds == len(uv_bls)] = 0
+        compat = np.all(uv_bls[bl_inds] == self_bls) and np.all(uv_counts[bl_inds] == self_counts + 1)
+        if compat:
+            # Offset each blt by where its baseline starts in UV instead of here
+            bl_offsets = np.repeat(uv_starts[bl_inds] - self_starts, self_counts)
+            uv_inds = np.arange(self.Nblts) + bl_offsets
+            uv_times = UV.time_array[uv_inds], UV.time_array[uv_inds + 1]
+            compat = np.all(self.time_array == 0.5 * (uv_times[0] + uv_times[1]))
+        if not compat:
+            raise ValueError("UVData and SS objects were found to be incompatible."
+                             " Check that the SS and UVData objects were read appropriately!")
+
+        return(uv_inds)
+
+
+class VDH():
+
+    """
+    Defines the VDH class, which accumulates the statistics of a visibility
+    difference histogram (VDH) one chunk of visibilities at a time: the
+    histogram counts in each frequency channel, and the sums needed for the
+    Rayleigh maximum likelihood estimator of each channel. Each amplitude is
+    only visited once, and the amplitudes of a whole observation never need to
+    be in memory together.
+    """
+
+    def __init__(self, bins, Nfreqs):
+
+        """
+        Args:
+            bins: The bin edges of the histogram. These must be known before
+                accumulating, so unlike numpy.histogram a string or number of
+                bins is not accepted.
+            Nfreqs: The number of frequency channels
+        """
+        self.bins = np.asarray(bins, dtype=float)
+        """The bin edges of the histogram"""
+        self.counts = np.zeros((Nfreqs, len(self.bins) - 1), dtype=int)
+        """The histogram counts in each frequency channel, shape (Nfreqs, Nbins)"""
+        self.N_spec = np.zeros(Nfreqs, dtype=int)
+        """The number of unflagged amplitudes in each channel, including those outside of the bins"""
+        self.square_sum = np.zeros(Nfreqs)
+        """The sum of the squared unflagged amplitudes in each channel"""
+        self.MLE = None
+        """Array of length Nfreqs that stores maximum likelihood estimators for
+        each frequency, calculated using the MLE_calc method"""
+
+    @classmethod
+    def from_files(cls, filenames, bins, chunk_bls=None, diff=True,
+                   flag_choice='original', **read_kwargs):
+        """
+        Accumulates a VDH from visibility files by reading chunk_bls baselines
+        at a time.
+
+        Args:
+            filenames (str or list of str): The visibility file(s) to read
+            bins: The bin edges of the histogram
+            chunk_bls (int): The number of baselines to read at a time. If None,
+                read all baselines at once.
+            diff (bool): Whether to difference the visibilities in time on read
+            flag_choice (None or 'original'): Passed to SS.read for each chunk.
+            read_kwargs: Additional keywords passed to SS.read for each chunk.
+
+        Returns:
+            vdh: The VDH of all the baselines in the files.
+        """
+        uvd = UVData()
+        uvd.read(filenames, read_data=False, **read_kwargs)
+        antpairs = uvd.get_antpairs()
+        vdh = cls(bins, uvd.Nfreqs)
+        del uvd
+        if chunk_bls is None:
+            chunk_bls = len(antpairs)
+
+        for chunk_ind in range(0, len(antpairs), chunk_bls):
+            ss = SS()
+            ss.read(filenames, bls=antpairs[chunk_ind:chunk_ind + chunk_bls],
+                    diff=diff, flag_choice=flag_choice, **read_kwargs)
+            if not isinstance(ss.data_array, np.ma.MaskedArray):
+                ss.apply_flags()
+            vdh.accumulate(np.absolute(ss.data_array.data), mask=ss.data_array.mask)
+
+        return(vdh)
+
+    def accumulate(self, amp, mask=None):
+        """
+        Adds a chunk of visibility amplitudes to the histogram counts and MLE
+        sums.
+
+        Args:
+            amp: The amplitudes, with frequency on the second to last axis,
+                e.g. a slice of np.absolute(SS.data_array) along the blt axis.
+            mask: Optional. A boolean array the same shape as amp. True
+                amplitudes are left out.
+        """
+        Nbins = len(self.bins) - 1
+        Nfreqs = amp.shape[-2]
+        if mask is None:
+            valid = np.ones(amp.shape, dtype=bool)
+        else:
+            valid = np.logical_not(mask)
+        sum_axes = tuple(axis for axis in range(amp.ndim) if axis != amp.ndim - 2)
+
+        self.square_sum += np.sum(np.where(valid, amp.astype(float)**2, 0), axis=sum_axes)
+        self.N_spec += np.count_nonzero(valid, axis=sum_axes)
+        self.MLE = None
+
+        # Same conventions as numpy.histogram: the last bin includes its upper
+        # edge, and amplitudes outside of the bins are not counted
+        bin_inds = np.searchsorted(self.bins, amp, side='right') - 1
+        bin_inds[amp == self.bins[-1]] = Nbins - 1
+        in_bins = valid & (bin_inds >= 0) & (bin_inds < Nbins)
+        chans = np.arange(Nfreqs)[:, np.newaxis]
+        flat_inds = (chans * Nbins + bin_inds)[in_bins]
+        self.counts += np.bincount(flat_inds, minlength=Nfreqs * Nbins).reshape(Nfreqs, Nbins)
+
+    def MLE_calc(self):
+        """
+        Calculates maximum likelihood estimators for Rayleigh fits at each
+        frequency from the accumulated sums. Channels with no unflagged
+        amplitudes are masked.
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            MLE = np.sqrt(0.5 * self.square_sum / self.N_spec)
+        self.MLE = np.ma.masked_array(MLE, mask=self.N_spec == 0)
+
+    def mixture_prob(self, bins=None, chunk_size=256):
+        """
+        Calculates the probabilities of landing in each bin from the Rayleigh
+        mixture model of the accumulated amplitudes. See SS.mixture_prob.
+
+        Args:
+            bins: The bin edges to calculate the probabilities for. Defaults
+                to the bins of the histogram.
+            chunk_size (int): The number of frequency channels to evaluate at once.
+        Returns:
+            prob: The probability to land in each bin based on the maximum likelihood model
+        """
+        if bins is None:
+            bins = self.bins
+        if self.MLE is None:
+            self.MLE_calc()
+
+        prob = _rayleigh_mixture(bins, self.MLE, self.N_spec, chunk_size=chunk_size)
+
+        return(prob)
@@ -1,4 +1,5 @@
-from SSINS import INS, SS, version
+from SSINS import INS, SS, MF, version
+from SSINS.match_filter import Event
 from SSINS.data import DATA_PATH
 import numpy as np
 import os
@@ -33,6 +34,15 @@ def test_init():
     # Check that the weights summed correctly
     assert np.all(test_weights == ins.weights_array), "Weights did not sum properly"
 
+    # Reducing all the blts at once, or a number that does not divide them,
+    # gives the same spectrum
+    for chunk_size in [None, 37]:
+        chunk_ins = INS(ss, chunk_size=chunk_size)
+        assert np.allclose(chunk_ins.metric_array, ins.metric_array)
+        assert np.array_equal(chunk_ins.metric_array.mask, ins.metric_array.mask)
+        assert np.array_equal(chunk_ins.weights_array, ins.weights_array)
+        assert np.array_equal(chunk_ins.weights_square_array, ins.weights_square_array)
+
 
 def test_no_diff_start():
     obs = '1061313128_99bl_1pol_half_time'
@@ -102,6 +112,63 @@ def test_polyfit():
     assert np.all(ins.metric_ms.mask), "The metric_ms array was not all masked"
 
 
+def test_polyfit_matches_ma_polyfit():
+
+    obs = '1061313128_99bl_1pol_half_time'
+    testfile = os.path.join(DATA_PATH, '%s.uvfits' % obs)
+
+    ss = SS()
+    ss.read(testfile, flag_choice='original', diff=True)
+
+    x = np.arange(1, ss.Ntimes + 1)
+    for order in range(1, 5):
+        ins = INS(ss, order=order, use_integration_weights=True)
+        # Mask a few samples so the columns have different weights
+        ins.metric_array[::5, ::3] = np.ma.masked
+        ins.metric_array[:, 7] = np.ma.masked
+        MS, coeffs = ins.mean_subtract(return_coeffs=True)
+        for chan in range(ins.Nfreqs):
+            if np.all(ins.metric_array.mask[:, chan, 0]):
+                assert np.all(MS.mask[:, chan, 0]), "Fully masked channel has unmasked z-scores"
+                continue
+            test_coeffs = np.ma.polyfit(x, ins.metric_array[:, chan, 0], order,
+                                        w=ins.weights_array[:, chan, 0])
+            assert np.allclose(coeffs[:, chan, 0], test_coeffs, rtol=1e-8, atol=0), "Coefficients disagree"
+
+
+def test_pack_masks():
+    obs = '1061313128_99bl_1pol_half_time'
+    insfile = os.path.join(DATA_PATH, f'{obs}_SSINS.h5')
+    prefix = os.path.join(DATA_PATH, f'{obs}_test')
+
+    ins = INS(insfile)
+    ins.metric_array[2, 10:20] = np.ma.masked
+    ins.metric_ms = ins.mean_subtract()
+    ins.sig_array = np.ma.copy(ins.metric_ms)
+    masks = {attr: np.ma.getmaskarray(getattr(ins, attr)).copy()
+             for attr in ['metric_array', 'metric_ms', 'sig_array']}
+    tp_flags = ins.mask_to_flags()
+
+    ins.pack_masks()
+    assert ins.metric_array.mask is np.ma.nomask
+    assert ins.packed_masks['metric_array'].count() == np.count_nonzero(masks['metric_array'])
+    # Time propagation runs on the packed mask
+    assert np.array_equal(ins.mask_to_flags(), tp_flags)
+    # Everything else needs the masks, which the arrays do not have while they are packed
+    mf = MF(ins.freq_array, 5)
+    for func, args in [(ins.mean_subtract, ()), (ins.select, ()),
+                       (ins.write, (prefix, )), (ins.__add__, (ins, )),
+                       (INS.concatenate, ([ins, ins], )), (mf.apply_match_test, (ins, ))]:
+        with pytest.raises(ValueError, match="The masks are packed. Call unpack_masks first."):
+            func(*args)
+
+    ins.unpack_masks()
+    for attr in masks:
+        assert np.array_equal(getattr(ins, attr).mask, masks[attr])
+    with pytest.raises(ValueError, match="The masks are not packed."):
+        ins.unpack_masks()
+
+
 def test_mask_to_flags():
     obs = '1061313128_99bl_1pol_half_time'
     testfile = os.path.join(DATA_PATH, '%s.uvfits' % obs)
@@ -219,6 +286,88 @@ def test_write():
         os.remove(path)
 
 
+def test_write_match_events_h5():
+
+    obs = '1061313128_99bl_1pol_half_time_SSINS'
+    testfile = os.path.join(DATA_PATH, '%s.h5' % obs)
+    prefix = os.path.join(DATA_PATH, '%s_test' % obs)
+    yml_outfile = '%s_SSINS_match_events.yml' % prefix
+    h5_outfile = '%s_SSINS_match_events.h5' % prefix
+
+    ins = INS(testfile)
+    # Mock some events
+    ins.match_events.append(Event(slice(0, 1), slice(1, 3), 'shape', 5.))
+    ins.match_events.append(Event(slice(1, 2), slice(4, 10), 'other_shape', None))
+    ins.match_events.append(Event(slice(0, ins.Ntimes), slice(1, 3), 'shape', 7.))
+
+    ins.write(prefix, output_type='match_events', clobber=True)
+    ins.write(prefix, output_type='match_events_h5', clobber=True)
+    with pytest.raises(IOError, match="File exists; skipping"):
+        ins.write(prefix, output_type='match_events_h5')
+
+    assert ins.match_events_read(h5_outfile) == ins.match_events_read(yml_outfile)
+    new_ins = INS(testfile, match_events_file=h5_outfile)
+    assert new_ins.match_events == ins.match_events
+
+    event_array, shape_names = ins.match_events_read(h5_outfile, as_array=True)
+    assert shape_names == ['shape', 'other_shape']
+    assert np.array_equal(event_array['t_stop'], [1, 2, ins.Ntimes])
+    assert np.array_equal(event_array['shape_id'], [0, 1, 0])
+    assert np.isnan(event_array['sig'][1])
+    with pytest.raises(ValueError, match="as_array is only supported for h5 match_events files."):
+        ins.match_events_read(yml_outfile, as_array=True)
+
+    for path in [yml_outfile, h5_outfile]:
+        os.remove(path)
+
+
+def test_write_bundle():
+
+    obs = '1061313128_99bl_1pol_half_time'
+    testfile = os.path.join(DATA_PATH, '%s.uvfits' % obs)
+    prefix = os.path.join(DATA_PATH, '%s_test' % obs)
+    bundle_outfile = '%s_SSINS_bundle.h5' % prefix
+
+    ss = SS()
+    ss.read(testfile, flag_choice='original', diff=True)
+
+    ins = INS(ss)
+    # Mock some events
+    ins.match_events.append(Event(slice(0, 1), slice(1, 3), 'shape', 5.))
+    ins.match_events.append(Event(slice(1, 2), slice(1, 3), 'other_shape', None))
+    ins.metric_array[:2, 1:3] = np.ma.masked
+    ins.metric_ms = ins.mean_subtract()
+    ins.sig_array[:2, 1:3] = 5
+
+    for data_compression in ['lzf', None]:
+        ins.write(prefix, output_type='bundle', clobber=True,
+                  data_compression=data_compression)
+
+        new_ins = INS(bundle_outfile)
+        assert np.all(ins.metric_array == new_ins.metric_array)
+        assert np.all(ins.weights_array == new_ins.weights_array)
+        assert np.all(ins.weights_square_array == new_ins.weights_square_array)
+        assert np.all(ins.metric_array.mask == new_ins.metric_array.mask)
+        # The z-scores are read back rather than recalculated
+        assert np.array_equal(ins.metric_ms.data, new_ins.metric_ms.data)
+        assert np.array_equal(ins.metric_ms.mask, new_ins.metric_ms.mask)
+        assert np.all(ins.sig_array.data == new_ins.sig_array.data)
+        assert np.all(ins.sig_array.mask == new_ins.sig_array.mask)
+        assert new_ins.match_events == ins.match_events
+
+        # Individual datasets can be read without the rest. The bundle is
+        # never compressed, so they are memory-mapped
+        mask = INS.read_bundle(bundle_outfile, 'mask', index=np.s_[:, 1:3])
+        assert np.all(mask == ins.metric_array.mask[:, 1:3])
+        assert isinstance(mask, np.memmap)
+        metric_array = INS.read_bundle(bundle_outfile, 'metric_array')
+        assert isinstance(metric_array, np.memmap)
+        assert np.array_equal(metric_array, ins.metric_array.data)
+        assert INS.read_bundle(bundle_outfile, 'match_events') == ins.match_events
+
+    os.remove(bundle_outfile)
+
+
 def test_write_mwaf():
     from astropy.io import fits
 
@@ -260,14 +409,20 @@ def test_write_mwaf():
               metafits_file=metafits_file)
     ins.write('%s_replace' % prefix, output_type='mwaf', mwaf_files=mwaf_files,
               mwaf_method='replace', metafits_file=metafits_file)
+    # Writing boxes in threads should give the same files
+    ins.write('%s_threads' % prefix, output_type='mwaf', mwaf_files=mwaf_files,
+              metafits_file=metafits_file, num_workers=2)
 
     with fits.open(mwaf_files[0]) as old_mwaf_hdu:
         with fits.open('%s_add_12.mwaf' % prefix) as add_mwaf_hdu:
             assert np.all(add_mwaf_hdu[1].data['FLAGS'] == old_mwaf_hdu[1].data['FLAGS'] + new_flags)
+        with fits.open('%s_threads_12.mwaf' % prefix) as threads_mwaf_hdu:
+            assert np.all(threads_mwaf_hdu[1].data['FLAGS'] == old_mwaf_hdu[1].data['FLAGS'] + new_flags)
     with fits.open('%s_replace_12.mwaf' % prefix) as replace_mwaf_hdu:
         assert np.all(replace_mwaf_hdu[1].data['FLAGS'] == new_flags)
 
-    for path in ['%s_add_12.mwaf' % prefix, '%s_replace_12.mwaf' % prefix]:
+    for path in ['%s_add_12.mwaf' % prefix, '%s_replace_12.mwaf' % prefix,
+                 '%s_threads_12.mwaf' % prefix]:
         os.remove(path)
 
 
@@ -290,6 +445,29 @@ def test_select():
     assert np.count_nonzero(ins.metric_array.mask) == 12
 
 
+def test_make_mask_copy():
+
+    obs = '1061313128_99bl_1pol_half_time_SSINS'
+    testfile = os.path.join(DATA_PATH, '%s.h5' % obs)
+    ins = INS(testfile)
+    ins.metric_array.mask[7, :12] = True
+
+    mask_uvf = ins._make_mask_copy()
+
+    # Only the mask is carried, not the data
+    assert type(mask_uvf) is UVFlag
+    assert mask_uvf.mode == 'flag'
+    assert mask_uvf.metric_array is None
+    assert mask_uvf.weights_array is None
+    assert np.array_equal(mask_uvf.flag_array, ins.metric_array.mask)
+    assert mask_uvf.flag_array is not ins.metric_array.mask
+    assert np.array_equal(mask_uvf.time_array, ins.time_array)
+    assert np.array_equal(mask_uvf.freq_array, ins.freq_array)
+    # The original is untouched
+    assert ins.mode == 'metric'
+    assert ins.weights_array is not None
+
+
 def test_data_params():
     obs = '1061313128_99bl_1pol_half_time_SSINS'
     testfile = os.path.join(DATA_PATH, '%s.h5' % obs)
@@ -391,6 +569,26 @@ def test_use_integration_weights():
     assert not np.all(ins.weights_array == ins.weights_square_array)
 
 
+def test_single_precision():
+
+    obs = '1061313128_99bl_1pol_half_time'
+    testfile = os.path.join(DATA_PATH, '%s.uvfits' % obs)
+
+    ss = SS()
+    ss.read(testfile, flag_choice='original', diff=True)
+
+    ins = INS(ss)
+    ss.data_array = ss.data_array.astype(np.complex64)
+    single_ins = INS(ss, dtype=np.float32)
+
+    # The spectrum is still double precision
+    assert single_ins.metric_array.dtype == np.float64
+    assert np.allclose(single_ins.metric_array, ins.metric_array, rtol=1e-5)
+    assert np.array_equal(single_ins.metric_array.mask, ins.metric_array.mask)
+    assert np.array_equal(single_ins.weights_array, ins.weights_array)
+    assert np.allclose(single_ins.metric_ms, ins.metric_ms, rtol=1e-4, atol=1e-4)
+
+
 def test_add():
     obs = "1061313128_99bl_1pol_half_time_SSINS"
     testfile = os.path.join(DATA_PATH, f"{obs}.h5")
@@ -411,3 +609,91 @@ def test_add():
     assert np.all(combo_ins.metric_array.mask == first_ins.metric_array.mask)
     assert np.all(combo_ins.metric_array.data == truth_ins.metric_array.data)
     assert np.all(combo_ins.metric_array.mask == truth_ins.metric_array.mask)
+
+
+def test_concatenate():
+    obs = "1061313128_99bl_1pol_half_time_SSINS"
+    testfile = os.path.join(DATA_PATH, f"{obs}.h5")
+
+    truth_ins = INS(testfile)
+    truth_ins.metric_array[5, 10:20] = np.ma.masked
+    truth_ins.metric_ms = truth_ins.mean_subtract()
+
+    for axis, chan_bounds in [('frequency', [0, 100, 192, 384]),
+                              ('time', [0, 5, 12, truth_ins.Ntimes])]:
+        pieces = []
+        for start, stop in zip(chan_bounds[:-1], chan_bounds[1:]):
+            piece = truth_ins.copy()
+            if axis == 'frequency':
+                piece.select(freq_chans=np.arange(start, stop))
+            else:
+                piece.select(times=np.unique(truth_ins.time_array)[start:stop])
+            piece.match_events = [Event(slice(1, 2), slice(2, 3), 'narrow', 6.)]
+            pieces.append(piece)
+
+        concat_ins = INS.concatenate(pieces, axis=axis)
+        chain_ins = pieces[0].__add__(pieces[1], axis=axis).__add__(pieces[2], axis=axis)
+
+        for ins in [truth_ins, chain_ins]:
+            assert np.array_equal(concat_ins.metric_array, ins.metric_array)
+            assert np.array_equal(concat_ins.metric_array.mask, ins.metric_array.mask)
+            assert np.array_equal(concat_ins.weights_array, ins.weights_array)
+            assert np.allclose(concat_ins.metric_ms, ins.metric_ms)
+            assert np.array_equal(concat_ins.time_array, ins.time_array)
+            assert np.array_equal(concat_ins.freq_array, ins.freq_array)
+        assert concat_ins.spectrum_type == truth_ins.spectrum_type
+        assert concat_ins.order == truth_ins.order
+        # The data of the first piece is not reused
+        assert not np.shares_memory(concat_ins.metric_array, pieces[0].metric_array)
+
+        # The events are shifted along with their piece
+        offsets = chan_bounds[:-1]
+        if axis == 'frequency':
+            assert [event.freq_slice for event in concat_ins.match_events] == [slice(2 + offset, 3 + offset) for offset in offsets]
+        else:
+            assert [event.time_slice for event in concat_ins.match_events] == [slice(1 + offset, 2 + offset) for offset in offsets]
+
+    with pytest.raises(ValueError, match="INS objects can only be concatenated along the 'time' or 'frequency' axis."):
+        INS.concatenate(pieces, axis='polarization')
+    with pytest.raises(ValueError, match="The spectra do not have matching freq_arrays."):
+        INS.concatenate([pieces[0], truth_ins.copy()])
+
+
+def test_from_files():
+
+    obs = '1061313128_99bl_1pol_half_time'
+    testfile = os.path.join(DATA_PATH, '%s.uvfits' % obs)
+
+    ss = SS()
+    ss.read(testfile, flag_choice='original', diff=True)
+    ins = INS(ss, use_integration_weights=True)
+
+    # Use a chunk size that does not divide the number of baselines
+    chunk_ins = INS.from_files(testfile, chunk_bls=10, flag_choice='original',
+                               use_integration_weights=True)
+
+    assert np.all(chunk_ins.time_array == ins.time_array), "Times are different"
+    assert np.allclose(chunk_ins.weights_array, ins.weights_array), "Weights are different"
+    assert np.allclose(chunk_ins.weights_square_array, ins.weights_square_array), "Weights square are different"
+    assert np.all(chunk_ins.metric_array.mask == ins.metric_array.mask), "Masks are different"
+    assert np.allclose(chunk_ins.metric_array, ins.metric_array), "Metric arrays are different"
+    assert np.allclose(chunk_ins.metric_ms, ins.metric_ms), "z-scores are different"
+    assert chunk_ins.spectrum_type == 'cross'
+
+    # Reduce the chunks in worker processes
+    par_ins = INS.from_files(testfile, chunk_bls=10, flag_choice='original',
+                             use_integration_weights=True, num_workers=2)
+    assert np.all(par_ins.weights_array == chunk_ins.weights_array), "Parallel weights are different"
+    assert np.all(par_ins.metric_array == chunk_ins.metric_array), "Parallel metric arrays are different"
+
+    # Differencing in chunks gives the same spectrum
+    diff_chunk_ins = INS.from_files(testfile, chunk_bls=10, flag_choice='original',
+                                    use_integration_weights=True, diff_chunk_size=37)
+    assert np.all(diff_chunk_ins.metric_array == chunk_ins.metric_array), "Chunked diff metric arrays are different"
+
+    with pytest.raises(ValueError, match="flag_choice must be None or 'original'"):
+        INS.from_files(testfile, flag_choice='INS')
+
+    autofile = os.path.join(DATA_PATH, '1061312640_autos.uvfits')
+    with pytest.raises(ValueError, match="Requested spectrum type is 'cross', but no such baselines"):
+        INS.from_files(autofile)
@@ -134,6 +134,114 @@ def test_apply_match_test():
     assert np.all(ins.metric_ms.mask[:, 7:13]), "All the times were not flagged for the shape"
 
 
+def test_update_stats():
+
+    obs = '1061313128_99bl_1pol_half_time'
+    insfile = os.path.join(DATA_PATH, f'{obs}_SSINS.h5')
+
+    ins = INS(insfile)
+    ch_wid = ins.freq_array[1] - ins.freq_array[0]
+    shape_dict = {'shape1': [ins.freq_array[7] - 0.2 * ch_wid, ins.freq_array[12] + 0.2 * ch_wid],
+                  'shape2': [ins.freq_array[10] - 0.2 * ch_wid, ins.freq_array[30] + 0.2 * ch_wid]}
+    mf = MF(ins.freq_array, 5, shape_dict=shape_dict, streak=True)
+
+    stats = mf._init_stats(ins)
+    # Partially overlaps shape2 and the streak, entirely covers shape1
+    for freq_slice in [slice(5, 6), slice(5, 15), slice(0, ins.Nfreqs)]:
+        ins.metric_array[2, freq_slice] = np.ma.masked
+        ins.metric_ms[:, freq_slice] = ins.mean_subtract(freq_slice=freq_slice)
+        mf._update_stats(ins, stats, freq_slice)
+        new_stats = mf._init_stats(ins)
+
+        for shape in stats['sum']:
+            assert np.allclose(stats['sum'][shape], new_stats['sum'][shape])
+            assert np.array_equal(stats['count'][shape], new_stats['count'][shape])
+        assert np.array_equal(stats['narrow_max'], new_stats['narrow_max'])
+        assert np.array_equal(stats['narrow_arg'], new_stats['narrow_arg'])
+        assert mf.match_test(ins, stats=stats)[:3] == mf.match_test(ins)[:3]
+
+
+def test_apply_match_test_incremental():
+
+    obs = '1061313128_99bl_1pol_half_time'
+    insfile = os.path.join(DATA_PATH, f'{obs}_SSINS.h5')
+
+    ins = INS(insfile)
+    ins_inc = INS(insfile)
+
+    ch_wid = ins.freq_array[1] - ins.freq_array[0]
+    shape = [ins.freq_array[7] - 0.2 * ch_wid, ins.freq_array[12] + 0.2 * ch_wid]
+    mf = MF(ins.freq_array, 5, shape_dict={'shape': shape}, streak=True,
+            tb_aggro=0.3)
+
+    for test_ins in [ins, ins_inc]:
+        test_ins.metric_array[3, 5] *= 10
+        test_ins.metric_array[5] *= 10
+        test_ins.metric_array[7, 7:13] *= 10
+        test_ins.metric_ms = test_ins.mean_subtract()
+
+    mf.apply_match_test(ins, time_broadcast=True)
+    mf.apply_match_test(ins_inc, time_broadcast=True, incremental=True)
+
+    assert np.array_equal(ins.metric_array.mask, ins_inc.metric_array.mask)
+    assert np.array_equal(ins.metric_ms.mask, ins_inc.metric_ms.mask)
+    assert np.allclose(ins.metric_ms, ins_inc.metric_ms, atol=1e-10)
+    assert len(ins.match_events) == len(ins_inc.match_events)
+    for event, event_inc in zip(ins.match_events, ins_inc.match_events):
+        assert event[:3] == event_inc[:3]
+
+    ins.order = 1
+    with pytest.raises(ValueError, match="only available for INS objects with order 0"):
+        mf.apply_match_test(ins, incremental=True)
+
+
+def test_apply_match_test_batch():
+
+    obs = '1061313128_99bl_1pol_half_time'
+    insfile = os.path.join(DATA_PATH, f'{obs}_SSINS.h5')
+
+    ins = INS(insfile)
+
+    # Mock a simple metric_array, as in test_apply_match_test
+    ins.metric_array[:] = np.ones_like(ins.metric_array)
+    ins.weights_array = np.copy(ins.metric_array)
+    ins.weights_square_array = np.copy(ins.weights_array)
+
+    ch_wid = ins.freq_array[1] - ins.freq_array[0]
+    shape = [ins.freq_array[7] - 0.2 * ch_wid, ins.freq_array[12] + 0.2 * ch_wid]
+    mf = MF(ins.freq_array, 5, shape_dict={'shape': shape})
+
+    ins.metric_array[3, 5] = 10
+    ins.metric_array[5] = 10
+    ins.metric_array[7, 7:13] = 10
+    ins.metric_ms = ins.mean_subtract()
+    ins.sig_array = np.ma.copy(ins.metric_ms)
+
+    events = mf.batch_match_test(ins, 1)
+    # The champion comes first
+    assert events[0][:-1] == (slice(5, 6), slice(0, ins.Nfreqs), 'streak')
+    sigs = [event.sig for event in events]
+    assert sigs == sorted(sigs, reverse=True)
+    assert np.all(np.array(sigs) > 5)
+    # No two events overlap
+    batch_mask = np.zeros(ins.metric_array.shape[:2], dtype=int)
+    for event in events:
+        batch_mask[event[:2]] += 1
+    assert np.all(batch_mask <= 1)
+
+    # With nothing strong enough to batch, the flags are the same as the serial loop
+    mf.apply_match_test(ins, batch_factor=1e6)
+
+    test_mask = np.zeros(ins.metric_array.shape, dtype=bool)
+    test_mask[3, 5] = 1
+    test_mask[5] = 1
+    test_mask[7, 7:13] = 1
+    assert np.all(test_mask == ins.metric_array.mask), "Flags are incorrect"
+
+    with pytest.raises(ValueError, match="batch_factor must be at least 1."):
+        mf.apply_match_test(ins, batch_factor=0.5)
+
+
 def test_time_broadcast():
 
     obs = '1061313128_99bl_1pol_half_time'
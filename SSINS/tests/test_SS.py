@@ -1,8 +1,9 @@
 import pytest
 from SSINS.data import DATA_PATH
-from SSINS import SS, INS
+from SSINS import SS, INS, VDH, PackedMask
 import os
 import numpy as np
+import scipy.stats
 from pyuvdata import UVData
 
 """
@@ -102,6 +103,13 @@ def test_apply_flags():
     assert not np.any(ss.data_array.mask[:, :, [0] + list(range(2, ss.Nfreqs)), :]), "Channels were flagged that should not have been."
     assert ss.flag_choice is 'INS'
 
+    # Flag several channels at once, and check the mask matches the INS mask at every blt
+    ins.metric_array.mask[3, 5:8] = True
+    ss.apply_flags(flag_choice='INS', INS=ins)
+    assert np.all(ss.data_array.mask[3::ss.Ntimes, :, 5:8, :]), "The 3rd time was not flagged."
+    time_inds = np.searchsorted(ins.time_array, ss.time_array)
+    assert np.array_equal(ss.data_array.mask[:, 0], ins.metric_array.mask[time_inds])
+
     # Make a bad time array to test an error
     ins.time_array = ins.time_array + 1
     with pytest.raises(ValueError):
@@ -133,6 +141,16 @@ def test_mixture_prob():
     # Check that they sum to close to 1
     assert np.isclose(np.sum(mixture_prob), 1), "Probabilities did not add up to close to 1"
 
+    # Compare to scipy's Rayleigh distributions, one channel at a time
+    bins = np.logspace(-3, 4, 201)
+    scipy_prob = np.zeros(len(bins) - 1)
+    N_spec = np.sum(np.logical_not(ss.data_array.mask), axis=(0, 1, -1))
+    for chan in range(ss.Nfreqs):
+        if ss.MLE[chan] > 0:
+            quants = scipy.stats.rayleigh.cdf(bins, scale=ss.MLE[chan])
+            scipy_prob += N_spec[chan] / np.sum(N_spec) * (quants[1:] - quants[:-1])
+    assert np.allclose(ss.mixture_prob(bins, chunk_size=7), scipy_prob, rtol=0, atol=1e-12)
+
     # Do a new read, but don't diff. Run and check mask.
     ss = SS()
     ss.read(testfile, diff=False)
@@ -142,6 +160,106 @@ def test_mixture_prob():
     assert ss.flag_choice is None
 
 
+def test_VDH():
+
+    obs = '1061313128_99bl_1pol_half_time'
+    testfile = os.path.join(DATA_PATH, '%s.uvfits' % obs)
+
+    ss = SS()
+    ss.read(testfile, diff=True, flag_choice='original')
+    amp = np.absolute(ss.data_array.data)
+    unflagged = amp[np.logical_not(ss.data_array.mask)]
+    bins = np.histogram_bin_edges(unflagged, bins='auto')
+
+    # Accumulate in uneven chunks of baseline-times
+    vdh = VDH(bins, ss.Nfreqs)
+    for blt_ind in range(0, ss.Nblts, 1000):
+        blt_slice = slice(blt_ind, blt_ind + 1000)
+        vdh.accumulate(amp[blt_slice], mask=ss.data_array.mask[blt_slice])
+
+    counts, _ = np.histogram(unflagged, bins=bins)
+    assert np.array_equal(np.sum(vdh.counts, axis=0), counts)
+    assert np.array_equal(vdh.N_spec, np.sum(np.logical_not(ss.data_array.mask), axis=(0, 1, -1)))
+    # SS.MLE_calc works in single precision
+    assert np.allclose(vdh.mixture_prob(), ss.mixture_prob(bins), atol=1e-6)
+
+    # Read two baselines at a time
+    file_vdh = VDH.from_files(testfile, bins, chunk_bls=2, diff=True)
+    assert np.array_equal(file_vdh.counts, vdh.counts)
+    file_vdh.MLE_calc()
+    vdh.MLE_calc()
+    assert np.allclose(file_vdh.MLE, vdh.MLE)
+
+
+def test_packed_mask():
+
+    rng = np.random.default_rng(0)
+    shape = (5, 1, 13, 2)
+    mask_1 = rng.random(shape) < 0.3
+    mask_2 = rng.random(shape) < 0.5
+    packed_1 = PackedMask(mask_1)
+    packed_2 = PackedMask(mask_2)
+
+    assert np.array_equal(packed_1.unpack(), mask_1)
+    assert packed_1.nbytes == 5 * 2 * 2
+    assert np.array_equal((packed_1 | packed_2).unpack(), mask_1 | mask_2)
+    assert np.array_equal((packed_1 & packed_2).unpack(), mask_1 & mask_2)
+    for axis in [None, 0, -2, (0, 2), (0, -1)]:
+        assert np.array_equal(packed_1.count(axis=axis), np.count_nonzero(mask_1, axis=axis))
+
+    tp_mask = np.zeros((6, 1, 13, 2), dtype=bool)
+    tp_mask[:-1] = mask_1
+    tp_mask[1:] = np.logical_or(tp_mask[1:], tp_mask[:-1])
+    assert np.array_equal(packed_1.time_propagate().unpack(), tp_mask)
+    assert np.array_equal(packed_1.unpack(slice(1, 3)), mask_1[1:3])
+    assert np.array_equal(packed_1.unpack([4, 0]), mask_1[[4, 0]])
+    assert np.array_equal(PackedMask.zeros(shape).unpack(), np.zeros(shape, dtype=bool))
+
+    with pytest.raises(ValueError, match="PackedMask objects have different shapes"):
+        packed_1 | PackedMask(mask_1[1:])
+    with pytest.raises(ValueError, match="Cannot index the packed axis."):
+        PackedMask(mask_1, freq_axis=0).unpack(slice(1, 3))
+
+
+def test_pack_mask():
+
+    obs = '1061313128_99bl_1pol_half_time'
+    testfile = os.path.join(DATA_PATH, '%s.uvfits' % obs)
+
+    ss = SS()
+    ss.read(testfile, diff=True, flag_choice='original')
+    mask = np.copy(ss.data_array.mask)
+
+    ins = INS(ss)
+    rev_ind_hist = ss.rev_ind([0, 1e3])
+
+    ss.pack_mask()
+    assert ss.data_array.mask is np.ma.nomask
+    assert ss.packed_mask.count() == np.count_nonzero(mask)
+    # These use the packed mask directly
+    assert np.array_equal(INS(ss).metric_array, ins.metric_array)
+    assert np.array_equal(ss.rev_ind([0, 1e3]), rev_ind_hist)
+    # These need the mask, which data_array does not have while it is packed
+    for method, args in [(ss.diff, ()), (ss.MLE_calc, ()), (ss.mixture_prob, ('auto', ))]:
+        with pytest.raises(ValueError, match="The mask is packed. Call unpack_mask first."):
+            method(*args)
+
+    ss.unpack_mask()
+    assert np.array_equal(ss.data_array.mask, mask)
+    assert ss.packed_mask is None
+    with pytest.raises(ValueError, match="The mask is not packed."):
+        ss.unpack_mask()
+
+    # The flags can be packed as they are applied, without the unpacked mask
+    for flag_choice, kwargs in [('original', {}), ('INS', {'INS': ins}),
+                                ('custom', {'custom': mask}), (None, {})]:
+        ss.apply_flags(flag_choice=flag_choice, **kwargs)
+        mask = np.copy(ss.data_array.mask)
+        ss.apply_flags(flag_choice=flag_choice, pack=True, **kwargs)
+        assert ss.data_array.mask is np.ma.nomask
+        assert np.array_equal(ss.packed_mask.unpack(), mask)
+
+
 def test_rev_ind():
 
     obs = '1061313128_99bl_1pol_half_time'
@@ -157,8 +275,9 @@ def test_rev_ind():
 
     # Find the indices of this data point
     ind = np.unravel_index(np.absolute(ss.data_array).argmax(), ss.data_array.shape)
-    # Convert the blt to a time index
-    t = ind[0] // ss.Nbls
+    # Convert the blt to a time index. The diffed data are in baseline order,
+    # so the index comes from the time of the blt rather than its position.
+    t = np.searchsorted(np.unique(ss.time_array), ss.time_array[ind[0]])
     f = ind[2]
     p = ind[3]
 
@@ -180,6 +299,41 @@ def test_rev_ind():
     assert ss.flag_choice is None
 
 
+def test_rev_ind_bands():
+
+    obs = '1061313128_99bl_1pol_half_time'
+    testfile = os.path.join(DATA_PATH, '%s.uvfits' % obs)
+
+    ss = SS()
+    ss.read(testfile, diff=True)
+
+    # Overlapping bands, bands with the bounds swapped, an empty band, and
+    # bands whose bounds are amplitudes in the data
+    amp = np.absolute(ss.data_array.data)
+    quantiles = np.quantile(amp, [0.1, 0.3, 0.5, 0.7, 0.9])
+    bands = [quantiles[[0, 2]], quantiles[[1, 3]], quantiles[[4, 0]],
+             quantiles[[2, 2]], [amp.flat[5], amp.flat[77]]]
+
+    rev_ind_hist = ss.rev_ind_bands(bands)
+    assert rev_ind_hist.shape == (len(bands), ss.Ntimes, ss.Nfreqs, ss.Npols)
+
+    # Count each band one time at a time
+    unmasked = np.logical_not(np.ma.getmaskarray(ss.data_array))
+    for band, band_hist in zip(bands, rev_ind_hist):
+        where_band = np.logical_and(amp > min(band), amp < max(band))
+        where_band = np.logical_and(where_band, unmasked)
+        ref_hist = np.array([np.sum(where_band[ss.time_array == time], axis=0)[0]
+                             for time in np.unique(ss.time_array)])
+        assert np.array_equal(band_hist, ref_hist)
+        assert np.array_equal(band_hist, ss.rev_ind(band))
+    assert not np.any(rev_ind_hist[3])
+
+    # Neither the blt order nor the chunking matters
+    ss.reorder_blts(order='time')
+    for chunk_size in [None, 1, 37]:
+        assert np.array_equal(ss.rev_ind_bands(bands, chunk_size=chunk_size), rev_ind_hist)
+
+
 def test_write():
 
     obs = '1061313128_99bl_1pol_half_time'
@@ -219,6 +373,101 @@ def test_write():
         ss.write(outfile, 'uvfits', bad_uv)
 
 
+def test_write_irregular():
+
+    obs = '1061313128_99bl_1pol_half_time'
+    testfile = os.path.join(DATA_PATH, f'{obs}.uvfits')
+    outfile = os.path.join(DATA_PATH, 'test_write_irregular.uvh5')
+
+    # One baseline is missing its last two times, another only has one time
+    UV = UVData()
+    UV.read(testfile)
+    bls = np.unique(UV.baseline_array)
+    times = np.unique(UV.time_array)
+    short_bl = UV.baseline_array == bls[1]
+    single_bl = UV.baseline_array == bls[2]
+    keep = np.logical_not(short_bl & (UV.time_array >= times[-2]))
+    keep &= np.logical_not(single_bl & (UV.time_array > times[0]))
+    UV.select(blt_inds=np.where(keep)[0])
+    UV.reorder_blts(order='baseline')
+
+    ss = SS()
+    ss.read(testfile, diff=True, blt_inds=np.where(keep & np.logical_not(single_bl))[0])
+    ss.reorder_blts(order='baseline')
+    custom = np.zeros_like(ss.data_array.mask)
+    custom[::7, :, 64:128, :] = 1
+    ss.apply_flags(flag_choice='custom', custom=custom)
+
+    # Propagate one baseline at a time
+    flags = np.zeros_like(UV.flag_array)
+    for bl in np.unique(ss.baseline_array):
+        uv_inds = np.where(UV.baseline_array == bl)[0]
+        new_flags = ss.data_array.mask[ss.baseline_array == bl]
+        flags[uv_inds[:-1]] |= new_flags
+        flags[uv_inds[1:]] |= new_flags
+
+    ss.write(outfile, 'uvh5', UV=UV, combine=False)
+    assert np.array_equal(UV.flag_array, flags)
+
+    # The order of the blts is checked, not just the blt_order label
+    ss.reorder_blts(order=np.random.default_rng(0).permutation(ss.Nblts))
+    ss.blt_order = ('baseline', 'time')
+    UV.flag_array[:] = False
+    with pytest.warns(UserWarning, match="Reordering data array to baseline order"):
+        ss.write(outfile, 'uvh5', UV=UV, combine=False)
+    assert np.array_equal(UV.flag_array, flags)
+
+    # The blocks of two baselines in the wrong order
+    swapped_bls = np.select([ss.baseline_array == bls[0], ss.baseline_array == bls[-1]],
+                            [bls[-1], bls[0]], default=ss.baseline_array)
+    ss.reorder_blts(order=np.lexsort((ss.time_array, swapped_bls)))
+    with pytest.raises(ValueError, match="must be sorted by baseline and then time"):
+        ss._undiff_blt_inds(UV)
+    os.remove(outfile)
+
+
+def test_write_flags():
+
+    obs = '1061313128_99bl_1pol_half_time'
+    testfile = os.path.join(DATA_PATH, f'{obs}.uvfits')
+    infile = os.path.join(DATA_PATH, 'test_write_flags_in.uvh5')
+    outfile = os.path.join(DATA_PATH, 'test_write_flags.uvh5')
+    flag_only_outfile = os.path.join(DATA_PATH, 'test_write_flags_only.uvh5')
+
+    # Keep the input file in time order so the blts need to be matched up
+    UV = UVData()
+    UV.read(testfile)
+    UV.reorder_blts(order='time')
+    UV.write_uvh5(infile, clobber=True)
+
+    ss = SS()
+    ss.read(infile, diff=True)
+    custom = np.zeros_like(ss.data_array.mask)
+    custom[::7, :, 64:128, :] = 1
+    ss.apply_flags(flag_choice='custom', custom=custom)
+
+    for combine in [True, False]:
+        ss.write(outfile, 'uvh5', filename_in=infile, combine=combine,
+                 write_kwargs={'clobber': True})
+        ss.write_flags(flag_only_outfile, infile, combine=combine,
+                       chunk_size=1000, clobber=True)
+        uvd = UVData()
+        uvd.read(outfile)
+        uvd.reorder_blts(order='time')
+        flag_only_uvd = UVData()
+        flag_only_uvd.read(flag_only_outfile)
+        assert np.array_equal(uvd.flag_array, flag_only_uvd.flag_array)
+        assert np.array_equal(UV.data_array, flag_only_uvd.data_array)
+
+    with pytest.raises(IOError, match="File exists; skipping"):
+        ss.write_flags(flag_only_outfile, infile)
+    with pytest.raises(ValueError, match="write_flags only supports uvh5 files."):
+        ss.write_flags(flag_only_outfile, testfile, clobber=True)
+
+    for path in [infile, outfile, flag_only_outfile]:
+        os.remove(path)
+
+
 def test_read_multifiles():
     obs = '1061313128_99bl_1pol_half_time'
     testfile = os.path.join(DATA_PATH, f'{obs}.uvfits')
@@ -275,3 +524,62 @@ def test_newmask():
 
     assert ss.flag_choice is None
     assert isinstance(ss.data_array, np.ma.MaskedArray)
+
+
+def test_diff_irregular():
+    obs = '1061313128_99bl_1pol_half_time'
+    testfile = os.path.join(DATA_PATH, '%s.uvfits' % obs)
+
+    uv = UVData()
+    uv.read(testfile)
+    uv.reorder_blts(order='baseline')
+    # Drop some blts so that baselines have differing numbers of times
+    keep = np.ones(uv.Nblts, dtype=bool)
+    keep[::7] = False
+    uv.select(blt_inds=np.where(keep)[0])
+
+    ss = SS()
+    ss.read(testfile, diff=False)
+    ss.reorder_blts(order='baseline')
+    ss.select(blt_inds=np.where(keep)[0])
+    ss.diff()
+
+    # Compare to differencing each baseline on its own
+    ind_acc = 0
+    for bl in np.unique(uv.baseline_array):
+        diff_dat = np.diff(uv.get_data(bl, squeeze='none'), axis=0)
+        flags = uv.get_flags(bl, squeeze='none')
+        diff_flags = np.logical_or(flags[:-1], flags[1:])
+        times = uv.get_times(bl)
+        diff_times = 0.5 * (times[:-1] + times[1:])
+        blt_slice = slice(ind_acc, ind_acc + diff_dat.shape[0])
+
+        assert np.array_equal(ss.data_array[blt_slice], diff_dat), "Data values are different!"
+        assert np.array_equal(ss.flag_array[blt_slice], diff_flags), "Flags are different!"
+        assert np.array_equal(ss.time_array[blt_slice], diff_times), "Times are different!"
+        assert np.all(ss.baseline_array[blt_slice] == bl), "Baselines are different!"
+        ind_acc += diff_dat.shape[0]
+    assert ind_acc == ss.Nblts, "Wrong number of baseline-times after diff"
+
+
+def test_diff_chunk_size():
+    obs = '1061313128_99bl_1pol_half_time'
+    testfile = os.path.join(DATA_PATH, '%s.uvfits' % obs)
+
+    ss = SS()
+    ss.read(testfile, diff=True)
+
+    ss_chunk = SS()
+    ss_chunk.read(testfile, diff=False)
+    ss_chunk.diff(chunk_size=37)
+
+    for attr in ['data_array', 'flag_array', 'time_array', 'nsample_array',
+                 'integration_time', 'baseline_array', 'uvw_array', 'lst_array']:
+        assert np.array_equal(getattr(ss, attr), getattr(ss_chunk, attr)), f"{attr} disagrees"
+    assert ss_chunk.Nblts == ss.Nblts
+    assert ss_chunk.Ntimes == ss.Ntimes
+
+    # The chunk size can also be given on read
+    ss_chunk = SS()
+    ss_chunk.read(testfile, diff=True, diff_chunk_size=37)
+    assert np.array_equal(ss.data_array, ss_chunk.data_array)
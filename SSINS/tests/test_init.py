@@ -0,0 +1,37 @@
+import os
+import pytest
+import subprocess
+import sys
+
+"""
+Tests the package level imports of SSINS
+"""
+
+
+def _run_in_fresh_interpreter(statement):
+    SSINS_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+    env = dict(os.environ, PYTHONPATH=SSINS_dir)
+    subprocess.run([sys.executable, '-c', statement], env=env, check=True)
+
+
+def test_lazy_import():
+    # MF and util should be usable without importing pyuvdata
+    statement = ("import sys; import SSINS; assert 'SSINS.incoherent_noise_spectrum' not in sys.modules; "
+                 "from SSINS import MF, util; assert 'pyuvdata' not in sys.modules; "
+                 "from SSINS import INS; assert 'pyuvdata' in sys.modules")
+    _run_in_fresh_interpreter(statement)
+
+
+def test_lazy_import_INS():
+    # Worker pools are only needed when reading or writing with several workers
+    statement = ("import sys; from SSINS import INS; "
+                 "assert 'concurrent.futures' not in sys.modules")
+    _run_in_fresh_interpreter(statement)
+
+
+def test_missing_attribute():
+    import SSINS
+
+    assert 'INS' in dir(SSINS)
+    with pytest.raises(AttributeError, match="has no attribute 'not_an_attribute'"):
+        SSINS.not_an_attribute
@@ -143,6 +143,28 @@ def test_combine_ins():
         assert np.all(np.isclose(getattr(whole_ins, attr), getattr(ins_first_50, attr))), f"{attr} is not equal between the two INS"
 
 
+def test_combine_many_ins():
+    obs = "1061313128_99bl_1pol_half_time"
+    testfile = os.path.join(DATA_PATH, f"{obs}.uvfits")
+
+    ss = SS()
+    ss.read(testfile, diff=True)
+
+    whole_ins = INS(ss)
+
+    all_bls = ss.get_antpairs()
+    chunk_ins = (INS(ss.select(bls=all_bls[chunk_ind:chunk_ind + 10], inplace=False))
+                 for chunk_ind in range(0, len(all_bls), 10))
+    test_ins = util.combine_many_ins(chunk_ins)
+
+    for attr in whole_ins._data_params:
+        assert np.all(np.isclose(getattr(whole_ins, attr), getattr(test_ins, attr))), f"{attr} is not equal between the two INS"
+    assert np.array_equal(whole_ins.metric_array.mask, test_ins.metric_array.mask)
+
+    with pytest.raises(ValueError, match="No spectra were given to combine."):
+        util.combine_many_ins([])
+
+
 def test_combine_ins_use_nsample():
     obs = "1061313128_99bl_1pol_half_time"
     testfile = os.path.join(DATA_PATH, f"{obs}.uvfits")
@@ -14,6 +14,7 @@ import os
 import subprocess
 import json
 import io
+import pytest
 
 import SSINS
 from SSINS.data import DATA_PATH
@@ -126,3 +127,23 @@ def test_main():
                                   d=version_info['git_description']))
     finally:
         sys.stdout = saved_stdout
+
+
+def test_lazy_version_info(tmp_path):
+    # The git info is constructed once on access and then cached
+    version_info = SSINS.version.get_version_info()
+    assert SSINS.version.version_info is version_info
+    assert SSINS.version.git_hash == version_info['git_hash']
+    assert SSINS.version.get_version_str() == ''.join(['%s: %s, ' % (key, val) for key, val in version_info.items()])
+
+    # An existing GIT_INFO file is used instead of running git
+    git_file = os.path.join(tmp_path, 'GIT_INFO')
+    with open(git_file, 'w') as outfile:
+        json.dump(['origin', 'hash', 'description', 'branch'], outfile)
+    file_info = SSINS.version.construct_version_info(git_file=git_file)
+    assert file_info == {'version': SSINS.__version__, 'git_origin': 'origin',
+                         'git_hash': 'hash', 'git_description': 'description',
+                         'git_branch': 'branch'}
+
+    with pytest.raises(AttributeError):
+        SSINS.version.not_an_attribute
@@ -6,6 +6,7 @@ import numpy as np
 import os
 from SSINS.match_filter import Event
 import copy
+import itertools
 import warnings
 
 
@@ -39,6 +40,7 @@ def calc_occ(ins, mf, num_init_flag, num_int_flag=0, lump_narrowband=False):
     Returns:
         occ_dict: A dictionary with shapes for keys and occupancy fractions for values
     """
+    ins._check_unpacked()
     occ_dict = {shape: 0. for shape in mf.slice_dict}
 
     # Figure out the total occupancy sans initial flags
@@ -150,33 +152,80 @@ def combine_ins(ins1, ins2, inplace=False):
         inplace: Whether to do the operation inplace on ins1 or not.
     """
 
-    if not np.array_equal(ins1.time_array, ins2.time_array):
-        raise ValueError("The spectra do not have matching time arrays.")
+    return(combine_many_ins([ins1, ins2], inplace=inplace))
 
-    if not np.array_equal(ins1.freq_array, ins2.freq_array):
-        raise ValueError("The spectra do not have the same frequencies.")
 
-    if not np.array_equal(ins1.polarization_array, ins2.polarization_array):
-        raise ValueError("The spectra do not have the same pols.")
+def combine_many_ins(ins_iter, inplace=False):
+    """
+    Combines any number of INS for the same obs that have been averaged over
+    different baselines. The spectra can come from a generator, so that only
+    one needs to exist at a time. The weighted sums are accumulated in place,
+    and the mean-subtracted spectrum is only calculated once at the end.
+    Samples that are masked in a spectrum where it has weight stay masked.
 
-    if not ins1.spectrum_type == ins2.spectrum_type:
-        raise ValueError(f"ins1 is of type {ins1.spectrum_type} while ins2 is of type {ins2.spectrum_type}")
+    Args:
+        ins_iter: An iterable of the spectra to combine
+        inplace: Whether to do the operation inplace on the first spectrum or not.
 
-    if (not np.array_equal(ins1.metric_ms, ins1.sig_array)) or (not np.array_equal(ins2.metric_ms, ins2.sig_array)):
-        warnings.warn("sig_array attribute will be reset after combinging INS")
+    Returns:
+        this: The combined spectrum
+    """
+    # Imported here so that the rest of util does not need pyuvdata
+    from SSINS.incoherent_noise_spectrum import _sums_to_metric
+
+    ins_iter = iter(ins_iter)
+    try:
+        first = next(ins_iter)
+    except StopIteration:
+        raise ValueError("No spectra were given to combine.")
+    first._check_unpacked()
+    reset_sig = not np.array_equal(first.metric_ms, first.sig_array)
 
     if inplace:
-        this = ins1
+        this = first
     else:
-        this = copy.deepcopy(ins1)
-
-    new_weights = this.weights_array + ins2.weights_array
-    new_weights_square = this.weights_square_array + ins2.weights_square_array
-    new_metric = (this.weights_array * this.metric_array + ins2.weights_array * ins2.metric_array) / new_weights
+        this = copy.deepcopy(first)
+
+    weights = np.array(first.weights_array, dtype=float)
+    weights_square = np.array(first.weights_square_array, dtype=float)
+    metric_sum = np.zeros(weights.shape)
+    mask = np.zeros(weights.shape, dtype=bool)
+    # Holds the weighted amplitudes of each spectrum in turn
+    weighted_metric = np.empty(weights.shape)
+    for ins_ind, ins in enumerate(itertools.chain([first], ins_iter), start=1):
+        if ins_ind > 1:
+            ins._check_unpacked()
+            if not np.array_equal(first.time_array, ins.time_array):
+                raise ValueError("The spectra do not have matching time arrays.")
+
+            if not np.array_equal(first.freq_array, ins.freq_array):
+                raise ValueError("The spectra do not have the same frequencies.")
+
+            if not np.array_equal(first.polarization_array, ins.polarization_array):
+                raise ValueError("The spectra do not have the same pols.")
+
+            if not first.spectrum_type == ins.spectrum_type:
+                raise ValueError(f"ins1 is of type {first.spectrum_type} while ins{ins_ind} is of type {ins.spectrum_type}")
+
+            reset_sig |= not np.array_equal(ins.metric_ms, ins.sig_array)
+            weights += ins.weights_array
+            weights_square += ins.weights_square_array
+
+        # Samples without weight hold no amplitude (and may be inf)
+        has_weight = ins.weights_array > 0
+        weighted_metric.fill(0)
+        np.multiply(ins.weights_array, np.ma.getdata(ins.metric_array),
+                    out=weighted_metric, where=has_weight)
+        metric_sum += weighted_metric
+        mask |= np.ma.getmaskarray(ins.metric_array) & has_weight
+
+    if reset_sig:
+        warnings.warn("sig_array attribute will be reset after combinging INS")
 
-    this.metric_array = new_metric
-    this.weights_array = new_weights
-    this.weights_square_array = new_weights_square
+    this.metric_array = _sums_to_metric(metric_sum, weights)
+    this.metric_array[mask] = np.ma.masked
+    this.weights_array = weights
+    this.weights_square_array = weights_square
 
     this.metric_ms = this.mean_subtract()
     this.sig_array = np.ma.copy(this.metric_ms)
@@ -185,7 +234,7 @@ def combine_ins(ins1, ins2, inplace=False):
 
 
 def write_meta(prefix, ins, uvf=None, mf=None, sep="_", clobber=False,
-               data_compression="lzf"):
+               data_compression="lzf", bundle=False):
     """
     Wrapper around several calls to ins.write so that a standard set of
     metadata can be written.
@@ -198,14 +247,21 @@ def write_meta(prefix, ins, uvf=None, mf=None, sep="_", clobber=False,
         sep: The separator character between the prefix and rest of output filenames.
         clobber: Whether to overwrite existing files.
         data_compression: The type of data compression to use for hdf5 outputs.
+            Bundles are always uncompressed (see INS.write).
+        bundle: If True, write the data, mask, and match events of the INS to a
+            single bundle file instead of separate files.
     """
 
-    ins.write(prefix, sep=sep, clobber=clobber,
-              data_compression=data_compression)
-    ins.write(prefix, output_type="mask", sep=sep, clobber=clobber,
-              data_compression=data_compression)
-    ins.write(prefix, output_type="match_events", sep=sep, clobber=clobber,
-              data_compression=data_compression)
+    if bundle:
+        ins.write(prefix, output_type="bundle", sep=sep, clobber=clobber,
+                  data_compression=data_compression)
+    else:
+        ins.write(prefix, sep=sep, clobber=clobber,
+                  data_compression=data_compression)
+        ins.write(prefix, output_type="mask", sep=sep, clobber=clobber,
+                  data_compression=data_compression)
+        ins.write(prefix, output_type="match_events", sep=sep, clobber=clobber,
+                  data_compression=data_compression)
     if uvf is not None:
         ins.write(prefix, output_type="flags", uvf=uvf, sep=sep, clobber=clobber,
                   data_compression=data_compression)
@@ -4,6 +4,7 @@ Copied from pyuvdata.version with permission from Dr. Bryna Hazelton.
 import os
 import subprocess
 import json
+from functools import lru_cache
 
 SSINS_dir = os.path.dirname(os.path.realpath(__file__))
 
@@ -40,26 +41,42 @@ def _get_gitinfo_file(git_file=None):
             'git_description': git_description, 'git_branch': git_branch}
 
 
-def construct_version_info():
-
+def _get_version():
+    """Get the version from the VERSION file."""
     version_file = os.path.join(SSINS_dir, 'VERSION')
     with open(version_file) as f:
         version = f.read().strip()
 
-    git_origin = ''
-    git_hash = ''
-    git_description = ''
-    git_branch = ''
+    return version
+
+
+def construct_version_info(git_file=None):
+    """Construct the version info, running git if possible.
+
+    Args:
+        git_file: A GIT_INFO file to take the git info from. If it exists, git
+            is not run at all. Otherwise git is run, falling back on the
+            GIT_INFO file written when installing the package.
 
-    version_info = {'version': version, 'git_origin': '', 'git_hash': '',
+    Returns:
+        version_info: Dictionary of the version and git info
+    """
+    version_info = {'version': _get_version(), 'git_origin': '', 'git_hash': '',
                     'git_description': '', 'git_branch': ''}
 
+    if git_file is not None and os.path.exists(git_file):
+        try:
+            version_info.update(_get_gitinfo_file(git_file=git_file))
+            return version_info
+        except (IOError, OSError, ValueError, IndexError):
+            pass
+
     try:
         version_info['git_origin'] = _get_git_output(['config', '--get', 'remote.origin.url'], capture_stderr=True)
         version_info['git_hash'] = _get_git_output(['rev-parse', 'HEAD'], capture_stderr=True)
         version_info['git_description'] = _get_git_output(['describe', '--dirty', '--tag', '--always'])
         version_info['git_branch'] = _get_git_output(['rev-parse', '--abbrev-ref', 'HEAD'], capture_stderr=True)
-    except subprocess.CalledProcessError:  # pragma: no cover
+    except (subprocess.CalledProcessError, OSError):  # pragma: no cover
         try:
             # Check if a GIT_INFO file was created when installing package
             version_info.update(_get_gitinfo_file())
@@ -69,19 +86,46 @@ def construct_version_info():
     return version_info
 
 
-version_info = construct_version_info()
-version = version_info['version']
-git_origin = version_info['git_origin']
-git_hash = version_info['git_hash']
-git_description = version_info['git_description']
-git_branch = version_info['git_branch']
+@lru_cache(maxsize=None)
+def get_version_info():
+    """Get the version info, constructing it on the first call only. git is
+    not run if the package was installed with a GIT_INFO file.
+
+    Returns:
+        version_info: Dictionary of the version and git info. Do not modify it.
+    """
+    return construct_version_info(git_file=os.path.join(SSINS_dir, 'GIT_INFO'))
+
+
+@lru_cache(maxsize=None)
+def get_version_str():
+    """Get the version info as a single string for histories and output files.
+
+    Returns:
+        version_str: The 'key: value, ' pairs of the version info, joined
+    """
+    return ''.join(['%s: %s, ' % (key, val) for key, val in get_version_info().items()])
+
+
+version = _get_version()
+
+
+def __getattr__(name):
+    # The git info is only constructed when it is first asked for, so that
+    # importing SSINS does not run git
+    if name == 'version_info':
+        return get_version_info()
+    if name in ('git_origin', 'git_hash', 'git_description', 'git_branch'):
+        return get_version_info()[name]
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
 
 def main():
-    print('Version = {0}'.format(version))
-    print('git origin = {0}'.format(git_origin))
-    print('git branch = {0}'.format(git_branch))
-    print('git description = {0}'.format(git_description))
+    version_info = construct_version_info()
+    print('Version = {0}'.format(version_info['version']))
+    print('git origin = {0}'.format(version_info['git_origin']))
+    print('git branch = {0}'.format(version_info['git_branch']))
+    print('git description = {0}'.format(version_info['git_description']))
 
 
 if __name__ == '__main__':  # pragma: no cover
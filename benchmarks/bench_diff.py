@@ -0,0 +1,84 @@
+"""
+Benchmarks SS.diff against the per-baseline loop it replaced, over a range of
+baseline counts, and checks that the outputs are identical.
+"""
+import argparse
+import numpy as np
+from SSINS import SS
+from common import make_ss, timeit
+
+
+def loop_diff(ss):
+    """The original per-baseline implementation of SS.diff, for reference."""
+    ind_acc = 0
+    for bl in np.unique(ss.baseline_array):
+        diff_dat = np.diff(ss.get_data(bl, squeeze='none'), axis=0)
+        diff_flags = np.logical_or(ss.get_flags(bl, squeeze='none')[:-1],
+                                   ss.get_flags(bl, squeeze='none')[1:])
+        diff_times = ss.get_times(bl)
+        diff_times = 0.5 * (diff_times[:-1] + diff_times[1:])
+        diff_nsamples = ss.get_nsamples(bl, squeeze='none')
+        diff_nsamples = 0.5 * (diff_nsamples[:-1] + diff_nsamples[1:])
+
+        len_diff = diff_dat.shape[0]
+        blt_slice = slice(ind_acc, ind_acc + len_diff)
+
+        ss.data_array[blt_slice] = diff_dat
+        ss.flag_array[blt_slice] = diff_flags
+        ss.time_array[blt_slice] = diff_times
+        ss.nsample_array[blt_slice] = diff_nsamples
+
+        where_bl = np.where(ss.baseline_array == bl)
+        diff_ints = ss.integration_time[where_bl]
+        ss.integration_time[blt_slice] = diff_ints[:-1] + diff_ints[1:]
+        diff_uvw = ss.uvw_array[where_bl]
+        ss.uvw_array[blt_slice] = 0.5 * (diff_uvw[:-1] + diff_uvw[1:])
+        ss.baseline_array[blt_slice] = bl
+        ss.ant_1_array[blt_slice], ss.ant_2_array[blt_slice] = ss.baseline_to_antnums(bl)
+        ind_acc += len_diff
+
+    for blts_attr in ['data_array', 'flag_array', 'time_array',
+                      'nsample_array', 'integration_time', 'baseline_array',
+                      'ant_1_array', 'ant_2_array', 'uvw_array']:
+        setattr(ss, blts_attr, getattr(ss, blts_attr)[:-ss.Nbls])
+
+
+def setup_ss(Nants, Ntimes, Nfreqs):
+    ss = make_ss(Nants=Nants, Ntimes=Ntimes, Nfreqs=Nfreqs)
+    # The synthetic data is already baseline ordered. Skip the reorder in
+    # SS.diff so that only the differencing is timed.
+    ss.blt_order = 'baseline'
+    return(ss)
+
+
+def time_diff(Nants, Ntimes, Nfreqs, method, repeat=3):
+    best = np.inf
+    for _ in range(repeat):
+        ss = setup_ss(Nants, Ntimes, Nfreqs)
+        diff_func = loop_diff if method == 'loop' else SS.diff
+        best = min(best, timeit(diff_func, ss, repeat=1))
+    return(best)
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-a', '--Nants', type=int, nargs='*', default=[8, 16, 32, 64, 128],
+                    help='The antenna counts to benchmark')
+parser.add_argument('-t', '--Ntimes', type=int, default=10,
+                    help='The number of integrations')
+parser.add_argument('-f', '--Nfreqs', type=int, default=64,
+                    help='The number of frequency channels')
+args = parser.parse_args()
+
+print(f"{'Nbls':>6} {'loop (s)':>10} {'vectorized (s)':>15} {'speedup':>8}")
+for Nants in args.Nants:
+    loop_ss = setup_ss(Nants, args.Ntimes, args.Nfreqs)
+    loop_diff(loop_ss)
+    vec_ss = setup_ss(Nants, args.Ntimes, args.Nfreqs)
+    vec_ss.diff()
+    for attr in ['data_array', 'flag_array', 'time_array', 'nsample_array',
+                 'integration_time', 'baseline_array', 'uvw_array']:
+        assert np.array_equal(getattr(loop_ss, attr), getattr(vec_ss, attr)), f"{attr} differs"
+
+    t_loop = time_diff(Nants, args.Ntimes, args.Nfreqs, 'loop')
+    t_vec = time_diff(Nants, args.Ntimes, args.Nfreqs, 'vectorized')
+    print(f"{vec_ss.Nbls:>6} {t_loop:>10.3f} {t_vec:>15.3f} {t_loop / t_vec:>8.1f}")
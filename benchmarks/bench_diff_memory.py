@@ -0,0 +1,51 @@
+"""
+Measures the peak memory allocated by SS.diff on top of the input object,
+with and without the chunk_size option, using tracemalloc (numpy reports its
+array allocations to tracemalloc). A small diff is done first, so that the
+one-time setup of the first diff (e.g. astropy loading data to recalculate the
+LSTs) is not counted against whichever mode happens to run first.
+"""
+import argparse
+import numpy as np
+import tracemalloc
+from common import make_ss
+
+
+def peak_diff_memory(Nants, Ntimes, Nfreqs, chunk_size):
+    ss = make_ss(Nants=Nants, Ntimes=Ntimes, Nfreqs=Nfreqs)
+    # Already baseline ordered, so skip the reorder in SS.diff
+    ss.blt_order = 'baseline'
+    tracemalloc.start()
+    ss.diff(chunk_size=chunk_size)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return(peak, ss)
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-a', '--Nants', type=int, default=64,
+                    help='The number of antennas')
+parser.add_argument('-t', '--Ntimes', type=int, default=10,
+                    help='The number of integrations')
+parser.add_argument('-f', '--Nfreqs', type=int, default=384,
+                    help='The number of frequency channels')
+parser.add_argument('-c', '--chunk_sizes', type=int, nargs='*', default=[10000, 1000, 100],
+                    help='The chunk sizes to benchmark')
+args = parser.parse_args()
+
+# Warm up
+peak_diff_memory(4, 3, 16, None)
+
+ss = make_ss(Nants=args.Nants, Ntimes=args.Ntimes, Nfreqs=args.Nfreqs)
+vis_MB = ss.data_array.nbytes / 2**20
+flag_MB = ss.flag_array.nbytes / 2**20
+print(f"Nblts={ss.Nblts}: visibilities {vis_MB:.1f} MB, flags {flag_MB:.1f} MB")
+del ss
+
+print(f"{'chunk_size':>10} {'peak extra (MB)':>16} {'x visibilities':>15}")
+peak, ref_ss = peak_diff_memory(args.Nants, args.Ntimes, args.Nfreqs, None)
+print(f"{'None':>10} {peak / 2**20:>16.1f} {peak / 2**20 / vis_MB:>15.2f}")
+for chunk_size in args.chunk_sizes:
+    peak, ss = peak_diff_memory(args.Nants, args.Ntimes, args.Nfreqs, chunk_size)
+    assert np.array_equal(ss.data_array, ref_ss.data_array), "Chunked diff disagrees"
+    print(f"{chunk_size:>10} {peak / 2**20:>16.1f} {peak / 2**20 / vis_MB:>15.2f}")
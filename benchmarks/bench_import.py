@@ -0,0 +1,51 @@
+"""
+Benchmarks importing SSINS in a fresh interpreter and counts the processes
+started while doing so. The version info (and git with it) should only be run
+when it is first asked for, e.g. by INS.write.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# Run in the child interpreter. Counts the processes started by SSINS.version,
+# leaving out any that dependencies start on import.
+CHILD = """
+import json, os, subprocess, sys, time, traceback
+sys.path.insert(0, %r)
+calls = []
+execute_child = subprocess.Popen._execute_child
+
+
+def counting_execute_child(self, args, *pargs, **kwargs):
+    if any(frame.filename.endswith(os.path.join('SSINS', 'version.py'))
+           for frame in traceback.extract_stack()):
+        calls.append(args)
+    return execute_child(self, args, *pargs, **kwargs)
+
+
+subprocess.Popen._execute_child = counting_execute_child
+start = time.perf_counter()
+import SSINS
+t_import = time.perf_counter() - start
+Nprocs_import = len(calls)
+start = time.perf_counter()
+SSINS.version.get_version_str()
+t_version = time.perf_counter() - start
+print(json.dumps([t_import, Nprocs_import, t_version, len(calls) - Nprocs_import]))
+""" % REPO_DIR
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-r', '--repeats', type=int, default=5,
+                    help='The number of fresh interpreters to time')
+args = parser.parse_args()
+
+results = [json.loads(subprocess.check_output([sys.executable, '-c', CHILD]))
+           for _ in range(args.repeats)]
+t_import, Nprocs_import, t_version, Nprocs_version = [min(col) for col in zip(*results)]
+print(f"import SSINS: {t_import:.3f} s, {Nprocs_import} git processes started")
+print(f"first version info access: {t_version:.3f} s, {Nprocs_version} git processes started")
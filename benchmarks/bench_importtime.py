@@ -0,0 +1,55 @@
+"""
+Benchmarks the import time of SSINS and its pieces with python -X importtime,
+and lists which of the heavy dependencies each import statement loads. Only
+what is actually used should be imported.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+HEAVY = ['pyuvdata', 'astropy', 'scipy', 'matplotlib', 'h5py', 'yaml']
+STATEMENTS = ['import SSINS', 'from SSINS import MF', 'from SSINS import util',
+              'from SSINS import INS', 'from SSINS import Catalog_Plot']
+
+
+def importtime(statement):
+    """
+    Imports in a fresh interpreter with -X importtime.
+
+    Args:
+        statement: The import statement to run
+
+    Returns:
+        total: The total cumulative import time of the top level modules, in s
+        heavy: The heavy dependencies that were imported
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([REPO_DIR, os.environ.get('PYTHONPATH', '')]))
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                            env=env, stderr=subprocess.PIPE, check=True,
+                            universal_newlines=True).stderr
+    total = 0
+    heavy = set()
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line.split('|')
+        # Top level imports are not indented
+        if not module[1:].startswith(' '):
+            total += int(cumulative)
+        if module.strip() in HEAVY:
+            heavy.add(module.strip())
+    return(total * 1e-6, sorted(heavy))
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-r', '--repeats', type=int, default=3,
+                    help='The number of fresh interpreters to time each statement in')
+args = parser.parse_args()
+
+print(f"{'statement':>30} {'time (s)':>9}  heavy dependencies")
+for statement in STATEMENTS:
+    results = [importtime(statement) for _ in range(args.repeats)]
+    best = min(result[0] for result in results)
+    print(f"{statement:>30} {best:>9.3f}  {', '.join(results[0][1])}")
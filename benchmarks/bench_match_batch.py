@@ -0,0 +1,58 @@
+"""
+Benchmarks the batch_factor option of MF.apply_match_test against the
+default one-champion-per-iteration loop on a spectrum with persistent
+narrowband RFI, and reports how the flags differ.
+"""
+import argparse
+import numpy as np
+import time
+from copy import deepcopy
+from common import make_ins
+from SSINS import MF
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-a', '--Nants', type=int, default=16,
+                    help='The number of antennas')
+parser.add_argument('-t', '--Ntimes', type=int, default=56,
+                    help='The number of integrations')
+parser.add_argument('-f', '--Nfreqs', type=int, default=768,
+                    help='The number of frequency channels')
+parser.add_argument('-p', '--Npols', type=int, default=1,
+                    help='The number of polarizations')
+parser.add_argument('-r', '--Nrfi', type=int, default=40,
+                    help='The number of channels with persistent RFI')
+parser.add_argument('-s', '--sig_thresh', type=float, default=5,
+                    help='The significance threshold')
+args = parser.parse_args()
+
+ins = make_ins(Nants=args.Nants, Ntimes=args.Ntimes, Nfreqs=args.Nfreqs,
+               Npols=args.Npols)
+rng = np.random.default_rng(1)
+# Persistent narrowband RFI that comes and goes, plus a few broadband streaks
+chans = rng.choice(ins.Nfreqs, size=args.Nrfi, replace=False)
+on = rng.random((ins.Ntimes, args.Nrfi)) < 0.5
+ins.metric_array[:, chans] *= np.where(on, rng.uniform(1.2, 3, size=on.shape), 1)[:, :, np.newaxis]
+ins.metric_array[rng.choice(ins.Ntimes, size=3, replace=False)] *= 1.05
+ins.metric_ms = ins.mean_subtract()
+
+mf = MF(ins.freq_array, args.sig_thresh, streak=True)
+
+serial = deepcopy(ins)
+start = time.perf_counter()
+mf.apply_match_test(serial)
+t_serial = time.perf_counter() - start
+serial_mask = serial.metric_array.mask
+print(f"serial: {len(serial.match_events)} events, {np.count_nonzero(serial_mask)} samples flagged, {t_serial:.2f} s")
+
+print(f"{'factor':>6} {'time (s)':>9} {'speedup':>8} {'events':>7} {'flagged':>8} {'only serial':>12} {'only batch':>11}")
+for batch_factor in [1, 1.5, 2, 4, 8]:
+    batch = deepcopy(ins)
+    start = time.perf_counter()
+    mf.apply_match_test(batch, batch_factor=batch_factor)
+    t_batch = time.perf_counter() - start
+    batch_mask = batch.metric_array.mask
+    only_serial = np.count_nonzero(serial_mask & np.logical_not(batch_mask))
+    only_batch = np.count_nonzero(batch_mask & np.logical_not(serial_mask))
+    print(f"{batch_factor:>6} {t_batch:>9.2f} {t_serial / t_batch:>8.1f} {len(batch.match_events):>7} "
+          f"{np.count_nonzero(batch_mask):>8} {only_serial:>12} {only_batch:>11}")
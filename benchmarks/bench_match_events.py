@@ -0,0 +1,43 @@
+"""
+Benchmarks writing and reading match events as yml against the h5 table
+written with output_type='match_events_h5'.
+"""
+import argparse
+import numpy as np
+import os
+import tempfile
+from common import make_ins, timeit
+from SSINS.match_filter import Event
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-e', '--Nevents', type=int, default=100000,
+                    help='The number of events')
+parser.add_argument('-s', '--Nshapes', type=int, default=50,
+                    help='The number of distinct shape names')
+parser.add_argument('-r', '--repeats', type=int, default=3,
+                    help='The number of times to repeat each measurement')
+args = parser.parse_args()
+
+ins = make_ins(Nants=4, Ntimes=20, Nfreqs=64)
+rng = np.random.default_rng(0)
+t_starts = rng.integers(0, 10000, args.Nevents)
+f_starts = rng.integers(0, 768, args.Nevents)
+shapes = [f"narrow_{170 + 0.04 * ind:.3f}MHz" for ind in range(args.Nshapes)]
+sigs = rng.uniform(5, 50, args.Nevents)
+ins.match_events = [Event(slice(int(t), int(t) + 1), slice(int(f), int(f) + 1),
+                          shapes[ind % args.Nshapes], None if ind % 10 == 0 else float(sig))
+                    for ind, (t, f, sig) in enumerate(zip(t_starts, f_starts, sigs))]
+
+with tempfile.TemporaryDirectory() as tmpdir:
+    prefix = os.path.join(tmpdir, 'bench')
+    print(f"{'format':>6} {'write (s)':>10} {'read (s)':>9} {'size (MB)':>10}")
+    for label, output_type in [('yml', 'match_events'), ('h5', 'match_events_h5')]:
+        filename = f'{prefix}_SSINS_match_events.{label}'
+        t_write = timeit(ins.write, prefix, output_type=output_type, clobber=True,
+                         repeat=args.repeats)
+        t_read = timeit(ins.match_events_read, filename, repeat=args.repeats)
+        assert ins.match_events_read(filename) == ins.match_events
+        print(f"{label:>6} {t_write:>10.3f} {t_read:>9.3f} {os.path.getsize(filename) / 2**20:>10.2f}")
+    t_array = timeit(ins.match_events_read, filename, as_array=True, repeat=args.repeats)
+    print(f"h5 read as a structured array: {t_array:.4f} s")
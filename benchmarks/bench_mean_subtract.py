@@ -0,0 +1,55 @@
+"""
+Benchmarks INS.mean_subtract for polynomial orders 1-4 against the
+channel-by-channel np.ma.polyfit loop it replaced, and reports the largest
+difference in the coefficients and z-scores.
+"""
+import argparse
+import numpy as np
+from common import make_ins, timeit
+
+
+def loop_mean_subtract(ins):
+    """The original per-channel, per-pol implementation, for reference."""
+    C = 4 / np.pi - 1
+    MS = np.zeros_like(ins.metric_array)
+    coeffs = np.zeros((ins.order + 1, ) + MS.shape[1:])
+    x = np.arange(1, ins.metric_array.shape[0] + 1)
+    good_chans = np.where(np.logical_not(np.all(ins.metric_array.mask, axis=0)))[0]
+    for chan in good_chans:
+        for pol_ind in range(ins.Npols):
+            y = ins.metric_array[:, chan, pol_ind]
+            w = ins.weights_array[:, chan, pol_ind]
+            w_sq = ins.weights_square_array[:, chan, pol_ind]
+            coeff = np.ma.polyfit(x, y, ins.order, w=w)
+            coeffs[:, chan, pol_ind] = coeff
+            mu = np.sum([coeff[poly_ind] * x**(ins.order - poly_ind)
+                         for poly_ind in range(ins.order + 1)],
+                        axis=0)
+            weights_factor = w / np.sqrt(C * w_sq)
+            MS[:, chan, pol_ind] = (y / mu - 1) * weights_factor
+    return(MS, coeffs)
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-a', '--Nants', type=int, default=16,
+                    help='The number of antennas')
+parser.add_argument('-t', '--Ntimes', type=int, default=56,
+                    help='The number of integrations')
+parser.add_argument('-f', '--Nfreqs', type=int, default=768,
+                    help='The number of frequency channels')
+parser.add_argument('-p', '--Npols', type=int, default=4,
+                    help='The number of polarizations')
+args = parser.parse_args()
+
+print(f"{'order':>5} {'loop (s)':>10} {'batched (s)':>12} {'speedup':>8} {'max coeff rel diff':>19} {'max z diff':>11}")
+for order in range(1, 5):
+    ins = make_ins(Nants=args.Nants, Ntimes=args.Ntimes, Nfreqs=args.Nfreqs,
+                   Npols=args.Npols, order=order)
+    loop_MS, loop_coeffs = loop_mean_subtract(ins)
+    MS, coeffs = ins.mean_subtract(return_coeffs=True)
+    coeff_diff = np.max(np.abs(coeffs - loop_coeffs) / np.abs(loop_coeffs))
+    z_diff = np.max(np.abs(MS - loop_MS))
+
+    t_loop = timeit(loop_mean_subtract, ins, repeat=1)
+    t_batch = timeit(ins.mean_subtract)
+    print(f"{order:>5} {t_loop:>10.3f} {t_batch:>12.4f} {t_loop / t_batch:>8.1f} {coeff_diff:>19.2e} {z_diff:>11.2e}")
@@ -0,0 +1,91 @@
+"""
+Benchmarks differencing and INS construction in double precision (complex128
+visibilities, float64 amplitudes and weights) against single precision
+(complex64 visibilities, dtype=np.float32 in INS), and reports how much the
+spectra and z-scores differ. Also times the INS reduction on its own,
+which is all that the dtype keyword of INS affects.
+"""
+import argparse
+import numpy as np
+import time
+import tracemalloc
+import warnings
+from copy import deepcopy
+from common import make_ss, timeit
+from SSINS import INS
+
+
+def diff_and_reduce(ss, dtype, chunk_size):
+    """Differences ss in place and makes an INS from it."""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        ss.diff()
+        ss.apply_flags(flag_choice='original')
+        ins = INS(ss, dtype=dtype, chunk_size=chunk_size)
+    return(ins)
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-a', '--Nants', type=int, default=48,
+                    help='The number of antennas')
+parser.add_argument('-t', '--Ntimes', type=int, default=20,
+                    help='The number of integrations')
+parser.add_argument('-f', '--Nfreqs', type=int, default=384,
+                    help='The number of frequency channels')
+parser.add_argument('-p', '--Npols', type=int, default=2,
+                    help='The number of polarizations')
+parser.add_argument('-c', '--chunk_size', type=int, default=1000,
+                    help='The number of blts for INS to reduce at a time')
+args = parser.parse_args()
+
+ss = make_ss(Nants=args.Nants, Ntimes=args.Ntimes, Nfreqs=args.Nfreqs, Npols=args.Npols)
+# Already baseline ordered, so skip the reorder in SS.diff
+ss.blt_order = 'baseline'
+
+results = {}
+for name, data_dtype, dtype in [('double', np.complex128, np.float64),
+                                ('single', np.complex64, np.float32)]:
+    ss_copy = deepcopy(ss)
+    ss_copy.data_array = ss_copy.data_array.astype(data_dtype)
+    best = np.inf
+    for _ in range(3):
+        ss_run = deepcopy(ss_copy)
+        start = time.perf_counter()
+        ins = diff_and_reduce(ss_run, dtype, args.chunk_size)
+        best = min(best, time.perf_counter() - start)
+    ss_run = deepcopy(ss_copy)
+    tracemalloc.start()
+    diff_and_reduce(ss_run, dtype, args.chunk_size)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results[name] = (ins, best, peak, ss_copy.data_array.nbytes)
+
+Nvis = ss.Nblts * ss.Nfreqs * ss.Npols
+print(f"{'precision':>9} {'time (s)':>9} {'Mvis/s':>8} {'peak (MB)':>10} {'data (MB)':>10}")
+for name, (ins, best, peak, nbytes) in results.items():
+    print(f"{name:>9} {best:>9.3f} {Nvis / best / 1e6:>8.1f} {peak / 2**20:>10.1f} {nbytes / 2**20:>10.1f}")
+
+ins_double, ins_single = results['double'][0], results['single'][0]
+print(f"throughput gain: {results['double'][1] / results['single'][1]:.2f}x")
+print(f"max relative metric difference: {np.max(np.abs(ins_single.metric_array / ins_double.metric_array - 1)):.2e}")
+print(f"max z-score difference: {np.max(np.abs(ins_single.metric_ms - ins_double.metric_ms)):.2e}")
+print(f"masks equal: {np.array_equal(ins_single.metric_array.mask, ins_double.metric_array.mask)}")
+
+# dtype only sets the precision of the reduction in INS, not of the
+# differencing, so also time the reduction of the same differenced
+# visibilities on its own
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore")
+    ss.diff()
+    ss.apply_flags(flag_choice='original')
+print(f"\nINS reduction only, {ss.data_array.dtype} visibilities")
+print(f"{'dtype':>9} {'time (s)':>9} {'Mvis/s':>8} {'peak (MB)':>10}")
+for dtype in [np.float64, np.float32]:
+    best = timeit(INS, ss, dtype=dtype, chunk_size=args.chunk_size)
+    tracemalloc.start()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        INS(ss, dtype=dtype, chunk_size=args.chunk_size)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{np.dtype(dtype).name:>9} {best:>9.3f} {Nvis / best / 1e6:>8.1f} {peak / 2**20:>10.1f}")
@@ -0,0 +1,111 @@
+"""
+Helpers shared by the benchmark scripts in this directory. The benchmarks are
+not part of the test suite. Run them directly, e.g. python benchmarks/bench_diff.py
+"""
+import numpy as np
+import time
+import warnings
+from SSINS import SS, INS
+
+
+def make_ss(Nants=16, Ntimes=20, Nfreqs=384, Npols=1, seed=0):
+    """
+    Makes a synthetic, undifferenced SS object with a regular baseline-ordered
+    blt axis. The visibilities are complex gaussian noise, so that SS.diff(),
+    INS() and MF() all have something sensible to work on.
+
+    Args:
+        Nants: The number of antennas. All cross-correlations are included.
+        Ntimes: The number of integrations
+        Nfreqs: The number of frequency channels
+        Npols: The number of polarizations (at most 4)
+        seed: Seed for the random number generator
+
+    Returns:
+        ss: The synthetic SS object
+    """
+    rng = np.random.default_rng(seed)
+    ant_1, ant_2 = np.triu_indices(Nants, 1)
+    Nbls = len(ant_1)
+
+    ss = SS()
+    ss.Nants_data = Nants
+    ss.Nants_telescope = Nants
+    ss.Nbls = Nbls
+    ss.Ntimes = Ntimes
+    ss.Nblts = Nbls * Ntimes
+    ss.Nfreqs = Nfreqs
+    ss.Npols = Npols
+    ss.Nspws = 1
+    ss.antenna_numbers = np.arange(Nants)
+    ss.antenna_names = ['Tile%03d' % ant for ant in range(Nants)]
+    ss.antenna_positions = rng.normal(scale=100, size=(Nants, 3))
+    ss.telescope_name = 'SYNTH'
+    ss.instrument = 'SYNTH'
+    # The MWA site
+    ss.telescope_location = np.array([-2559454.08, 5095372.14, -2849057.18])
+    ss.ant_1_array = np.repeat(ant_1, Ntimes)
+    ss.ant_2_array = np.repeat(ant_2, Ntimes)
+    ss.baseline_array = ss.antnums_to_baseline(ss.ant_1_array, ss.ant_2_array)
+    ss.time_array = np.tile(2459000.5 + np.arange(Ntimes) * 2. / 86400, Nbls)
+    ss.lst_array = np.zeros(ss.Nblts)
+    ss.integration_time = np.full(ss.Nblts, 2.)
+    ss.uvw_array = rng.normal(scale=100, size=(ss.Nblts, 3))
+    ss.spw_array = np.array([0])
+    ss.freq_array = (1.67e8 + 8e4 * np.arange(Nfreqs))[np.newaxis]
+    ss.channel_width = 8e4
+    ss.polarization_array = np.array([-5, -6, -7, -8][:Npols])
+    ss.vis_units = 'UNCALIB'
+    ss.history = ''
+    ss.object_name = 'synthetic'
+    ss.phase_type = 'drift'
+    ss.blt_order = ('baseline', 'time')
+
+    shape = (ss.Nblts, 1, Nfreqs, Npols)
+    ss.data_array = (rng.normal(size=shape) + 1j * rng.normal(size=shape)).astype(np.complex64)
+    ss.flag_array = rng.random(shape) < 0.01
+    ss.nsample_array = np.ones(shape, dtype=np.float32)
+
+    return(ss)
+
+
+def make_ins(Nants=16, Ntimes=20, Nfreqs=384, Npols=1, seed=0, order=0):
+    """
+    Makes an INS from a differenced synthetic SS object. See make_ss for the
+    arguments. order is passed to INS.
+
+    Returns:
+        ins: The INS
+    """
+    ss = make_ss(Nants=Nants, Ntimes=Ntimes, Nfreqs=Nfreqs, Npols=Npols, seed=seed)
+    # Already baseline ordered, so skip the reorder in SS.diff
+    ss.blt_order = 'baseline'
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        ss.diff()
+        ss.apply_flags(flag_choice='original')
+        ins = INS(ss, order=order)
+    return(ins)
+
+
+def timeit(func, *args, repeat=3, **kwargs):
+    """
+    Times a function call, taking the best of several repeats.
+
+    Args:
+        func: The function to call
+        args: Positional arguments for func
+        repeat: The number of times to call func
+        kwargs: Keyword arguments for func
+
+    Returns:
+        best: The shortest wall time over the repeats, in seconds
+    """
+    best = np.inf
+    for _ in range(repeat):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            start = time.perf_counter()
+            func(*args, **kwargs)
+            best = min(best, time.perf_counter() - start)
+    return(best)
@@ -4,6 +4,8 @@ from pyuvdata import UVData, UVFlag
 import yaml
 import argparse
 from astropy.io import fits
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from astropy.time import Time
 import numpy as np
 
@@ -49,7 +51,17 @@ def find_gpubox_file_starts_ends(gpu_files):
     return times
 
 
-def low_mem_setup(uvd_type, uvf_type, gpu_files, metafits_file, **kwargs):
+def read_box_group(uvd_type, uvf_type, box_files, jd_time_array, kwargs):
+    """Reads one group of gpubox files and reduces it. Module level so that it
+    can be run in worker processes."""
+    print(f"box files for this group are {box_files}")
+    uvd_obj = uvd_type()
+    uvd_obj.read(box_files, times=jd_time_array, **kwargs)
+    return(uvf_type(uvd_obj))
+
+
+def low_mem_setup(uvd_type, uvf_type, gpu_files, metafits_file, num_workers=1,
+                  **kwargs):
     times = find_gpubox_file_starts_ends(gpu_files)
     chan_list = [str(chan).zfill(2) for chan in range(1, 25)]
 
@@ -78,92 +90,101 @@ def low_mem_setup(uvd_type, uvf_type, gpu_files, metafits_file, **kwargs):
                            int_time)
     jd_time_array = Time(time_array, format="unix", scale="utc").jd.astype(float)
 
-    print(f"init box files are {init_files}")
-    uvd_obj = uvd_type()
-    uvd_obj.read(init_files + metafits_file, times=jd_time_array, **kwargs)
-    uvf_obj = uvf_type(uvd_obj)
-
+    group_files = [init_files + metafits_file]
     for chan_group in range(1, 8):
         box_files = []
         for chan in chan_list[3 * chan_group: 3 * (chan_group + 1)]:
             box_files += [path for path in gpu_files if f"gpubox{chan}" in path]
-
-        print(f"box files for this iteration are {box_files}")
-        uvd_obj = uvd_type()
-        uvd_obj.read(box_files + metafits_file, times=jd_time_array, **kwargs)
-        uvf_obj = uvf_type(uvd_obj).__add__(uvf_obj, axis="frequency", inplace=False)
-        assert np.all(uvf_obj.freq_array[1:] > uvf_obj.freq_array[:-1]), "Frequencies are out of order for uvf object."
-        print(f"INS nfreqs is {uvf_obj.Nfreqs}")
+        group_files.append(box_files + metafits_file)
+
+    # Each group of boxes is read and reduced independently
+    group_func = partial(read_box_group, uvd_type, uvf_type,
+                         jd_time_array=jd_time_array, kwargs=kwargs)
+    if num_workers > 1:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            group_uvfs = list(executor.map(group_func, group_files))
+    else:
+        group_uvfs = map(group_func, group_files)
+
+    # Each group goes in front of the ones before it in frequency
+    uvf_obj = uvf_type.concatenate(list(group_uvfs)[::-1], axis="frequency")
+    assert np.all(uvf_obj.freq_array[1:] > uvf_obj.freq_array[:-1]), "Frequencies are out of order for uvf object."
+    print(f"INS nfreqs is {uvf_obj.Nfreqs}")
 
     return(uvf_obj, jd_time_array)
 
 
-parser = argparse.ArgumentParser()
-parser.add_argument('-f', '--filelist', nargs='*',
-                    help='List of gpubox, metafits, and mwaf files.')
-parser.add_argument('-d', '--outdir',
-                    help='The output directory of the output files, including new mwaf files if applicable')
-parser.add_argument('-o', '--obsid',
-                    help='The obsid of the files.')
-parser.add_argument('-r', '--rfi_flag', action='store_true',
-                    help='Do rfi flagging.')
-parser.add_argument('-m', '--write_mwaf', action='store_true',
-                    help='If RFI flagging is requested, also write out an mwaf file')
-parser.add_argument('-s', '--start_flag', type=float, default=2.0,
-                    help='The number of seconds to flag at the beginning of the obs.')
-parser.add_argument('-e', '--end_flag', type=float, default=2.0,
-                    help='The number of seconds to flag at the end of the obs.')
-parser.add_argument('-p', '--plot', action='store_true',
-                    help='Plot the INS object')
-args = parser.parse_args()
-
-gpu_files = [path for path in args.filelist if ".fits" in path]
-mwaf_files = [path for path in args.filelist if ".mwaf" in path]
-metafits_file = [path for path in args.filelist if ".metafits" in path]
-
-ins, jd_times = low_mem_setup(SS, INS, gpu_files, metafits_file,
-                              correct_cable_len=True, phase_to_pointing_center=True,
-                              ant_str='cross', diff=True, flag_choice='original',
-                              flag_init=True, )
-prefix = f"{args.outdir}/{args.obsid}"
-ins.write(prefix, clobber=True)
-
-if args.plot:
-    cp.INS_plot(ins, prefix, file_ext='pdf')
-
-if args.rfi_flag:
-
-    uvd = UVData()
-    uvd.read(gpu_files + metafits_file, correct_cable_len=True,
-             phase_to_pointing_center=True, ant_str='cross', read_data=False,
-             flag_init=True, times=jd_times)
-    uvf = UVFlag(uvd, waterfall=True, mode='flag')
-
-    num_init_flag = np.sum(ins.metric_array.mask)
-    int_time = uvd.integration_time[0]
-    print(f"Using int_time {int_time}")
-    num_int_flag = (args.start_flag + args.end_flag) / int_time
-
-    with open(f"{DATA_PATH}/MWA_EoR_Highband_shape_dict.yml", "r") as shape_file:
-        shape_dict = yaml.safe_load(shape_file)
-    sig_thresh = {shape: 5 for shape in shape_dict}
-    sig_thresh["narrow"] = 5
-    sig_thresh["streak"] = 10
-    print(f"Flagging these shapes: {shape_dict}")
-
-    mf = MF(ins.freq_array, sig_thresh, shape_dict=shape_dict, tb_aggro=0.4)
-    mf.apply_match_test(ins, time_broadcast=True)
-
-    occ_dict = util.calc_occ(ins, mf, num_init_flag, num_int_flag=num_int_flag,
-                             lump_narrowband=True)
-    with open(f"{prefix}_occ.yml", "w") as occ_file:
-        yaml.safe_dump(occ_dict, occ_file)
-
-    ins.write(prefix, output_type='mask', clobber=True)
-    print(ins.Nfreqs)
-    print(uvf.Nfreqs)
-    ins.write(prefix, output_type='flags', uvf=uvf, clobber=True)
-    ins.write(prefix, output_type='match_events', clobber=True)
-    if args.write_mwaf:
-        ins.write(prefix, output_type='mwaf', metafits_file=metafits_file,
-                  mwaf_files=mwaf_files, Ncoarse=len(gpu_files))
+# Guarded so that worker processes can import this module safely
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--filelist', nargs='*',
+                        help='List of gpubox, metafits, and mwaf files.')
+    parser.add_argument('-d', '--outdir',
+                        help='The output directory of the output files, including new mwaf files if applicable')
+    parser.add_argument('-o', '--obsid',
+                        help='The obsid of the files.')
+    parser.add_argument('-r', '--rfi_flag', action='store_true',
+                        help='Do rfi flagging.')
+    parser.add_argument('-m', '--write_mwaf', action='store_true',
+                        help='If RFI flagging is requested, also write out an mwaf file')
+    parser.add_argument('-s', '--start_flag', type=float, default=2.0,
+                        help='The number of seconds to flag at the beginning of the obs.')
+    parser.add_argument('-e', '--end_flag', type=float, default=2.0,
+                        help='The number of seconds to flag at the end of the obs.')
+    parser.add_argument('-p', '--plot', action='store_true',
+                        help='Plot the INS object')
+    parser.add_argument('-n', '--num_workers', type=int, default=1,
+                        help='The number of processes to read the gpubox groups with.')
+    args = parser.parse_args()
+
+    gpu_files = [path for path in args.filelist if ".fits" in path]
+    mwaf_files = [path for path in args.filelist if ".mwaf" in path]
+    metafits_file = [path for path in args.filelist if ".metafits" in path]
+
+    ins, jd_times = low_mem_setup(SS, INS, gpu_files, metafits_file,
+                                  num_workers=args.num_workers,
+                                  correct_cable_len=True, phase_to_pointing_center=True,
+                                  ant_str='cross', diff=True, flag_choice='original',
+                                  flag_init=True, )
+    prefix = f"{args.outdir}/{args.obsid}"
+    ins.write(prefix, clobber=True)
+
+    if args.plot:
+        cp.INS_plot(ins, prefix, file_ext='pdf')
+
+    if args.rfi_flag:
+
+        uvd = UVData()
+        uvd.read(gpu_files + metafits_file, correct_cable_len=True,
+                 phase_to_pointing_center=True, ant_str='cross', read_data=False,
+                 flag_init=True, times=jd_times)
+        uvf = UVFlag(uvd, waterfall=True, mode='flag')
+
+        num_init_flag = np.sum(ins.metric_array.mask)
+        int_time = uvd.integration_time[0]
+        print(f"Using int_time {int_time}")
+        num_int_flag = (args.start_flag + args.end_flag) / int_time
+
+        with open(f"{DATA_PATH}/MWA_EoR_Highband_shape_dict.yml", "r") as shape_file:
+            shape_dict = yaml.safe_load(shape_file)
+        sig_thresh = {shape: 5 for shape in shape_dict}
+        sig_thresh["narrow"] = 5
+        sig_thresh["streak"] = 10
+        print(f"Flagging these shapes: {shape_dict}")
+
+        mf = MF(ins.freq_array, sig_thresh, shape_dict=shape_dict, tb_aggro=0.4)
+        mf.apply_match_test(ins, time_broadcast=True)
+
+        occ_dict = util.calc_occ(ins, mf, num_init_flag, num_int_flag=num_int_flag,
+                                 lump_narrowband=True)
+        with open(f"{prefix}_occ.yml", "w") as occ_file:
+            yaml.safe_dump(occ_dict, occ_file)
+
+        ins.write(prefix, output_type='mask', clobber=True)
+        print(ins.Nfreqs)
+        print(uvf.Nfreqs)
+        ins.write(prefix, output_type='flags', uvf=uvf, clobber=True)
+        ins.write(prefix, output_type='match_events', clobber=True)
+        if args.write_mwaf:
+            ins.write(prefix, output_type='mwaf', metafits_file=metafits_file,
+                      mwaf_files=mwaf_files, Ncoarse=len(gpu_files))
@@ -1,89 +1,78 @@
 #! /usr/bin/env python
 
-from SSINS import SS, INS, version, MF, util
+from SSINS import INS, version, MF
 from SSINS.data import DATA_PATH
-from functools import reduce
 import numpy as np
 import argparse
 from pyuvdata import UVData, UVFlag
 import yaml
 
-parser = argparse.ArgumentParser()
-parser.add_argument("-f", "--filename", nargs='*',
-                    help="The visibility file(s) to process")
-parser.add_argument("-s", "--streak_sig", type=float,
-                    help="The desired streak significance threshold")
-parser.add_argument("-o", "--other_sig", type=float,
-                    help="The desired significance threshold for other shapes")
-parser.add_argument("-p", "--prefix",
-                    help="The prefix for output files")
-parser.add_argument("-t", "--tb_aggro", type=float,
-                    help="The tb_aggro parameter for the match filter.")
-parser.add_argument("-c", "--clobber", action='store_true',
-                    help="Whether to overwrite files that have already been written")
-parser.add_argument("-x", "--no_diff", action='store_false',
-                    help="Flag to turn off differencing. Use if files are already time-differenced.")
-parser.add_argument("-N", "--num_baselines", type=int, default=0,
-                    help="The number of baselines to read in at a time")
-args = parser.parse_args()
+# Guarded so that worker processes can import this module safely
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", "--filename", nargs='*',
+                        help="The visibility file(s) to process")
+    parser.add_argument("-s", "--streak_sig", type=float,
+                        help="The desired streak significance threshold")
+    parser.add_argument("-o", "--other_sig", type=float,
+                        help="The desired significance threshold for other shapes")
+    parser.add_argument("-p", "--prefix",
+                        help="The prefix for output files")
+    parser.add_argument("-t", "--tb_aggro", type=float,
+                        help="The tb_aggro parameter for the match filter.")
+    parser.add_argument("-c", "--clobber", action='store_true',
+                        help="Whether to overwrite files that have already been written")
+    parser.add_argument("-x", "--no_diff", action='store_false',
+                        help="Flag to turn off differencing. Use if files are already time-differenced.")
+    parser.add_argument("-N", "--num_baselines", type=int, default=0,
+                        help="The number of baselines to read in at a time")
+    parser.add_argument("-j", "--num_workers", type=int, default=1,
+                        help="The number of processes to read baseline chunks with")
+    args = parser.parse_args()
 
-version_info_list = [f'{key}: {version.version_info[key]}, ' for key in version.version_info]
-version_hist_substr = reduce(lambda x, y: x + y, version_info_list)
+    version_hist_substr = version.get_version_str()
 
-# Make the uvflag object for storing flags later, and grab bls for partial I/O
-uvd = UVData()
-uvd.read(args.filename, read_data=False)
-bls = uvd.get_antpairs()
-uvf = UVFlag(uvd, waterfall=True, mode='flag')
-del uvd
+    # Make the uvflag object for storing flags later
+    uvd = UVData()
+    uvd.read(args.filename, read_data=False)
+    uvf = UVFlag(uvd, waterfall=True, mode='flag')
+    del uvd
 
-# Make the SS object
-ss = SS()
-if args.num_baselines > 0:
-    ss.read(args.filename, bls=bls[:args.num_baselines],
-            diff=args.no_diff)
-    ins = INS(ss)
-    Nbls = len(bls)
-    for slice_ind in range(args.num_baselines, Nbls, args.num_baselines):
-        ss = SS()
-        ss.read(args.filename, bls=bls[slice_ind:slice_ind + args.num_baselines],
-                diff=args.no_diff)
-        new_ins = INS(ss)
-        ins = util.combine_ins(ins, new_ins)
-else:
-    ss.read(args.filename, ant_str='cross', diff=args.no_diff)
-    ins = INS(ss)
+    # Make the INS, reading num_baselines baselines at a time if requested
+    if args.num_baselines > 0:
+        chunk_bls = args.num_baselines
+    else:
+        chunk_bls = None
+    ins = INS.from_files(args.filename, chunk_bls=chunk_bls, diff=args.no_diff,
+                         num_workers=args.num_workers)
 
-# Clear some memory??
-del ss
+    # Write the raw data and z-scores to h5 format
+    ins.write(args.prefix, sep='.', clobber=args.clobber)
+    ins.write(args.prefix, output_type='z_score', sep='.', clobber=args.clobber)
 
-# Write the raw data and z-scores to h5 format
-ins.write(args.prefix, sep='.', clobber=args.clobber)
-ins.write(args.prefix, output_type='z_score', sep='.', clobber=args.clobber)
+    # Flag FM radio
+    where_FM = np.where(np.logical_and(ins.freq_array > 87.5e6, ins.freq_array < 108e6))
+    ins.metric_array[:, where_FM] = np.ma.masked
+    ins.metric_ms = ins.mean_subtract()
+    ins.history += "Manually flagged the FM band. "
 
-# Flag FM radio
-where_FM = np.where(np.logical_and(ins.freq_array > 87.5e6, ins.freq_array < 108e6))
-ins.metric_array[:, where_FM] = np.ma.masked
-ins.metric_ms = ins.mean_subtract()
-ins.history += "Manually flagged the FM band. "
+    # Make a filter with specified settings
+    with open(f"{DATA_PATH}/HERA_shape_dict.yml", 'r') as shape_file:
+        shape_dict = yaml.safe_load(shape_file)
 
-# Make a filter with specified settings
-with open(f"{DATA_PATH}/HERA_shape_dict.yml", 'r') as shape_file:
-    shape_dict = yaml.safe_load(shape_file)
+    sig_thresh = {shape: args.other_sig for shape in shape_dict}
+    sig_thresh['narrow'] = args.other_sig
+    sig_thresh['streak'] = args.streak_sig
+    mf = MF(ins.freq_array, sig_thresh, shape_dict=shape_dict, tb_aggro=args.tb_aggro)
 
-sig_thresh = {shape: args.other_sig for shape in shape_dict}
-sig_thresh['narrow'] = args.other_sig
-sig_thresh['streak'] = args.streak_sig
-mf = MF(ins.freq_array, sig_thresh, shape_dict=shape_dict, tb_aggro=args.tb_aggro)
+    # Do flagging
+    mf.apply_match_test(ins, time_broadcast=True)
+    ins.history += f"Flagged using apply_match_test on SSINS {version_hist_substr}."
 
-# Do flagging
-mf.apply_match_test(ins, time_broadcast=True)
-ins.history += f"Flagged using apply_match_test on SSINS {version_hist_substr}."
-
-# Write outputs
-ins.write(args.prefix, output_type='mask', sep='.', clobber=args.clobber)
-uvf.history += ins.history
-# "flags" are not helpful if no differencing was done
-if args.no_diff:
-    ins.write(args.prefix, output_type='flags', sep='.', uvf=uvf, clobber=args.clobber)
-ins.write(args.prefix, output_type='match_events', sep='.', clobber=args.clobber)
+    # Write outputs
+    ins.write(args.prefix, output_type='mask', sep='.', clobber=args.clobber)
+    uvf.history += ins.history
+    # "flags" are not helpful if no differencing was done
+    if args.no_diff:
+        ins.write(args.prefix, output_type='flags', sep='.', uvf=uvf, clobber=args.clobber)
+    ins.write(args.prefix, output_type='match_events', sep='.', clobber=args.clobber)
@@ -35,8 +35,14 @@ def dict_list_to_csv(dict_list, outpath, fieldnames):
 #main execution body
 def row_routine(obs):
     obsid = obs['obsid']
-    ins = INS(obs['ins_file'], mask_file=obs['mask_file'],
-              match_events_file=obs['yml_file'])
+    # A bundle holds the data, mask, and events in one file
+    if obs.get('bundle_file'):
+        ins_file = obs['bundle_file']
+        ins = INS(ins_file)
+    else:
+        ins_file = obs['ins_file']
+        ins = INS(ins_file, mask_file=obs['mask_file'],
+                  match_events_file=obs['yml_file'])
     # if enabled, do fine channel/ time ignore for parts of the data
     if fine_channels_ignore is not None:
         freq_chans = np.arange(len(ins.freq_array))
@@ -55,15 +61,15 @@ def row_routine(obs):
             for shape in inputargs.shapes:
                 obs_occ_dict[shape] = len([event for event in ins.match_events if event[2] == shape]) / ins.metric_array.shape[0]
         occ_dict_list.append(obs_occ_dict)
-        print("+ accepted "+obs['ins_file']) #prints + accepted or - rejected on left side of conout
+        print("+ accepted "+ins_file) #prints + accepted or - rejected on left side of conout
     else:
-        print("- rejected "+obs['ins_file'])
+        print("- rejected "+ins_file)
 
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument('-s', '--shapes', nargs='*', help='The shapes to calculate occupancies for (pass as `-c SHAPE SHAPE SHAPE... <other inputargs>`')
-    parser.add_argument('-c', '--csv', help='A csv whose columns are obsids, ins data files, ins masks, and yml files')
+    parser.add_argument('-c', '--csv', help='A csv whose columns are obsids, ins data files, ins masks, and yml files, or obsids and ins bundle files')
     parser.add_argument('-o', '--outfile', help='The name of the output csv that contains occupancy information (use absolute path)')
     parser.add_argument('-i', '--ch_ignore', help='A text file of fine frequency channels to ignore in occupancy calculation')
     parser.add_argument('-t', '--time_ignore', help='Times to ignore when calculating occupancy')
@@ -6,8 +6,10 @@ import json
 
 from SSINS import version
 
-# Make a GIT_INFO file on install
-data = [version.git_origin, version.git_hash, version.git_description, version.git_branch]
+# Make a GIT_INFO file on install. Run git rather than reading an old GIT_INFO.
+version_info = version.construct_version_info()
+data = [version_info['git_origin'], version_info['git_hash'],
+        version_info['git_description'], version_info['git_branch']]
 with open(os.path.join('SSINS', 'GIT_INFO'), 'w') as outfile:
     json.dump(data, outfile)
 
@@ -40,6 +42,7 @@ setup_args = {
                 'scripts/MWA_vis_to_SSINS.py', 'scripts/occ_csv.py'],
     'version': version.version,
     'package_data': {'SSINS': data_files},
+    'python_requires': '>=3.7',
     'install_requires': ['pyuvdata', 'h5py', 'pyyaml'],
     'zip_safe': False,
 }